@@ -0,0 +1,629 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the insurance data viewer. Run with the name of a benchmark, for example:
+
+    python benchmark.py connection --rows 100000 --queries 500
+
+The suite runs the main benchmarks on synthetic data and writes the results as JSON, which compare checks against an
+earlier run to catch regressions:
+
+    python benchmark.py suite --rows 10000,100000 --output before.json
+    python benchmark.py compare before.json after.json
+"""
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from database import COLUMN_NAMES, ROLLUP_FIELDS, Database
+from synthetic import synthetic_rows, write_workbook
+
+# The modules the command line should never load for a simple query
+HEAVY_MODULES = ("tkinter", "openpyxl", "numpy")
+# How much slower a result has to be before compare calls it a regression
+REGRESSION_THRESHOLD = 1.2
+
+
+class _HeadlessTreeview:
+    """
+    Stands in for a ttk.Treeview when there is no display, so the suite can still time VirtualTable's paging and row
+    formatting. Only the parts of the Treeview that VirtualTable uses are here.
+    """
+
+    def __init__(self, height):
+        self.height = height
+        self.items = {}
+        self._ids = itertools.count()
+
+    def cget(self, option):
+        return self.height
+
+    def bind(self, sequence, function):
+        pass
+
+    def get_children(self):
+        return tuple(self.items)
+
+    def selection(self):
+        return ()
+
+    def selection_remove(self, items):
+        pass
+
+    def item(self, item, text, values):
+        self.items[item] = (text, values)
+
+    def insert(self, parent, index, text, values):
+        item = f"I{next(self._ids)}"
+        self.items[item] = (text, values)
+        return item
+
+    def delete(self, *items):
+        for item in items:
+            del self.items[item]
+
+
+class _HeadlessScrollbar:
+    """
+    Stands in for a ttk.Scrollbar when there is no display
+    """
+
+    def configure(self, command):
+        pass
+
+    def set(self, first, last):
+        pass
+
+
+def _time_calls(function, calls):
+    """
+    Call a function repeatedly and collect how long each call took
+    :param function: The function to call with no arguments
+    :param calls: The number of times to call it
+    :return timings: A list of the time each call took in seconds
+    """
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _report(name, timings):
+    """
+    Print the median and 95th percentile of a list of timings in microseconds
+    :param name: The name to print next to the timings
+    :param timings: A list of timings in seconds
+    :return None:
+    """
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f'{name:<40} median {statistics.median(timings) * 1e6:10.1f} us    p95 {p95 * 1e6:10.1f} us')
+
+
+def bench_connection(rows, queries):
+    """
+    Compare the per-query latency of opening a new connection for every query, which is what Database used to do,
+    against Database's persistent, tuned connection
+    :param rows: The number of rows to put in the insurance table
+    :param queries: The number of queries to time for each approach
+    :return None:
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, "bench.db")
+        with Database(db_name) as database:
+            database.write_data(synthetic_rows(rows))
+
+            def connect_per_query():
+                conn = sqlite3.connect(db_name)
+                conn.execute("SELECT * FROM insurance WHERE state = ?", ("WI",)).fetchall()
+                conn.close()
+
+            def persistent():
+                database.read_filtered_data("state", "WI")
+
+            def connect_per_distinct():
+                conn = sqlite3.connect(db_name)
+                conn.execute("SELECT DISTINCT state FROM insurance").fetchall()
+                conn.close()
+
+            def persistent_distinct():
+                database.read_unique_data("state")
+
+            print(f'{rows} rows, {queries} queries each')
+            _report("filter, connect per query", _time_calls(connect_per_query, queries))
+            _report("filter, persistent", _time_calls(persistent, queries))
+            _report("distinct, connect per query", _time_calls(connect_per_distinct, queries))
+            _report("distinct, persistent", _time_calls(persistent_distinct, queries))
+
+
+def bench_columnar(row_counts, queries):
+    """
+    Compare the sqlite engine against the in-memory columnar engine on the queries the viewer issues. Caching is turned
+    off in both so every call does the full amount of work.
+    :param row_counts: A list of table sizes to run the comparison at
+    :param queries: The number of times to time each query
+    :return None:
+    """
+    # Imported here so the other benchmarks run without NumPy
+    from columnar import ColumnarDatabase
+
+    for rows in row_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            with Database(os.path.join(directory, "bench.db"), cache_bytes=0) as database:
+                database.write_data(synthetic_rows(rows))
+                start = time.perf_counter()
+                columnar = ColumnarDatabase(database, cache_bytes=0)
+                print(f'{rows} rows, {queries} queries each, columnar load took {time.perf_counter() - start:.2f}s')
+
+                for name, engine in (("sqlite", database), ("columnar", columnar)):
+                    _report(f"{name} distinct state", _time_calls(lambda: engine.read_unique_data("state"), queries))
+                    _report(f"{name} count + page", _time_calls(
+                        lambda: (engine.count_filtered_data("state", "WI"), engine.read_page("state", "WI")), queries))
+                    _report(f"{name} sorted page", _time_calls(
+                        lambda: engine.read_page("region", "East", order_by="insurance_value"), queries))
+                    _report(f"{name} filter all rows", _time_calls(
+                        lambda: engine.read_filtered_data("state", "WI"), queries))
+
+
+def bench_ingest(files, rows, process_counts):
+    """
+    Time importing a directory of workbooks with different numbers of worker processes. Parsing scales with the
+    processes until the single writer becomes the bottleneck.
+    :param files: The number of workbooks to import
+    :param rows: The number of rows in each workbook
+    :param process_counts: A list of the numbers of processes to try
+    :return None:
+    """
+    from ingest import ingest_workbooks
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Give every workbook its own policy numbers
+        for index in range(files):
+            write_workbook(os.path.join(directory, f"policies_{index:03}.xlsx"),
+                            synthetic_rows(rows, seed=index, first_policy=100000 + index * rows))
+        print(f'{files} workbooks of {rows} rows, {os.cpu_count()} CPUs')
+        for processes in process_counts:
+            db_name = os.path.join(directory, f"bench_{processes}.db")
+            with Database(db_name) as database:
+                start = time.perf_counter()
+                ingest_workbooks(database, directory, processes=processes)
+                elapsed = time.perf_counter() - start
+            print(f'{processes:>3} processes: {elapsed:.2f}s, {files * rows / elapsed:,.0f} rows/s')
+
+
+def bench_export(rows, formats):
+    """
+    Time exporting every row to each format and measure the most memory the export held at once, which should stay
+    the same no matter how many rows there are
+    :param rows: The number of rows to put in the insurance table
+    :param formats: A list of the formats to export to
+    :return None:
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        with Database(os.path.join(directory, "bench.db"), cache_bytes=0) as database:
+            database.write_data(synthetic_rows(rows))
+            print(f'{rows} rows')
+            for file_format in formats:
+                path = os.path.join(directory, f"export.{file_format}")
+                start = time.perf_counter()
+                database.export_data(path)
+                elapsed = time.perf_counter() - start
+                size = os.path.getsize(path)
+
+                # A second run to measure memory, tracemalloc slows everything down so it is not timed
+                tracemalloc.start()
+                database.export_data(path)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f'{file_format:<8} {elapsed:7.2f}s {rows / elapsed:12,.0f} rows/s {size / elapsed / 1e6:8.1f} MB/s '
+                      f'   peak memory {peak / 1e6:7.1f} MB')
+
+
+def bench_cold_start(rows, runs):
+    """
+    Time how long the command line takes to answer a simple query from a fresh interpreter, and check that it did
+    not load any of the modules only the viewer and the Excel import need
+    :param rows: The number of rows to put in the insurance table
+    :param runs: The number of times to run the command
+    :return None:
+    """
+    program = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    with tempfile.TemporaryDirectory() as directory:
+        db_name = os.path.join(directory, "bench.db")
+        with Database(db_name) as database:
+            database.write_data(synthetic_rows(rows))
+        command = [sys.executable, program, "--db", db_name, "query", "--field", "state", "--value", "WI", "--count"]
+
+        def query():
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        def bare_interpreter():
+            subprocess.run([sys.executable, "-c", "pass"], check=True)
+
+        def heavy_imports():
+            subprocess.run([sys.executable, "-c", f"import {', '.join(HEAVY_MODULES)}"], check=True)
+
+        # Run the command inside an interpreter that reports which of the heavy modules it ended up loading
+        check = (f"import sys; sys.argv = {command[1:]!r}; import runpy\n"
+                 f"try: runpy.run_path({program!r}, run_name='__main__')\n"
+                 f"except SystemExit: pass\n"
+                 f"print('loaded:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules), file=sys.stderr)")
+        output = subprocess.run([sys.executable, "-c", check], capture_output=True, text=True,
+                                cwd=os.path.dirname(program)).stderr
+        loaded = [line[len("loaded:"):] for line in output.splitlines() if line.startswith("loaded:")]
+
+        print(f'{rows} rows, {runs} runs each')
+        _report("bare interpreter", _time_calls(bare_interpreter, runs))
+        _report("import " + "/".join(HEAVY_MODULES), _time_calls(heavy_imports, runs))
+        _report("main.py query --count", _time_calls(query, runs))
+        print(f'heavy modules loaded by the query: {loaded[-1] if loaded and loaded[-1] else "none"}')
+
+
+def bench_memory(rows):
+    """
+    Measure how many bytes each row costs when every row is held as a tuple, which is what the viewer used to do,
+    against paging through the table and against the columnar engine's arrays before and after they are narrowed
+    :param rows: The number of rows to put in the insurance table
+    :return None:
+    """
+    # Imported here so the other benchmarks run without NumPy
+    import numpy as np
+    from columnar import CATEGORICAL_FIELDS, NUMERIC_FIELDS, ColumnarDatabase
+    from paging import PagedResult
+
+    def traced(function):
+        # Return what the function allocated and kept, so the result has to be held until the memory is read
+        tracemalloc.start()
+        result = function()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return result, size
+
+    with tempfile.TemporaryDirectory() as directory:
+        with Database(os.path.join(directory, "bench.db"), cache_bytes=0) as database:
+            database.write_data(synthetic_rows(rows))
+            print(f'{rows} rows')
+
+            # Every row as a tuple, a filtered copy of those tuples, and the tuples shown in the table
+            def tuples():
+                data = database.read_data()
+                filtered = [row for row in data if row[COLUMN_NAMES.index("state")] == "WI"]
+                shown = [tuple(str(value) for value in row) for row in filtered[:50]]
+                return data, filtered, shown
+            result, size = traced(tuples)
+            del result
+            print(f'{"row tuples":<40} {size / rows:8.1f} bytes/row')
+
+            def paged():
+                result = PagedResult(database, "state", "WI")
+                result[0:50]
+                return result
+            result, size = traced(paged)
+            del result
+            print(f'{"paged result":<40} {size / rows:8.1f} bytes/row')
+
+            columnar = ColumnarDatabase(database)
+            wide = sum(np.dtype("int32" if field in CATEGORICAL_FIELDS else NUMERIC_FIELDS[field]).itemsize
+                       for field in columnar.columns)
+            usage = columnar.memory_usage()
+            print(f'{"columnar, 32/64 bit columns":<40} {wide + usage["categories"] / rows:8.1f} bytes/row')
+            print(f'{"columnar, narrowed columns":<40} {(usage["columns"] + usage["categories"]) / rows:8.1f} bytes/row')
+            for field, column in columnar.columns.items():
+                print(f'    {field:<36} {column.dtype}')
+
+            view = columnar.view("state", "WI")
+            view[0:50]
+            print(f'{"columnar view":<40} {view.positions.nbytes / max(len(view), 1):8.1f} bytes/matching row')
+
+
+def check_paging(rows, page_size):
+    """
+    Check that paging through a result by continuation keys returns exactly the rows of the whole result, in order,
+    for every sort field in both directions. Some of the insured values, earthquakes, and floods are left blank the way
+    an empty Excel cell is, since NULLs in the sort column need their own handling. The rows go in through sync_data,
+    the way a workbook is imported, and are synced again with other cells blank, and the rollups the triggers kept up
+    to date have to match the ones rebuilt from scratch. When NumPy is installed the columnar engine is checked too, and
+    its filters and unique values on the blank fields have to agree with sqlite's.
+    :param rows: The number of rows to put in the insurance table
+    :param page_size: The number of rows in each page
+    :return failures: A list of (engine, field, value, order_by, descending) for every result that came back wrong
+    """
+    import columnar
+    from paging import PagedResult
+    from query_builder import Condition
+
+    def with_blanks(data, shift=0):
+        for index, row in enumerate(data):
+            row = list(row)
+            for column, every in ((6, 3), (9, 5), (10, 7)):
+                if (index + shift) % every == 0:
+                    row[column - 1] = None
+            yield tuple(row)
+
+    def unique_key(value):
+        return value is not None, value
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        with Database(os.path.join(directory, "bench.db"), cache_bytes=0) as database:
+            # Sync once to add the rows and again to update and delete some, so every rollup trigger runs
+            database.sync_data(with_blanks(synthetic_rows(rows + 10), shift=1))
+            database.sync_data(with_blanks(synthetic_rows(rows)))
+            rollups = {field: database.read_rollup(field) for field in ROLLUP_FIELDS}
+            database.rebuild_rollups()
+            for field in ROLLUP_FIELDS:
+                if database.read_rollup(field) != rollups[field]:
+                    failures.append(("sqlite", "rollup", field, None, None))
+            engines = [("sqlite", database)]
+            if columnar.np is not None:
+                engines.append(("columnar", columnar.ColumnarDatabase(database, cache_bytes=0)))
+            for name, engine in engines:
+                for field, value in (("*", None), ("region", "East")):
+                    for order_by in COLUMN_NAMES:
+                        column = COLUMN_NAMES.index(order_by)
+                        for descending in (False, True):
+                            # sqlite sorts NULLs before every value, ties are broken by insurance_id
+                            expected = sorted(database.read_filtered_data(field, value), reverse=descending,
+                                              key=lambda row: (row[column] is not None, row[column] or 0, row[0]))
+                            result = PagedResult(engine, field, value, order_by=order_by, descending=descending,
+                                                 page_size=page_size)
+                            if result[0:len(result)] != expected:
+                                failures.append((name, field, value, order_by, descending))
+                if engine is database:
+                    continue
+                # Every comparison with a blank is false in sqlite, even !=, and blanks are a unique value of their own
+                for order_by in ("insurance_value", "earthquake", "flood"):
+                    queries = [Condition(order_by, operator, 0) for operator in ("=", "!=", "<", ">=")]
+                    queries += [Condition(order_by, "BETWEEN", (0, 1)), Condition(order_by, "IN", (0, 1))]
+                    for query in queries:
+                        expected = sorted(database.read_filtered_data(query, None))
+                        if sorted(engine.read_filtered_data(query, None)) != expected:
+                            failures.append((name, query.to_dict(), None, None, None))
+                    expected = sorted(database.read_unique_data(order_by), key=unique_key)
+                    if engine.read_unique_data(order_by) != expected:
+                        failures.append((name, "unique", order_by, None, None))
+    print(f'{rows} rows in pages of {page_size}: {"ok" if not failures else f"{len(failures)} wrong results"}')
+    for failure in failures:
+        print("wrong: engine=%s field=%s value=%s order_by=%s descending=%s" % failure)
+    return failures
+
+
+def _summarize(name, rows, timings):
+    """
+    Print the median and 95th percentile of a list of timings and return them as a result for the JSON report
+    :param name: The name of the benchmark
+    :param rows: The number of rows in the table the benchmark ran against
+    :param timings: A list of timings in seconds
+    :return result: A dict of the timings in milliseconds
+    """
+    _report(f"{name} ({rows})", timings)
+    timings = sorted(timings)
+    return {"name": name, "rows": rows, "calls": len(timings), "median_ms": statistics.median(timings) * 1e3,
+            "p95_ms": timings[max(int(len(timings) * 0.95) - 1, 0)] * 1e3, "min_ms": timings[0] * 1e3}
+
+
+def _throughput(name, rows, function):
+    """
+    Time a function that processes every row once, print the rate, and return it as a result for the JSON report
+    :param name: The name of the benchmark
+    :param rows: The number of rows the function processes
+    :param function: The function to time, called with no arguments
+    :return result: A dict of the time taken and the rows per second
+    """
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    label = f"{name} ({rows})"
+    print(f'{label:<40} {seconds:10.2f} s    {rows / seconds:12,.0f} rows/s')
+    return {"name": name, "rows": rows, "seconds": seconds, "rows_per_second": rows / seconds}
+
+
+def _render_table():
+    """
+    Make the table the render benchmark draws into. A real Treeview is used when there is a display, otherwise the
+    headless stand-ins are.
+    :return table: A tuple of (table, scrollbar, root), root is None when there is no display
+    """
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        root = tk.Tk()
+        root.withdraw()
+        return ttk.Treeview(root, height=24), ttk.Scrollbar(root), root
+    except Exception:
+        return _HeadlessTreeview(24), _HeadlessScrollbar(), None
+
+
+def _environment(seed):
+    """
+    Describe the machine and version of the program the suite ran on, so results from different runs can be matched
+    :param seed: The seed the synthetic data was generated with
+    :return environment: A dict describing the run
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=directory, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"created": datetime.datetime.now().isoformat(timespec="seconds"), "commit": commit,
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "seed": seed}
+
+
+def run_suite(row_counts, queries, xlsx_rows, seed):
+    """
+    Run every benchmark in the suite against synthetic tables of each size: importing a workbook, write_data,
+    read_data, read_unique_data, read_filtered_data, paging, and drawing the table. Caching is turned off so every
+    call does the full amount of work.
+    :param row_counts: A list of table sizes to run the suite at
+    :param queries: The number of times to time each quick query. Queries that read every matching row run at most 5 times
+    :param xlsx_rows: The largest table to also import from a workbook, since workbooks are slow to write and parse
+    :param seed: The seed for the synthetic data
+    :return report: A dict of the environment and a list of results, ready to be written as JSON
+    """
+    from ingest import sync_excel
+    from paging import PagedResult
+    from virtual_table import VirtualTable, format_row
+
+    results = []
+    full_reads = min(queries, 5)
+    for rows in row_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            if rows <= xlsx_rows:
+                workbook = os.path.join(directory, "data.xlsx")
+                write_workbook(workbook, synthetic_rows(rows, seed=seed))
+                with Database(os.path.join(directory, "xlsx.db")) as database:
+                    results.append(_throughput("ingest_xlsx", rows, lambda: sync_excel(database, workbook)))
+
+            with Database(os.path.join(directory, "bench.db"), cache_bytes=0) as database:
+                results.append(_throughput("write_data", rows,
+                                           lambda: database.write_data(synthetic_rows(rows, seed=seed))))
+                state = database.read_unique_data("state")[0]
+
+                results.append(_summarize("read_data", rows, _time_calls(database.read_data, full_reads)))
+                for field in ("state", "business_type", "expiry"):
+                    results.append(_summarize(f"read_unique_data[{field}]", rows, _time_calls(
+                        lambda: database.read_unique_data(field), queries)))
+                results.append(_summarize("read_filtered_data[state]", rows, _time_calls(
+                    lambda: database.read_filtered_data("state", state), full_reads)))
+                results.append(_summarize("count_filtered_data[state]", rows, _time_calls(
+                    lambda: database.count_filtered_data("state", state), queries)))
+                results.append(_summarize("read_page[insurance_value]", rows, _time_calls(
+                    lambda: database.read_page("state", state, order_by="insurance_value"), queries)))
+
+                # Point the table at a fresh result, which reads the first page, then scroll to random places in it
+                table, scrollbar, root = _render_table()
+                virtual_table = VirtualTable(table, scrollbar, format_row)
+                results.append(_summarize("create_table_rows", rows, _time_calls(
+                    lambda: virtual_table.set_rows(PagedResult(database)), queries)))
+                rng = random.Random(seed)
+                results.append(_summarize("scroll_table", rows, _time_calls(
+                    lambda: virtual_table.scroll_to(rng.randrange(rows)), queries)))
+                if root is not None:
+                    root.destroy()
+
+    return {"environment": _environment(seed), "results": results}
+
+
+def compare(old_path, new_path, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare two JSON reports from the suite and print how much each benchmark sped up or slowed down
+    :param old_path: The report to compare against
+    :param new_path: The new report
+    :param threshold: How many times slower a benchmark has to be to count as a regression
+    :return regressions: The number of benchmarks that got slower by more than the threshold
+    """
+    with open(old_path) as fp:
+        old = {(result["name"], result["rows"]): result for result in json.load(fp)["results"]}
+    with open(new_path) as fp:
+        new = json.load(fp)["results"]
+
+    regressions = 0
+    for result in new:
+        before = old.get((result["name"], result["rows"]))
+        if before is None:
+            continue
+        # Throughput benchmarks record the total time, the others the median time of a call
+        metric = "seconds" if "seconds" in result else "median_ms"
+        ratio = result[metric] / before[metric] if before[metric] else float("inf")
+        flag = ""
+        if ratio > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        label = f'{result["name"]} ({result["rows"]})'
+        print(f'{label:<40} {before[metric]:12.3f} -> {result[metric]:12.3f} {metric}   x{ratio:.2f}{flag}')
+    return regressions
+
+
+def main():
+    """
+    Parse the command line and run the chosen benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    connection = subparsers.add_parser("connection", help="Per-query latency with and without a persistent connection")
+    connection.add_argument("--rows", type=int, default=10000)
+    connection.add_argument("--queries", type=int, default=200)
+
+    columnar = subparsers.add_parser("columnar", help="The sqlite engine against the NumPy columnar engine")
+    columnar.add_argument("--rows", default="1000000,10000000", help="Comma separated table sizes")
+    columnar.add_argument("--queries", type=int, default=20)
+
+    ingest = subparsers.add_parser("ingest", help="Parallel import of a directory of workbooks")
+    ingest.add_argument("--files", type=int, default=8)
+    ingest.add_argument("--rows", type=int, default=20000, help="Rows in each workbook")
+    ingest.add_argument("--processes", default="1,2,4,8", help="Comma separated process counts")
+
+    export = subparsers.add_parser("export", help="Streaming export throughput and memory")
+    export.add_argument("--rows", type=int, default=2000000)
+    export.add_argument("--formats", default="csv,jsonl,parquet", help="Comma separated formats")
+
+    cold_start = subparsers.add_parser("cold-start", help="Start up time of a command line query")
+    cold_start.add_argument("--rows", type=int, default=100000)
+    cold_start.add_argument("--runs", type=int, default=20)
+
+    paging = subparsers.add_parser("paging", help="Check that paging returns every row, including blank sort values")
+    paging.add_argument("--rows", type=int, default=2000)
+    paging.add_argument("--page-size", type=int, default=100)
+
+    memory = subparsers.add_parser("memory", help="Bytes per row held in memory by each way of storing rows")
+    memory.add_argument("--rows", type=int, default=1000000)
+
+    suite = subparsers.add_parser("suite", help="Every benchmark at each table size, written as JSON")
+    suite.add_argument("--rows", default="10000,100000,1000000", help="Comma separated table sizes, up to 10000000")
+    suite.add_argument("--queries", type=int, default=20)
+    suite.add_argument("--xlsx-rows", type=int, default=200000, help="The largest table to also import from a workbook")
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--output", help="The file to write the JSON report to, it is printed if this is left out")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two JSON reports from the suite")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                                help="How many times slower counts as a regression")
+
+    args = parser.parse_args()
+    if args.benchmark == "connection":
+        bench_connection(args.rows, args.queries)
+    elif args.benchmark == "columnar":
+        bench_columnar([int(rows) for rows in args.rows.split(",")], args.queries)
+    elif args.benchmark == "ingest":
+        bench_ingest(args.files, args.rows, [int(processes) for processes in args.processes.split(",")])
+    elif args.benchmark == "export":
+        bench_export(args.rows, args.formats.split(","))
+    elif args.benchmark == "cold-start":
+        bench_cold_start(args.rows, args.runs)
+    elif args.benchmark == "paging":
+        sys.exit(1 if check_paging(args.rows, args.page_size) else 0)
+    elif args.benchmark == "memory":
+        bench_memory(args.rows)
+    elif args.benchmark == "suite":
+        # Progress goes to stderr, so the report is the only thing on stdout and can be redirected to a file
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run_suite([int(rows) for rows in args.rows.split(",")], args.queries, args.xlsx_rows, args.seed)
+        if args.output:
+            with open(args.output, "w") as fp:
+                json.dump(report, fp, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
+    elif args.benchmark == "compare":
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
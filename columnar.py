@@ -0,0 +1,525 @@
+"""
+An in-memory columnar engine for interactive exploration. The insurance table is loaded once into NumPy arrays, with
+the text columns dictionary encoded as integer codes, and filters are answered with vectorized boolean masks instead of
+a sqlite query per filter. Every column is stored in the smallest integer type that holds it, and filtered views are
+arrays of row positions, so only the rows on screen are ever turned into tuples. ColumnarDatabase has the same read
+interface as database.Database, so the viewer can use either one. NumPy is optional, the rest of the program works
+without it.
+"""
+import sys
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from database import COLUMN_NAMES, EXPORT_CHUNK_SIZE, PAGE_SIZE, SEARCH_LIMIT, SORT_FIELDS
+from query_builder import COMPARISONS, And, Condition, Or, Query
+from result_cache import ResultCache
+
+# The text columns, stored as integer codes into a list of the column's distinct values
+CATEGORICAL_FIELDS = ("expiry", "location", "state", "region", "construction", "business_type")
+# The number columns and the type of array they are stored in
+NUMERIC_FIELDS = {"insurance_id": "int64", "policy": "int64", "insurance_value": "int64", "earthquake": "int8",
+                  "flood": "int8"}
+# The memory budget for cached filter results, which are arrays of row positions
+CACHE_BYTES = 64 * 1024 * 1024
+# The integer types columns are narrowed to once they are loaded, from smallest to largest
+INTEGER_DTYPES = ("int8", "int16", "int32", "int64")
+
+
+class ColumnarDatabase:
+    """
+    Class to answer the viewer's queries from NumPy arrays loaded from a database.Database
+
+    Attributes:
+
+    - cache :    :class:`result_cache.ResultCache` --> Recent filter results, stored as arrays of row positions
+    - categories :    :class:`dict` --> Maps each text field to the list of its distinct values, indexed by code
+    - columns :    :class:`dict` --> Maps each field to its array, narrowed to the smallest integer type that fits. Text fields hold codes into categories
+    - database :    :class:`database.Database` --> The database the data is loaded from
+    - generation :    :class:`int` --> The database generation the arrays were loaded at
+    - row_count :    :class:`int` --> The number of rows loaded
+    - valid :    :class:`dict` --> Maps each number field that has blanks to a boolean array that is False where sqlite holds NULL
+
+    Methods:
+
+    - reload() --> Load every row of the insurance table into the arrays
+    - _refresh() --> Reload the arrays if the database has changed since they were loaded
+    - read_data() --> Return every row
+    - read_unique_data(field) --> Return the unique values of the field indicated
+    - read_filtered_data(field, value) --> Return all rows containing the same value for the field provided
+    - iter_filtered_data(field, value, chunk_size, order_by, descending) --> Return the rows containing the same value for the field provided in chunks
+    - export_data(path, field, value, file_format, order_by, descending) --> Write the rows containing the same value for the field provided to a file
+    - count_filtered_data(field, value) --> Count the rows containing the same value for the field provided
+    - read_page(field, value, order_by, descending, after, offset, page_size) --> Return one page of the rows containing the same value for the field provided
+    - _mask(field, value) --> Return a boolean array that is True for the rows containing the value
+    - _query_mask(query) --> Return a boolean array that is True for the rows matching a query_builder query
+    - _number_mask(column, operator, value) --> Return a boolean array that is True for the values of a number column that pass a comparison
+    - _positions(field, value, order_by, descending) --> Return the positions of the matching rows in sorted order
+    - _rows(positions) --> Turn an array of row positions back into row tuples
+    - view(field, value, order_by, descending) --> Return the matching rows as a RowView over the loaded columns
+    - memory_usage() --> Return how many bytes the loaded data is using
+    - read_rollup(field) --> Read the policy count and insured value totals for each value of a field
+    - search_values(field, text, limit) --> Find the values of a field matching what the user has typed so far
+    - interrupt(thread) --> Does nothing, there is no sqlite query to abort
+    - close() --> Close the database the data was loaded from
+    """
+
+    def __init__(self, database, cache_bytes=CACHE_BYTES):
+        if np is None:
+            raise ImportError("The columnar engine needs NumPy, install it with pip install numpy")
+        self.database = database
+        self.cache = ResultCache(cache_bytes)
+        self.columns = {}
+        self.categories = {}
+        self.valid = {}
+        self.generation = None
+        self.row_count = 0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self, chunk_size=100000):
+        """
+        Load every row of the insurance table into the arrays. Rows are streamed from the database in chunks, and each
+        chunk is converted to arrays before the next one is read.
+        :param chunk_size: The number of rows to convert at a time
+        :return None:
+        """
+        with self._lock:
+            generation = self.database._current_generation()
+            chunks = {field: [] for field in SORT_FIELDS}
+            valid_chunks = {field: [] for field in NUMERIC_FIELDS}
+            # value -> code for each text field, codes are handed out in the order values are first seen
+            codes = {field: {} for field in CATEGORICAL_FIELDS}
+
+            for rows in self.database.iter_filtered_data(chunk_size=chunk_size):
+                for field, values in zip(SORT_FIELDS, zip(*rows)):
+                    if field in codes:
+                        lookup = codes[field]
+                        chunk = np.fromiter((lookup.setdefault(value, len(lookup)) for value in values),
+                                            dtype="int32", count=len(values))
+                    else:
+                        # A missing number is stored as 0 and marked as missing in the field's validity mask
+                        chunk = np.fromiter((0 if value is None else value for value in values),
+                                            dtype=NUMERIC_FIELDS[field], count=len(values))
+                        valid_chunks[field].append(np.fromiter((value is not None for value in values), dtype=bool,
+                                                               count=len(values)))
+                    chunks[field].append(chunk)
+
+            self.columns = {}
+            for field in SORT_FIELDS:
+                dtype = "int32" if field in codes else NUMERIC_FIELDS[field]
+                column = np.concatenate(chunks[field]) if chunks[field] else np.empty(0, dtype=dtype)
+                # Store each column in the smallest type that holds it, a handful of states only needs a byte per row
+                self.columns[field] = _narrow(column)
+                del chunks[field]
+            # Only the fields that actually have blanks keep a mask
+            self.valid = {}
+            for field, masks in valid_chunks.items():
+                valid = np.concatenate(masks) if masks else np.empty(0, dtype=bool)
+                if not valid.all():
+                    self.valid[field] = valid
+            self.categories = {field: list(lookup) for field, lookup in codes.items()}
+            # Where each code falls when the values are sorted, so text columns can be sorted by code
+            self._ranks = {}
+            for field, values in self.categories.items():
+                ranks = np.empty(len(values), dtype="int32")
+                ranks[sorted(range(len(values)), key=values.__getitem__)] = np.arange(len(values), dtype="int32")
+                self._ranks[field] = ranks
+            self.row_count = len(self.columns["insurance_id"])
+            # Row positions only need 4 bytes each until there are more than 2 billion rows
+            self._position_dtype = "int32" if self.row_count < 2 ** 31 else "int64"
+            self.generation = generation
+            self.cache.clear()
+
+    def _refresh(self):
+        """
+        Reload the arrays if the database has changed since they were loaded
+        :return None:
+        """
+        if self.database._current_generation() != self.generation:
+            self.reload()
+
+    def read_data(self):
+        """
+        Return every row
+        :return data: A list of tuples in the same layout as the insurance table
+        """
+        return self.read_filtered_data("*", None)
+
+    def read_unique_data(self, field):
+        """
+        Return the unique values of the field indicated
+        :param field: The field to get unique values from
+        :return data: The unique values of the field
+        """
+        self._refresh()
+        if field not in SORT_FIELDS:
+            raise ValueError(f'Cannot read unique values of {field}')
+        if field in self.categories:
+            # Only the codes need to be made unique, then they are looked up once each. Counting the codes is a single
+            # pass, where np.unique would have to sort them
+            categories = self.categories[field]
+            counts = np.bincount(self.columns[field], minlength=len(categories))
+            return [categories[code] for code in np.flatnonzero(counts).tolist()]
+        if field in self.valid:
+            # sqlite returns NULL as one of the distinct values, and sorts it before every number
+            valid = self.valid[field]
+            values = np.unique(self.columns[field][valid]).tolist()
+            return ([None] if not valid.all() else []) + values
+        return np.unique(self.columns[field]).tolist()
+
+    def read_filtered_data(self, field, value):
+        """
+        Return all rows containing the same value for the field provided
+        :param field: The field to select, or "*" for every row
+        :param value: The value to find duplicates of
+        :return data: The rows containing the same value for the field
+        """
+        self._refresh()
+        return self._rows(self._positions(field, value, "insurance_id", False))
+
+    def iter_filtered_data(self, field="*", value=None, chunk_size=PAGE_SIZE, order_by=None, descending=False):
+        """
+        Return the rows containing the same value for the field provided in chunks. Only one chunk of rows is built
+        at a time, from the cached array of matching positions.
+        :param field: The field to select, or "*" for every row
+        :param value: The value to find duplicates of
+        :param chunk_size: The number of rows in each chunk
+        :param order_by: The field to sort the rows by, or None for the order they were added in
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :return chunks: A generator of lists of rows
+        """
+        self._refresh()
+        order_by = order_by or "insurance_id"
+        if order_by not in SORT_FIELDS:
+            raise ValueError(f'Cannot sort by {order_by}')
+        positions = self._positions(field, value, order_by, descending)
+        for start in range(0, len(positions), chunk_size):
+            yield self._rows(positions[start:start + chunk_size])
+
+    def export_data(self, path, field="*", value=None, file_format=None, order_by=None, descending=False,
+                    chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Write the rows containing the same value for the field provided to a CSV, JSON Lines, or Parquet file. Takes
+        the same arguments as database.Database.export_data.
+        :param path: The file to write
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :param file_format: "csv", "jsonl", or "parquet", worked out from the file's extension if not given
+        :param order_by: The field to sort the rows by, or None for the order they were added in
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :param chunk_size: The number of rows built at a time
+        :return row_count: The number of rows written
+        """
+        from export import export_chunks
+        chunks = self.iter_filtered_data(field, value, chunk_size, order_by=order_by, descending=descending)
+        return export_chunks(chunks, path, file_format, COLUMN_NAMES)
+
+    def count_filtered_data(self, field, value):
+        """
+        Count the rows containing the same value for the field provided
+        :param field: The field to select, or "*" to count every row
+        :param value: The value to find duplicates of
+        :return count: The number of rows containing the same value for the field
+        """
+        self._refresh()
+        mask = self._mask(field, value)
+        return self.row_count if mask is None else int(np.count_nonzero(mask))
+
+    def read_page(self, field="*", value=None, order_by="insurance_id", descending=False, after=None, offset=0,
+                  page_size=PAGE_SIZE):
+        """
+        Return one page of the rows containing the same value for the field provided, sorted by order_by. Takes the
+        same arguments as database.Database.read_page, the continuation key is the position of the next row.
+        :param field: The field to select, or "*" for every row
+        :param value: The value to find duplicates of
+        :param order_by: The field to sort the rows by
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :param after: The continuation key returned with the previous page, or None to start at offset
+        :param offset: The number of rows to skip when there is no continuation key
+        :param page_size: The most rows to return
+        :return page: A tuple of (rows, key), key is None when there are no more rows
+        """
+        self._refresh()
+        if order_by not in SORT_FIELDS:
+            raise ValueError(f'Cannot sort by {order_by}')
+        if after is not None:
+            offset = after[0]
+        positions = self._positions(field, value, order_by, descending)
+        rows = self._rows(positions[offset:offset + page_size])
+        next_offset = offset + page_size
+        return rows, ((next_offset,) if next_offset < len(positions) else None)
+
+    def _mask(self, field, value):
+        """
+        Return a boolean array that is True for the rows containing the value. Values are compared the way sqlite
+        would compare them against the column, so "5" matches 5 in a number column.
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :return mask: The boolean array, or None when every row is selected
+        """
+        if isinstance(field, Query):
+            return self._query_mask(field)
+        if field == "*":
+            return None
+        return self._query_mask(Condition(field, "=", value))
+
+    def _query_mask(self, query):
+        """
+        Return a boolean array that is True for the rows matching a query_builder query. Conditions on text fields
+        are tested once per distinct value and then looked up by code, conditions on number fields are tested on the
+        whole array at once.
+        :param query: A query_builder.Query
+        :return mask: The boolean array
+        """
+        if isinstance(query, And):
+            return np.logical_and.reduce([self._query_mask(part) for part in query.parts])
+        if isinstance(query, Or):
+            return np.logical_or.reduce([self._query_mask(part) for part in query.parts])
+
+        field, operator = query.field, query.operator
+        if field not in SORT_FIELDS:
+            raise ValueError(f'Cannot filter on {field}')
+
+        if field in self.categories:
+            # The column holds text, so compare against the text of the value like sqlite would
+            if operator in ("IN", "BETWEEN"):
+                value = tuple(str(part) for part in query.value)
+            else:
+                value = str(query.value)
+            condition = Condition(field, operator, value)
+            categories = self.categories[field]
+            passes = np.fromiter((condition.test(category) for category in categories), dtype=bool,
+                                 count=len(categories))
+            return passes[self.columns[field]]
+
+        mask = self._number_mask(self.columns[field], operator, query.value)
+        # A comparison with a NULL is never true in sqlite, whatever it is compared with
+        if field in self.valid:
+            mask &= self.valid[field]
+        return mask
+
+    def _number_mask(self, column, operator, value):
+        """
+        Return a boolean array that is True for the values of a number column that pass a comparison, the way sqlite
+        would compare them
+        :param column: The column's array
+        :param operator: One of query_builder.OPERATORS
+        :param value: The value to compare with. A tuple of values for IN, a (low, high) tuple for BETWEEN
+        :return mask: The boolean array
+        """
+        if operator == "IN":
+            numbers = [number for number in map(_number, value) if number is not None]
+            return np.isin(column, numbers)
+        # Comparing with NULL is never true
+        if value is None or (operator == "BETWEEN" and None in value):
+            return np.zeros(self.row_count, dtype=bool)
+        if operator == "BETWEEN":
+            low, high = map(_number, value)
+            # sqlite sorts every number before every piece of text, so a text low bound matches nothing and a text
+            # high bound matches every number above the low bound
+            if low is None:
+                return np.zeros(self.row_count, dtype=bool)
+            if high is None:
+                return column >= low
+            return (column >= low) & (column <= high)
+        number = _number(value)
+        if number is None:
+            # Every number is less than text in sqlite, and never equal to it
+            return np.full(self.row_count, operator in ("!=", "<", "<="))
+        return COMPARISONS[operator](column, number)
+
+    def _positions(self, field, value, order_by, descending):
+        """
+        Return the positions of the rows containing the value, sorted by order_by with ties broken by insurance_id.
+        Results are cached, so paging through a result only filters and sorts it once.
+        :param field: The field to select, or "*" for every row
+        :param value: The value to find duplicates of
+        :param order_by: The field to sort the rows by
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :return positions: An array of row positions
+        """
+        key = (field, value, order_by, descending)
+        positions = self.cache.get(key, self.generation)
+        if positions is not None:
+            return positions
+
+        mask = self._mask(field, value)
+        positions = np.arange(self.row_count) if mask is None else np.flatnonzero(mask)
+        positions = positions.astype(self._position_dtype, copy=False)
+        if order_by != "insurance_id":
+            sort_values = self.columns[order_by][positions]
+            if order_by in self._ranks:
+                # Codes are in the order values were first seen, so sort by where each value falls alphabetically
+                sort_values = self._ranks[order_by][sort_values]
+            keys = (self.columns["insurance_id"][positions], sort_values)
+            if order_by in self.valid:
+                # sqlite sorts NULLs before every number
+                keys += (self.valid[order_by][positions],)
+            # lexsort sorts by the last key first, insurance_id breaks the ties
+            positions = positions[np.lexsort(keys)]
+        else:
+            positions = positions[np.argsort(self.columns["insurance_id"][positions], kind="stable")]
+        if descending:
+            positions = positions[::-1]
+
+        self.cache.put(key, self.generation, positions, positions.nbytes)
+        return positions
+
+    def _rows(self, positions):
+        """
+        Turn an array of row positions back into row tuples. Only the rows asked for are ever built.
+        :param positions: An array of row positions
+        :return rows: A list of tuples in the same layout as the insurance table
+        """
+        return _build_rows(self.columns, self.categories, self.valid, positions)
+
+    def view(self, field="*", value=None, order_by="insurance_id", descending=False):
+        """
+        Return the rows containing the same value for the field provided as a RowView. The view is an array of row
+        positions into the loaded columns, so no rows are copied until they are looked at.
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :param order_by: The field to sort the rows by
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :return view: A RowView of the matching rows
+        """
+        self._refresh()
+        if order_by not in SORT_FIELDS:
+            raise ValueError(f'Cannot sort by {order_by}')
+        # The view keeps the columns it was made from, so a reload does not change the rows under it
+        return RowView(self.columns, self.categories, self.valid,
+                       self._positions(field, value, order_by, descending))
+
+    def memory_usage(self):
+        """
+        Return how many bytes the loaded data is using
+        :return usage: A dict with the bytes used by the columns, the text values the codes point to, and the cached
+        filter results
+        """
+        columns = sum(column.nbytes for column in self.columns.values())
+        columns += sum(valid.nbytes for valid in self.valid.values())
+        categories = sum(sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+                         for values in self.categories.values())
+        return {"rows": self.row_count, "columns": columns, "categories": categories,
+                "cached_positions": self.cache.size}
+
+    def read_rollup(self, field):
+        """
+        Read the policy count and insured value totals for each value of a field. The rollup tables in the database
+        are already kept up to date, so they are read from there.
+        :param field: One of database.ROLLUP_FIELDS
+        :return rollup: A list of (value, count, sum, min, max) tuples sorted by value
+        """
+        return self.database.read_rollup(field)
+
+    def search_values(self, field, text, limit=SEARCH_LIMIT):
+        """
+        Find the values of a field matching what the user has typed so far. The database's search index is already
+        kept up to date, so it is searched there.
+        :param field: One of database.FILTER_FIELDS
+        :param text: What the user has typed
+        :param limit: The most values to return
+        :return values: A list of at most limit matching values
+        """
+        return self.database.search_values(field, text, limit)
+
+    def interrupt(self, thread=None):
+        """
+        Does nothing, there is no sqlite query to abort. Here so the query worker can use either engine.
+        :param thread: The thread whose queries would be aborted
+        :return None:
+        """
+
+    def close(self):
+        """
+        Close the database the data was loaded from
+        :return None:
+        """
+        self.database.close()
+
+
+class RowView:
+    """
+    Class to look like a list of rows while only holding an array of row positions into a ColumnarDatabase's columns.
+    Row tuples are built when they are asked for, so a view of millions of rows costs 4 bytes a row.
+
+    Attributes:
+
+    - categories :    :class:`dict` --> The text values the codes in the columns point to
+    - columns :    :class:`dict` --> The columns the rows are read from
+    - positions :    :class:`numpy.ndarray` --> The position of each row of the view in the columns
+    - valid :    :class:`dict` --> The validity masks of the number columns that have blanks
+    """
+
+    def __init__(self, columns, categories, valid, positions):
+        self.columns = columns
+        self.categories = categories
+        self.valid = valid
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return _build_rows(self.columns, self.categories, self.valid, self.positions[index])
+        return _build_rows(self.columns, self.categories, self.valid, self.positions[index:index + 1 or None])[0]
+
+
+def _build_rows(columns, categories, valid, positions):
+    """
+    Turn an array of row positions into row tuples
+    :param columns: Maps each field to its array
+    :param categories: Maps each text field to the list of its values, indexed by code
+    :param valid: Maps each number field with blanks to its validity mask
+    :param positions: An array of row positions
+    :return rows: A list of tuples in the same layout as the insurance table
+    """
+    values = []
+    for field in SORT_FIELDS:
+        column = columns[field][positions].tolist()
+        if field in categories:
+            lookup = categories[field]
+            column = [lookup[code] for code in column]
+        elif field in valid:
+            # Put the NULLs back where sqlite has them
+            present = valid[field][positions]
+            if not present.all():
+                column = [value if ok else None for value, ok in zip(column, present.tolist())]
+        values.append(column)
+    return list(zip(*values))
+
+
+def _narrow(column):
+    """
+    Return a column of integers in the smallest type that holds every value in it
+    :param column: A NumPy integer array
+    :return column: The same values, copied to a smaller type if one fits
+    """
+    if not len(column):
+        return column
+    low, high = int(column.min()), int(column.max())
+    for dtype in INTEGER_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return column.astype(dtype, copy=False)
+    return column
+
+
+def _number(value):
+    """
+    Turn a value into a number the way sqlite would before comparing it with a number column
+    :param value: The value to turn into a number
+    :return number: An int or float, or None if the value is not a number
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
@@ -1,5 +1,67 @@
+import datetime
+import hashlib
+import itertools
 import os
 import sqlite3
+import threading
+
+from query_builder import Query
+from result_cache import ResultCache, estimate_size
+
+# The formats expiry dates are read in, in the order they are tried
+DATE_FORMATS = ("%Y-%m-%d", "%Y-%m-%d %H:%M:%S", "%m/%d/%Y", "%m/%d/%y", "%d-%b-%Y", "%b %d, %Y")
+
+# The PRAGMAs every connection is tuned with unless the caller overrides them
+DEFAULT_PRAGMAS = {
+    # Let readers keep reading while a write is happening
+    "journal_mode": "WAL",
+    # WAL is still safe against corruption with NORMAL, it just syncs less often
+    "synchronous": "NORMAL",
+    # Negative values are in KiB, so this is a 64 MiB page cache
+    "cache_size": -64000,
+    # Read the database through a 256 MiB memory map instead of read() calls
+    "mmap_size": 268435456,
+    # Keep temp tables and sort space in memory
+    "temp_store": "MEMORY",
+}
+
+# The number of prepared statements each connection keeps around for reuse
+STATEMENT_CACHE_SIZE = 256
+
+INSERT_QUERY = '''
+    INSERT OR IGNORE INTO insurance (policy, expiry, location, state, region, insurance_value, construction,
+    business_type, earthquake, flood) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SELECT_ALL_QUERY = "SELECT * FROM insurance"
+
+# Every field the viewer can filter on. policy is already indexed by its UNIQUE constraint
+FILTER_FIELDS = ("policy", "expiry", "location", "state", "region", "insurance_value", "construction",
+                 "business_type", "earthquake", "flood")
+# The fields that get an index of their own. A single column index also covers SELECT DISTINCT on that column, so
+# read_unique_data can be answered from the index without touching the table
+INDEXED_FIELDS = FILTER_FIELDS[1:]
+# The fields the summary rollups are grouped by
+ROLLUP_FIELDS = ("state", "region", "construction", "business_type", "earthquake", "flood")
+# The columns of the insurance table, in the order rows are returned in
+COLUMN_NAMES = ("insurance_id",) + FILTER_FIELDS
+# The text fields with too many values for a dropdown menu, which are searched as the user types instead
+SEARCH_FIELDS = ("location", "business_type")
+# The fields with close to a different value in every row. They are searched as the user types too, by matching the
+# start of the value over the field's index, since a full text index of them would be as big as the table
+PREFIX_SEARCH_FIELDS = ("policy", "expiry", "insurance_value")
+# The fields that hold whole numbers
+INTEGER_FIELDS = ("policy", "insurance_value", "earthquake", "flood")
+# The most matches a search returns
+SEARCH_LIMIT = 25
+# The fields rows can be sorted by
+SORT_FIELDS = COLUMN_NAMES
+
+# The number of rows read_page returns unless asked for a different amount
+PAGE_SIZE = 500
+# The number of rows export_data reads from sqlite at a time
+EXPORT_CHUNK_SIZE = 10000
+# The memory budget for cached query results
+CACHE_BYTES = 32 * 1024 * 1024
 
 
 class Database:
@@ -8,23 +70,79 @@ class Database:
 
     Attributes:
 
+    - cache :    :class:`result_cache.ResultCache` --> Recent query results, which are thrown out when the data changes
+    - column_names :    :class:`frozenset` --> The columns of the insurance table, used to check fields before they go into SQL
     - db_name :    :class:`str` --> The name of the database file
+    - full_text :    :class:`bool` --> True if sqlite was built with FTS5, searches fall back to matching the start of values without it
+    - generation :    :class:`int` --> Counts changes to the data, cached results from an older generation are stale
+    - pragmas :    :class:`dict` --> The PRAGMAs each connection is tuned with when it is opened
 
     Methods:
 
     - _exist_chk() --> This modified version of exist_chk provided in the starting materials checks to see if the database file exists. If the file does not exist, it will be created. The insurance table will then be created, regardless of if the file existed prior to the program running.
     - _create_database() --> Create the file to use for the database.
+    - _connect() --> Return the connection for the current thread, opening and tuning it the first time it is needed
+    - close() --> Close every connection that has been opened
+    - disconnect() --> Close the current thread's connection
+    - interrupt(thread) --> Abort the queries running on one thread's connection, or on all of this database's connections
     - _create_table() --> This modified version of create_table provided in the starting materials. This method connects to the database and creates a table if one does not exist already.
     - write_data() --> Take in data and write the data to the sqlite database
+    - _where(field, value) --> Build the WHERE clause for a field and value, or for a query_builder.Query
     - read_data() --> Read in data from the sqlite database and return it
     - read_unique_data() --> Read and return the unique values from the field indicated
     - read_filtered_data() --> Read and return all rows containing the same value for the field provided
+    - _create_sync_tables() --> Create the tables that remember what was imported last time, so unchanged data can be skipped
+    - read_manifest(source) --> Read the size, modification time, and hash recorded for a source file
+    - write_manifest(source, size, mtime, digest) --> Record the size, modification time, and hash of a source file
+    - sync_data(rows) --> Make the insurance table match the rows, only writing the rows that changed and deleting the rows that are gone
+    - upsert_data(rows) --> Insert new rows and update changed rows, without deleting any
+    - _stage_rows(conn, rows, batch_size) --> Fingerprint rows and put them in a temporary table
+    - _upsert_staged(conn) --> Write the staged rows that are new or changed
+    - _create_indexes() --> Create an index on every field the viewer can filter on
+    - _create_rollups() --> Create the rollup table and the triggers that keep it up to date
+    - _migrate() --> Bring a database made by an older version of the program up to date
+    - rebuild_rollups() --> Recompute the rollup table from the insurance table
+    - _create_search_index() --> Create the table of distinct values to search, its full text index, and the triggers that keep them up to date
+    - rebuild_search_index() --> Recompute the distinct values to search from the insurance table
+    - search_values(field, text, limit) --> Find the values of a field matching what the user has typed so far
+    - _prefix_search(conn, field, text, limit) --> Find the values of a field that start with the text, from the field's index
+    - read_rollup(field) --> Read the policy count and insured value totals for each value of a field
+    - explain(query, params) --> Return the steps of sqlite's query plan for a query
+    - advise_indexes() --> Check that every query the viewer can issue is answered with an index
+    - iter_filtered_data(field, value, chunk_size, order_by, descending) --> Stream the rows containing the same value for the field provided in chunks
+    - export_data(path, field, value, file_format, order_by, descending) --> Write the rows containing the same value for the field provided to a file
+    - count_filtered_data(field, value) --> Count the rows containing the same value for the field provided
+    - read_page(field, value, order_by, descending, after, offset, page_size) --> Read one page of the rows containing the same value for the field provided
+    - _cached(key, read, size) --> Return a query's result from the cache, or read it and store it in the cache
+    - _current_generation() --> Return the data generation, bumping it if another connection has written to the database since it was last checked
+    - _bump_generation() --> Start a new data generation, which makes every cached result stale
+    - cache_stats() --> Return the result cache's hit, miss, and size counters
+
+    The database can be used as a context manager, which closes its connections on exit.
     """
 
-    def __init__(self):
-        self.db_name = "insurance_data.db"
+    def __init__(self, db_name="insurance_data.db", pragmas=None, cache_bytes=CACHE_BYTES):
+        self.db_name = db_name
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.cache = ResultCache(cache_bytes)
+        self.generation = 0
+        # Each thread gets its own connection, since a sqlite connection should only be used by one thread at a time
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # One connection shared by every thread, only used to watch for writes from other connections
+        self._version_conn = None
+        self._data_version = None
         self._exist_chk()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def _exist_chk(self):
         """
         This modified version of exist_chk provided in the starting materials checks to see if the database file exists.
@@ -38,6 +156,13 @@ class Database:
             self._create_database()
 
         self._create_table()
+        self._create_sync_tables()
+        self._create_indexes()
+        self._create_rollups()
+        self._create_search_index()
+        self._migrate()
+        # The columns of the insurance table, every field used in a query has to be one of these
+        self.column_names = frozenset(row[1] for row in self._connect().execute("PRAGMA table_info(insurance)"))
 
     def _create_database(self):
         """
@@ -47,6 +172,70 @@ class Database:
         with open(self.db_name, 'w') as fp:
             print('Database has been created.')
 
+    def _connect(self):
+        """
+        Return the connection for the current thread, opening and tuning it the first time it is needed. The
+        connection stays open so later queries skip the cost of connecting and loading the schema, and sqlite reuses
+        the prepared statement for any query text it has already seen.
+        :return conn: The sqlite3 connection for this thread
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # check_same_thread is off only so close() can close every thread's connection
+            conn = sqlite3.connect(self.db_name, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+            for name, value in self.pragmas.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append((threading.current_thread(), conn))
+        return conn
+
+    def close(self):
+        """
+        Close every connection that has been opened. The database can still be used afterwards, it will just open new
+        connections.
+        :return None:
+        """
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+            self._local = threading.local()
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
+
+        for _, conn in connections:
+            # Let sqlite update its statistics for the query planner before the connection goes away
+            conn.execute("PRAGMA optimize")
+            conn.close()
+
+    def disconnect(self):
+        """
+        Close the current thread's connection, for threads that are finished with the database while the others carry
+        on using it. The thread will open a new connection if it uses the database again.
+        :return None:
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        with self._lock:
+            self._connections = [(owner, other) for owner, other in self._connections if other is not conn]
+        self._local.conn = None
+        conn.close()
+
+    def interrupt(self, thread=None):
+        """
+        Abort the queries running on one thread's connection, or on all of this database's connections. The
+        interrupted queries raise sqlite3.OperationalError in the threads running them.
+        :param thread: The threading.Thread whose queries to abort, or None to abort every thread's queries
+        :return None:
+        """
+        with self._lock:
+            connections = list(self._connections)
+        for owner, conn in connections:
+            if thread is None or owner is thread:
+                conn.interrupt()
+
     def _create_table(self):
         """
         This modified version of create_table provided in the starting materials. This method connects to the database and creates a table if one does not exist already.
@@ -54,7 +243,7 @@ class Database:
         :return bool:
         """
         try:
-            conn = sqlite3.connect(self.db_name)
+            conn = self._connect()
             cursor = conn.cursor()
             # Make sure the policy # is unique
             query = '''CREATE TABLE IF NOT EXISTS insurance
@@ -76,47 +265,349 @@ class Database:
 
         except sqlite3.Error as error:
             print(f'Error ocured - {error}')
+            return False
 
-        finally:
-            if conn:
-                conn.close()
-                return True
+        return True
 
-    def write_data(self, data):
+    def _create_sync_tables(self):
         """
-        Take in data and write the data to the sqlite database
-        :param data: The data from Excel to write to the database
+        Create the tables that remember what was imported last time, so unchanged data can be skipped. source_manifest
+        holds the size, modification time, and hash of each imported file and row_fingerprint holds a hash of every
+        imported row, keyed on the policy #.
         :return None:
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        # Insert data into the "insurance" table
-        insert_query = '''
-            INSERT OR IGNORE INTO insurance (policy, expiry, location, state, region, insurance_value, construction, 
-            business_type, earthquake, flood) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        conn = self._connect()
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS source_manifest
+                (source TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                digest TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS row_fingerprint
+                (policy INTEGER PRIMARY KEY,
+                fingerprint BLOB NOT NULL);
+        ''')
+
+    def _create_indexes(self):
+        """
+        Create an index on every field the viewer can filter on, so filtering on a field is an index lookup and
+        finding the unique values of a field is an index-only scan instead of a full table scan
+        :return None:
+        """
+        conn = self._connect()
+        for field in INDEXED_FIELDS:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_insurance_{field} ON insurance ({field})")
+        conn.commit()
+
+    def _create_rollups(self):
+        """
+        Create the rollup table and the triggers that keep it up to date. insurance_rollup holds the number of
+        policies and the sum, min, and max insured value for each value of each field in ROLLUP_FIELDS. The triggers
+        adjust it every time a row is inserted, updated, or deleted, so it never has to be recomputed from scratch.
+        :return None:
+        """
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS insurance_rollup
+                            (field TEXT NOT NULL,
+                            value NOT NULL,
+                            row_count INTEGER NOT NULL,
+                            value_sum INTEGER NOT NULL,
+                            value_min INTEGER,
+                            value_max INTEGER,
+                            PRIMARY KEY (field, value)) WITHOUT ROWID;''')
+        cursor = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'insurance_rollup_%'")
+        if cursor.fetchone()[0] == 3:
+            return
+
+        # Adding a row to a group bumps its count and sum and widens its min and max. A blank value is left out, the
+        # same as rebuild_rollups leaves it out
+        add = '''
+            INSERT INTO insurance_rollup (field, value, row_count, value_sum, value_min, value_max)
+            SELECT '{field}', NEW.{field}, 1, COALESCE(NEW.insurance_value, 0), NEW.insurance_value, NEW.insurance_value
+            WHERE NEW.{field} IS NOT NULL
+            ON CONFLICT (field, value) DO UPDATE SET row_count = row_count + 1,
+            value_sum = value_sum + excluded.value_sum,
+            value_min = COALESCE(MIN(value_min, excluded.value_min), value_min, excluded.value_min),
+            value_max = COALESCE(MAX(value_max, excluded.value_max), value_max, excluded.value_max);
+        '''
+        # Taking a row out of a group lowers its count and sum. The min or max only has to be looked up again when the
+        # row held it, and an empty group is removed. A blank value matches no group, so it changes nothing
+        remove = '''
+            UPDATE insurance_rollup SET row_count = row_count - 1,
+            value_sum = value_sum - COALESCE(OLD.insurance_value, 0),
+            value_min = CASE WHEN OLD.insurance_value <= value_min
+                THEN (SELECT MIN(insurance_value) FROM insurance WHERE {field} = OLD.{field}) ELSE value_min END,
+            value_max = CASE WHEN OLD.insurance_value >= value_max
+                THEN (SELECT MAX(insurance_value) FROM insurance WHERE {field} = OLD.{field}) ELSE value_max END
+            WHERE field = '{field}' AND value = OLD.{field};
+            DELETE FROM insurance_rollup WHERE field = '{field}' AND value = OLD.{field} AND row_count <= 0;
         '''
+        adds = "".join(add.format(field=field) for field in ROLLUP_FIELDS)
+        removes = "".join(remove.format(field=field) for field in ROLLUP_FIELDS)
+        columns = ", ".join(ROLLUP_FIELDS + ("insurance_value",))
+
+        conn.executescript(f'''
+            DROP TRIGGER IF EXISTS insurance_rollup_insert;
+            DROP TRIGGER IF EXISTS insurance_rollup_delete;
+            DROP TRIGGER IF EXISTS insurance_rollup_update;
+            CREATE TRIGGER insurance_rollup_insert AFTER INSERT ON insurance BEGIN {adds} END;
+            CREATE TRIGGER insurance_rollup_delete AFTER DELETE ON insurance BEGIN {removes} END;
+            CREATE TRIGGER insurance_rollup_update AFTER UPDATE OF {columns} ON insurance BEGIN {removes} {adds} END;
+        ''')
+        # Fill the rollups in for any rows that were added before the triggers existed
+        self.rebuild_rollups()
 
-        # Iterate through rows in the Excel sheet and insert each row into the table
-        for row in data.iter_rows(min_row=2, values_only=True):
-            cursor.execute(insert_query, row)
+    def _migrate(self):
+        """
+        Bring a database made by an older version of the program up to date. PRAGMA user_version records how far
+        the database has been brought, so each step only ever runs once.
+        :return None:
+        """
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # Expiry dates used to be stored however they came out of Excel, usually with a 00:00:00 time on the end.
+            # Cut them down to YYYY-MM-DD so they sort as dates and date ranges can use the index
+            conn.execute("""UPDATE insurance SET expiry = substr(expiry, 1, 10)
+                            WHERE expiry GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] *'""")
+            conn.execute("PRAGMA user_version = 1")
+            conn.commit()
+        if version < 2:
+            # The rollup triggers used to add rows with a blank earthquake or flood to a group of NULL, which the
+            # rollup table does not allow, so every import of such a row failed. Make them again with the guard
+            conn.execute("DROP TRIGGER IF EXISTS insurance_rollup_insert")
+            self._create_rollups()
+            conn.execute("PRAGMA user_version = 2")
+            conn.commit()
 
-        # Commit the changes and close the connection
+    def rebuild_rollups(self):
+        """
+        Recompute the rollup table from the insurance table. Only needed when the triggers are first created, after
+        that the triggers keep the rollups up to date.
+        :return None:
+        """
+        conn = self._connect()
+        conn.execute("DELETE FROM insurance_rollup")
+        for field in ROLLUP_FIELDS:
+            conn.execute(f'''
+                INSERT INTO insurance_rollup (field, value, row_count, value_sum, value_min, value_max)
+                SELECT '{field}', {field}, COUNT(*), COALESCE(SUM(insurance_value), 0), MIN(insurance_value),
+                MAX(insurance_value) FROM insurance WHERE {field} IS NOT NULL GROUP BY {field}
+            ''')
         conn.commit()
-        conn.close()
+        self._bump_generation()
+
+    def _create_search_index(self):
+        """
+        Create the table of distinct values to search, its full text index, and the triggers that keep them up to
+        date. search_value holds each value of each field in SEARCH_FIELDS with the number of rows that have it, and
+        value_search is an FTS5 index over it that matches the start of any word in a value. The triggers on the
+        insurance table keep the counts right as rows are inserted, updated, and deleted, and the triggers on
+        search_value add and remove values from the index.
+        :return None:
+        """
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS search_value
+                            (search_id INTEGER PRIMARY KEY,
+                            field TEXT NOT NULL,
+                            value TEXT NOT NULL,
+                            row_count INTEGER NOT NULL,
+                            UNIQUE (field, value));''')
+        try:
+            # Index every prefix of up to 3 characters, so the first letters typed are answered from the index
+            conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS value_search USING fts5
+                            (value, content='search_value', content_rowid='search_id', prefix='1 2 3')''')
+            self.full_text = True
+        except sqlite3.OperationalError as error:
+            print(f'Error ocured - {error}')
+            self.full_text = False
+
+        triggers = 2 + len(SEARCH_FIELDS) + (2 if self.full_text else 0)
+        cursor = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'search_value_%'")
+        if cursor.fetchone()[0] == triggers:
+            return
+
+        # Adding a row bumps the count of its value, a value seen for the first time is added to the table
+        add = '''
+            INSERT INTO search_value (field, value, row_count) VALUES ('{field}', NEW.{field}, 1)
+            ON CONFLICT (field, value) DO UPDATE SET row_count = row_count + 1;
+        '''
+        # Taking a row out lowers the count of its value, and a value no row has any more is removed
+        remove = '''
+            UPDATE search_value SET row_count = row_count - 1 WHERE field = '{field}' AND value = OLD.{field};
+            DELETE FROM search_value WHERE field = '{field}' AND value = OLD.{field} AND row_count <= 0;
+        '''
+        adds = "".join(add.format(field=field) for field in SEARCH_FIELDS)
+        removes = "".join(remove.format(field=field) for field in SEARCH_FIELDS)
+        # An update only touches the counts of the fields that actually changed
+        updates = "".join(f'''
+            DROP TRIGGER IF EXISTS search_value_update_{field};
+            CREATE TRIGGER search_value_update_{field} AFTER UPDATE OF {field} ON insurance
+            WHEN OLD.{field} IS NOT NEW.{field} BEGIN {remove.format(field=field)} {add.format(field=field)} END;
+        ''' for field in SEARCH_FIELDS)
+        # The full text index only holds the values, so it is told about values being added and removed
+        index = '''
+            CREATE TRIGGER search_value_index AFTER INSERT ON search_value BEGIN
+                INSERT INTO value_search (rowid, value) VALUES (NEW.search_id, NEW.value);
+            END;
+            CREATE TRIGGER search_value_unindex AFTER DELETE ON search_value BEGIN
+                INSERT INTO value_search (value_search, rowid, value) VALUES ('delete', OLD.search_id, OLD.value);
+            END;
+        ''' if self.full_text else ""
+
+        conn.executescript(f'''
+            DROP TRIGGER IF EXISTS search_value_insert;
+            DROP TRIGGER IF EXISTS search_value_delete;
+            DROP TRIGGER IF EXISTS search_value_index;
+            DROP TRIGGER IF EXISTS search_value_unindex;
+            CREATE TRIGGER search_value_insert AFTER INSERT ON insurance BEGIN {adds} END;
+            CREATE TRIGGER search_value_delete AFTER DELETE ON insurance BEGIN {removes} END;
+            {updates}
+            {index}
+        ''')
+        # Fill the table in for any rows that were added before the triggers existed
+        self.rebuild_search_index()
+
+    def rebuild_search_index(self):
+        """
+        Recompute the distinct values to search from the insurance table. Only needed when the triggers are first
+        created, after that the triggers keep the values up to date.
+        :return None:
+        """
+        conn = self._connect()
+        conn.execute("DELETE FROM search_value")
+        for field in SEARCH_FIELDS:
+            conn.execute(f'''
+                INSERT INTO search_value (field, value, row_count)
+                SELECT '{field}', {field}, COUNT(*) FROM insurance WHERE {field} IS NOT NULL GROUP BY {field}
+            ''')
+        if self.full_text:
+            # Build the index again from search_value in one pass, in case it had drifted
+            conn.execute("INSERT INTO value_search (value_search) VALUES ('rebuild')")
+        conn.commit()
+        self._bump_generation()
+
+    def search_values(self, field, text, limit=SEARCH_LIMIT):
+        """
+        Find the values of a field matching what the user has typed so far, with the values most rows have first. Each
+        word typed matches the start of a word in the value, so "off bl" finds "Office Bldg". Only the distinct values
+        are searched, never the insurance table itself. Any other field the viewer can filter on is matched on the start
+        of its value instead, smallest first.
+        :param field: One of FILTER_FIELDS, usually one of SEARCH_FIELDS or PREFIX_SEARCH_FIELDS
+        :param text: What the user has typed, every value is a match when it is blank
+        :param limit: The most values to return
+        :return values: A list of at most limit matching values
+        """
+        if field not in FILTER_FIELDS:
+            raise ValueError(f'Cannot search {field}')
+        if field not in SEARCH_FIELDS:
+            text = text.strip()
+            return list(self._cached(("search", field, text, limit),
+                                     lambda: self._prefix_search(self._connect(), field, text, limit)))
+        words = text.split()
+
+        def read():
+            conn = self._connect()
+            if not words:
+                cursor = conn.execute('''SELECT value FROM search_value WHERE field = ?
+                                         ORDER BY row_count DESC, value LIMIT ?''', (field, limit))
+            elif self.full_text:
+                # Quote each word so nothing typed is read as FTS5 syntax, and match it as a prefix
+                match = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+                cursor = conn.execute('''SELECT search_value.value FROM value_search
+                                         JOIN search_value ON search_value.search_id = value_search.rowid
+                                         WHERE value_search MATCH ? AND search_value.field = ?
+                                         ORDER BY search_value.row_count DESC, search_value.value LIMIT ?''',
+                                      (match, field, limit))
+            else:
+                # Without FTS5 the text has to match the start of the value
+                pattern = " ".join(words).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                cursor = conn.execute('''SELECT value FROM search_value WHERE field = ? AND value LIKE ? ESCAPE '\\'
+                                         ORDER BY row_count DESC, value LIMIT ?''', (field, pattern, limit))
+            return [row[0] for row in cursor.fetchall()]
+
+        return list(self._cached(("search", field, " ".join(words).lower(), limit), read))
+
+    @staticmethod
+    def _prefix_search(conn, field, text, limit):
+        """
+        Find the values of a field that start with the text, reading only the field's index. A text value starting
+        with the text sorts between the text and the text with its last character bumped, so it is one range of the
+        index. The whole numbers starting with the digits typed are one range for each number of digits after them,
+        such as 12, then 120 to 129, then 1200 to 1299, so they take one small range of the index each.
+        :param conn: The connection to search on
+        :param field: One of FILTER_FIELDS
+        :param text: What the user has typed, every value is a match when it is blank
+        :param limit: The most values to return
+        :return values: A list of at most limit matching values, smallest first
+        """
+        query = f"SELECT DISTINCT {field} FROM insurance WHERE {field} >= ? AND {field} < ? ORDER BY {field} LIMIT ?"
+        if not text:
+            cursor = conn.execute(f"SELECT DISTINCT {field} FROM insurance WHERE {field} IS NOT NULL "
+                                  f"ORDER BY {field} LIMIT ?", (limit,))
+            return [row[0] for row in cursor.fetchall()]
+        if field not in INTEGER_FIELDS:
+            cursor = conn.execute(query, (text, text[:-1] + chr(ord(text[-1]) + 1), limit))
+            return [row[0] for row in cursor.fetchall()]
+
+        # Numbers are often typed with thousands separators
+        digits = text.replace(",", "")
+        # A number never starts with a 0 unless it is 0
+        if not digits.isdigit() or (digits.startswith("0") and digits != "0"):
+            return []
+        number = int(digits)
+        largest = conn.execute(f"SELECT MAX({field}) FROM insurance").fetchone()[0]
+        values = []
+        low, high = number, number + 1
+        while largest is not None and low <= largest and len(values) < limit:
+            cursor = conn.execute(query, (low, high, limit - len(values)))
+            values.extend(row[0] for row in cursor.fetchall())
+            if number == 0:
+                break
+            low, high = low * 10, high * 10
+        return values
+
+    def write_data(self, data, batch_size=5000):
+        """
+        Take in data and write the data to the sqlite database. The rows are written in batches inside a single
+        transaction, so the data can be a generator and never has to be held in memory all at once.
+        :param data: An iterable of rows to write to the database, or an Excel sheet
+        :param batch_size: The number of rows to send to sqlite in each executemany call
+        :return row_count: The number of rows that were read from the data
+        """
+        # Still accept an openpyxl sheet, skipping the header row like before
+        if hasattr(data, "iter_rows"):
+            data = data.iter_rows(min_row=2, values_only=True)
+
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        row_count = 0
+        rows = iter(data)
+        try:
+            # Pull the rows in batches and insert each batch into the "insurance" table with one call
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                cursor.executemany(INSERT_QUERY, batch)
+                row_count += len(batch)
+
+            # Commit the changes once all of the batches are in
+            conn.commit()
+            self._bump_generation()
+        except BaseException:
+            conn.rollback()
+            raise
+
+        return row_count
 
     def read_data(self):
         """
         Read in data from the sqlite database and return it
         :return data: A list of tuples containing data from the sqlite database
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-        select_query = "SELECT * FROM insurance"
-        cursor.execute(select_query)
-        data = cursor.fetchall()
-
-        conn.close()
-        return data
+        return self.read_filtered_data("*", None)
 
     def read_unique_data(self, field):
         """
@@ -124,17 +615,16 @@ class Database:
         :param field: The database field to get unique values from
         :return data: The unique values of the field
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
-
-        # Query the database for unique values in the selected field
-        cursor.execute(f"SELECT DISTINCT {field} FROM insurance")
-        data = [row[0] for row in cursor.fetchall()]
+        if field not in self.column_names:
+            raise ValueError(f'Cannot read unique values of {field}')
 
-        # Close the connection
-        conn.close()
+        def read():
+            # Query the database for unique values in the selected field
+            cursor = self._connect().execute(f"SELECT DISTINCT {field} FROM insurance")
+            return [row[0] for row in cursor.fetchall()]
 
-        return data
+        # Hand back a copy so the caller can sort it without changing the cached list
+        return list(self._cached(("unique", field, None), read))
 
     def read_filtered_data(self, field, value):
         """
@@ -143,16 +633,449 @@ class Database:
         :param value: The value to find duplicates of
         :return data: The rows containing the same value for the field
         """
-        conn = sqlite3.connect(self.db_name)
-        cursor = conn.cursor()
+        where, params = self._where(field, value)
+
+        def read():
+            # Fetch all the matching entries
+            return self._connect().execute(SELECT_ALL_QUERY + where, params).fetchall()
+
+        return list(self._cached(("filtered", field, value), read))
+
+    def _where(self, field, value):
+        """
+        Build the WHERE clause that selects the rows containing the same value for the field provided, or the rows
+        matching a query. Fields are checked against the columns of the insurance table before they go into the SQL.
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of, ignored for a query
+        :return where: A tuple of (clause, params), the clause is empty when every row is selected
+        """
+        if isinstance(field, Query):
+            clause, params = field.to_sql(self.column_names)
+            return f" WHERE {clause}", tuple(params)
         if field == "*":
-            cursor.execute("SELECT * FROM insurance")
+            return "", ()
+        if field not in self.column_names:
+            raise ValueError(f'Cannot filter on {field}')
+        return f" WHERE {field} = ?", (value,)
+
+    def iter_filtered_data(self, field="*", value=None, chunk_size=PAGE_SIZE, order_by=None, descending=False):
+        """
+        Stream the rows containing the same value for the field provided in chunks, without reading the whole result
+        into memory the way read_filtered_data does. Nothing is cached.
+        :param field: The field to select, or "*" for every row
+        :param value: The value to find duplicates of
+        :param chunk_size: The number of rows in each chunk
+        :param order_by: The field to sort the rows by, or None to return them in whatever order is quickest. Every
+        sort field is indexed, but sqlite may still have to sort the whole result when it filters with another index
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :return chunks: A generator of lists of rows
+        """
+        where, params = self._where(field, value)
+        order = ""
+        if order_by is not None:
+            if order_by not in SORT_FIELDS:
+                raise ValueError(f'Cannot sort by {order_by}')
+            direction = "DESC" if descending else "ASC"
+            order = f" ORDER BY {order_by} {direction}, insurance_id {direction}"
+        # A cursor of its own, so other queries on this connection do not disturb it
+        cursor = self._connect().cursor()
+        cursor.execute(SELECT_ALL_QUERY + where + order, params)
+        try:
+            while True:
+                chunk = cursor.fetchmany(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            cursor.close()
+
+    def export_data(self, path, field="*", value=None, file_format=None, order_by=None, descending=False,
+                    chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Write the rows containing the same value for the field provided to a CSV, JSON Lines, or Parquet file. The
+        rows are streamed from a cursor a chunk at a time, so memory use does not grow with the size of the result.
+        :param path: The file to write
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :param file_format: "csv", "jsonl", or "parquet", worked out from the file's extension if not given
+        :param order_by: The field to sort the rows by, or None to write them in whatever order is quickest
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :param chunk_size: The number of rows read from sqlite at a time
+        :return row_count: The number of rows written
+        """
+        # Imported here so the database does not load the export writers until they are needed
+        from export import export_chunks
+        chunks = self.iter_filtered_data(field, value, chunk_size, order_by=order_by, descending=descending)
+        return export_chunks(chunks, path, file_format, COLUMN_NAMES)
+
+    def count_filtered_data(self, field, value):
+        """
+        Count the rows containing the same value for the field provided
+        :param field: The field to select, or "*" to count every row
+        :param value: The value to find duplicates of
+        :return count: The number of rows containing the same value for the field
+        """
+        where, params = self._where(field, value)
+
+        def read():
+            cursor = self._connect().execute(f"SELECT COUNT(*) FROM insurance{where}", params)
+            return cursor.fetchone()[0]
+
+        return self._cached(("count", field, value), read)
+
+    def read_page(self, field="*", value=None, order_by="insurance_id", descending=False, after=None, offset=0,
+                  page_size=PAGE_SIZE):
+        """
+        Read one page of the rows containing the same value for the field provided, sorted by order_by. Pass the key
+        returned with one page as after to get the page that follows it, which sqlite finds with an index seek instead
+        of skipping over every earlier row. offset is only used when there is no key, such as when jumping straight to
+        the middle of the result.
+        :param field: The field to select, or "*" for every row
+        :param value: The value to find duplicates of
+        :param order_by: The field to sort the rows by
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :param after: The continuation key returned with the previous page, or None to start at offset
+        :param offset: The number of rows to skip when there is no continuation key
+        :param page_size: The most rows to return
+        :return page: A tuple of (rows, key). key is opaque and should only be passed back as after, it is None when
+                      there are no more rows
+        """
+        if order_by not in SORT_FIELDS:
+            raise ValueError(f'Cannot sort by {order_by}')
+        where, params = self._where(field, value)
+        direction = "DESC" if descending else "ASC"
+        comparison = "<" if descending else ">"
+
+        # Ties on the sort field are broken by insurance_id so every row has a unique position to continue from
+        if order_by == "insurance_id":
+            sort_key = "insurance_id"
+            order = f"insurance_id {direction}"
         else:
-            cursor.execute(f"SELECT * FROM insurance WHERE {field} = ?", (value,))
+            sort_key = f"({order_by}, insurance_id)"
+            order = f"{order_by} {direction}, insurance_id {direction}"
 
-        # Fetch all the matching entries
-        data = cursor.fetchall()
+        if after is not None:
+            where += " AND " if where else " WHERE "
+            if len(after) == 1:
+                where += f"insurance_id {comparison} ?"
+                params += tuple(after)
+            elif after[0] is None:
+                # sqlite puts NULLs first going up and last going down, and a comparison with NULL is never true.
+                # After a NULL, going up continues with the rest of the NULLs and then every value, going down it
+                # only has the rest of the NULLs left
+                rest = "" if descending else f" OR {order_by} IS NOT NULL"
+                where += f"(({order_by} IS NULL AND insurance_id {comparison} ?){rest})"
+                params += (after[1],)
+            else:
+                # Going down, the NULLs still come after every value
+                rest = f" OR {order_by} IS NULL" if descending else ""
+                where += f"({sort_key} {comparison} (?, ?){rest})"
+                params += tuple(after)
+            offset = 0
 
-        # Close the connection
-        conn.close()
-        return data
+        def read():
+            query = f"SELECT * FROM insurance{where} ORDER BY {order} LIMIT ? OFFSET ?"
+            rows = self._connect().execute(query, params + (page_size, offset)).fetchall()
+
+            # There are no more rows once a page comes back short
+            if len(rows) < page_size:
+                return rows, None
+            last = rows[-1]
+            if order_by == "insurance_id":
+                return rows, (last[0],)
+            return rows, (last[SORT_FIELDS.index(order_by)], last[0])
+
+        key = ("page", field, value, order_by, descending, after, offset, page_size)
+        rows, next_key = self._cached(key, read, size=lambda page: estimate_size(page[0]))
+        return list(rows), next_key
+
+    def _cached(self, key, read, size=estimate_size):
+        """
+        Return a query's result from the cache, or read it and store it in the cache if there is no current result
+        :param key: The cache key for the query, starting with the kind of query
+        :param read: A function that runs the query and returns its result
+        :param size: A function that estimates the size of the result in bytes
+        :return result: The result of the query
+        """
+        generation = self._current_generation()
+        result = self.cache.get(key, generation)
+        if result is None:
+            result = read()
+            self.cache.put(key, generation, result, size(result))
+        return result
+
+    def _current_generation(self):
+        """
+        Return the data generation, bumping it first if another connection has written to the database since it was
+        last checked. Every thread checks against the same connection, so a thread's first query sees the writes made
+        before it started.
+        :return generation: The current data generation
+        """
+        with self._lock:
+            if self._version_conn is None:
+                # A connection opened again after close() cannot tell what changed while there was none
+                if self._data_version is not None:
+                    self.generation += 1
+                self._version_conn = sqlite3.connect(self.db_name, check_same_thread=False)
+                self._data_version = None
+            # data_version changes whenever a different connection, in this process or another one, commits a change
+            version = self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._data_version is not None and version != self._data_version:
+                self.generation += 1
+            self._data_version = version
+            return self.generation
+
+    def _bump_generation(self):
+        """
+        Start a new data generation, which makes every cached result stale. Anything that changes the insurance table
+        has to call this.
+        :return None:
+        """
+        with self._lock:
+            self.generation += 1
+
+    def read_rollup(self, field):
+        """
+        Read the policy count and insured value totals for each value of a field from the rollup table. This only
+        reads one row per group, no matter how many rows are in the insurance table.
+        :param field: One of ROLLUP_FIELDS
+        :return rollup: A list of (value, count, sum, min, max) tuples sorted by value
+        """
+        if field not in ROLLUP_FIELDS:
+            raise ValueError(f'There is no rollup for {field}')
+
+        def read():
+            cursor = self._connect().execute('''SELECT value, row_count, value_sum, value_min, value_max
+                                                FROM insurance_rollup WHERE field = ? ORDER BY value''', (field,))
+            return cursor.fetchall()
+
+        return list(self._cached(("rollup", field, None), read))
+
+    def cache_stats(self):
+        """
+        Return the result cache's hit, miss, and size counters along with the current data generation
+        :return stats: A dict of the counters
+        """
+        stats = self.cache.stats()
+        stats["generation"] = self.generation
+        return stats
+
+    def read_manifest(self, source):
+        """
+        Read the size, modification time, and hash recorded for a source file the last time it was imported
+        :param source: The path of the source file
+        :return manifest: A tuple of (size, mtime, digest), or None if the file has never been imported
+        """
+        cursor = self._connect().execute("SELECT size, mtime, digest FROM source_manifest WHERE source = ?",
+                                         (source,))
+        return cursor.fetchone()
+
+    def write_manifest(self, source, size, mtime, digest):
+        """
+        Record the size, modification time, and hash of a source file that was just imported
+        :param source: The path of the source file
+        :param size: The size of the file in bytes
+        :param mtime: The modification time of the file in nanoseconds
+        :param digest: The hash of the file's contents
+        :return None:
+        """
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO source_manifest (source, size, mtime, digest) VALUES (?, ?, ?, ?)",
+                     (source, size, mtime, digest))
+        conn.commit()
+
+    def sync_data(self, rows, batch_size=5000):
+        """
+        Make the insurance table match the rows. Every row is fingerprinted and staged in a temporary table on disk,
+        then only the rows whose fingerprint changed are upserted and the policies that are no longer in the rows are
+        deleted.
+        :param rows: An iterable of every row in the source, in the same layout write_data takes
+        :param batch_size: The number of rows to send to sqlite in each executemany call
+        :return counts: A tuple of (rows read, rows inserted or updated, rows deleted)
+        """
+        conn = self._connect()
+        self._stage_on_disk(conn, True)
+        try:
+            row_count = self._stage_rows(conn, rows, batch_size)
+            upserted = self._upsert_staged(conn)
+
+            # Delete the policies that are no longer in the source
+            cursor = conn.execute("DELETE FROM insurance WHERE policy NOT IN (SELECT policy FROM sync_stage)")
+            deleted = cursor.rowcount
+            conn.execute("DELETE FROM row_fingerprint WHERE policy NOT IN (SELECT policy FROM sync_stage)")
+
+            conn.commit()
+            if upserted or deleted:
+                self._bump_generation()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.sync_stage")
+            self._stage_on_disk(conn, False)
+
+        return row_count, upserted, deleted
+
+    def upsert_data(self, rows, batch_size=5000):
+        """
+        Insert new rows and update the rows whose policy is already in the insurance table, leaving every other row
+        alone. Rows that have not changed since they were last written are skipped, the same way sync_data skips them.
+        The rows are held in a temporary table until they are written, so large sources should be sent in batches.
+        :param rows: An iterable of rows, in the same layout write_data takes
+        :param batch_size: The number of rows to send to sqlite in each executemany call
+        :return counts: A tuple of (rows read, rows inserted or updated)
+        """
+        conn = self._connect()
+        self._stage_on_disk(conn, True)
+        try:
+            row_count = self._stage_rows(conn, rows, batch_size)
+            upserted = self._upsert_staged(conn)
+            conn.commit()
+            if upserted:
+                self._bump_generation()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DROP TABLE IF EXISTS temp.sync_stage")
+            self._stage_on_disk(conn, False)
+
+        return row_count, upserted
+
+    def _stage_on_disk(self, conn, on_disk):
+        """
+        Move a connection's temporary tables to a file while rows are staged, and back to the temp_store in pragmas
+        afterwards. A whole workbook is staged before it is compared, so with temp tables in memory the import would
+        use more memory the bigger the workbook is. Changing temp_store drops the connection's temporary tables, so
+        this is only called when none are in use.
+        :param conn: The connection the rows are staged on
+        :param on_disk: True before staging, False once the staged rows are dropped
+        :return None:
+        """
+        conn.execute(f"PRAGMA temp_store = {'FILE' if on_disk else self.pragmas.get('temp_store', 'DEFAULT')}")
+
+    @staticmethod
+    def _stage_rows(conn, rows, batch_size):
+        """
+        Fingerprint rows and put them in the temporary sync_stage table. Only the first row for each policy is kept.
+        :param conn: The connection to stage the rows on
+        :param rows: An iterable of rows, in the same layout write_data takes
+        :param batch_size: The number of rows to send to sqlite in each executemany call
+        :return row_count: The number of rows read
+        """
+        # The NOT NULL constraints match the insurance table so INSERT OR IGNORE drops the same bad rows write_data
+        # would
+        conn.execute("DROP TABLE IF EXISTS temp.sync_stage")
+        conn.execute('''CREATE TEMP TABLE sync_stage
+                            (policy INTEGER NOT NULL UNIQUE,
+                            expiry TEXT NOT NULL,
+                            location TEXT NOT NULL,
+                            state TEXT NOT NULL,
+                            region TEXT NOT NULL,
+                            insurance_value INTEGER DEFAULT 0,
+                            construction TEXT NOT NULL,
+                            business_type TEXT NOT NULL,
+                            earthquake INTEGER DEFAULT 0,
+                            flood INTEGER DEFAULT 0,
+                            fingerprint BLOB NOT NULL);''')
+        stage_query = '''
+            INSERT OR IGNORE INTO sync_stage (policy, expiry, location, state, region, insurance_value, construction,
+            business_type, earthquake, flood, fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+
+        row_count = 0
+        rows = iter(rows)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            # Add a hash of each row's values to the end of it
+            conn.executemany(stage_query, (row + (_fingerprint(row),) for row in batch))
+            row_count += len(batch)
+        return row_count
+
+    @staticmethod
+    def _upsert_staged(conn):
+        """
+        Upsert the staged rows that are new or whose fingerprint changed since they were last written, and remember
+        their new fingerprints
+        :param conn: The connection the rows were staged on
+        :return upserted: The number of rows inserted or updated
+        """
+        # Rows are written in the order they were staged, so new rows get their insurance_id in source order
+        changed = '''
+            FROM sync_stage AS s LEFT JOIN row_fingerprint AS f ON f.policy = s.policy
+            WHERE f.fingerprint IS NOT s.fingerprint
+            ORDER BY s.rowid
+        '''
+        cursor = conn.execute(f'''
+            INSERT INTO insurance (policy, expiry, location, state, region, insurance_value, construction,
+            business_type, earthquake, flood)
+            SELECT s.policy, s.expiry, s.location, s.state, s.region, s.insurance_value, s.construction,
+            s.business_type, s.earthquake, s.flood {changed}
+            ON CONFLICT (policy) DO UPDATE SET expiry = excluded.expiry, location = excluded.location,
+            state = excluded.state, region = excluded.region, insurance_value = excluded.insurance_value,
+            construction = excluded.construction, business_type = excluded.business_type,
+            earthquake = excluded.earthquake, flood = excluded.flood
+        ''')
+        upserted = cursor.rowcount
+        conn.execute(f"INSERT OR REPLACE INTO row_fingerprint (policy, fingerprint) SELECT s.policy, s.fingerprint {changed}")
+        return upserted
+
+    def explain(self, query, params=()):
+        """
+        Return the steps of sqlite's query plan for a query
+        :param query: The SQL query to explain
+        :param params: The parameters for the query
+        :return plan: A list of the plan's steps, such as "SEARCH insurance USING INDEX idx_insurance_state (state=?)"
+        """
+        cursor = self._connect().execute(f"EXPLAIN QUERY PLAN {query}", params)
+        # The last column of each row is the human readable description of the step
+        return [row[-1] for row in cursor.fetchall()]
+
+    def advise_indexes(self):
+        """
+        Check that every query the viewer can issue is answered with an index. Filtering on a field has to search an
+        index, and finding the unique values of a field has to scan a covering index.
+        :return report: A list of (query, plan, uses_index) tuples, one for each query the viewer can issue
+        """
+        report = []
+        for field in FILTER_FIELDS:
+            filter_query = f"SELECT * FROM insurance WHERE {field} = ?"
+            plan = self.explain(filter_query, (None,))
+            report.append((filter_query, plan, any("USING" in step and "INDEX" in step for step in plan)))
+
+            distinct_query = f"SELECT DISTINCT {field} FROM insurance"
+            plan = self.explain(distinct_query)
+            report.append((distinct_query, plan, any("USING COVERING INDEX" in step for step in plan)))
+        return report
+
+
+def normalize_expiry(value):
+    """
+    Turn an expiry date into the YYYY-MM-DD text it is stored as, so dates sort correctly and date ranges can use the
+    index. Values that are not recognized as dates are left alone.
+    :param value: A datetime, a date, or text in one of DATE_FORMATS
+    :return expiry: The date as YYYY-MM-DD text
+    """
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, str):
+        text = value.strip()
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(text, date_format).date().isoformat()
+            except ValueError:
+                pass
+    return value
+
+
+def _fingerprint(row):
+    """
+    Hash the values of a row so changed rows can be found without comparing every column
+    :param row: A tuple of values for the insurance table
+    :return fingerprint: A 16 byte hash of the row
+    """
+    return hashlib.blake2b(repr(row).encode(), digest_size=16).digest()
@@ -0,0 +1,139 @@
+"""
+Streaming export of query results to CSV, JSON Lines, and Parquet files. Rows arrive in chunks from a cursor and are
+written out as they come, so exporting millions of rows uses no more memory than one chunk. Parquet needs pyarrow,
+the other formats work without it, and pyarrow is only imported when a Parquet file is written.
+"""
+import csv
+import json
+import os
+
+# The formats that can be exported, keyed on the file extensions that pick them
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+# The size of the buffer used when writing text files, big writes keep the export close to disk speed
+WRITE_BUFFER = 1024 * 1024
+# The number of rows gathered into each Parquet row group
+ROW_GROUP_SIZE = 100000
+# The type of each column in a Parquet file, any column not listed is stored as text
+PARQUET_TYPES = {"insurance_id": "int64", "policy": "int64", "insurance_value": "int64", "earthquake": "int8",
+                 "flood": "int8"}
+
+
+def format_for(path):
+    """
+    Work out the format to export to from a file's extension
+    :param path: The path of the file
+    :return file_format: One of the values of FORMATS
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Cannot export to {extension or "a file with no extension"}, use one of {", ".join(FORMATS)}')
+    return FORMATS[extension]
+
+
+def export_chunks(chunks, path, file_format, columns):
+    """
+    Write chunks of rows to a file. The rows are written to a temporary file next to the real one, which only
+    replaces it once every row is written, so a failed export never leaves half a file behind.
+    :param chunks: An iterable of lists of row tuples, such as database.Database.iter_filtered_data returns
+    :param path: The file to write
+    :param file_format: "csv", "jsonl", or "parquet", worked out from the file's extension if it is None
+    :param columns: The names of the columns, in the same order as the values in each row
+    :return row_count: The number of rows written
+    """
+    if file_format is None:
+        file_format = format_for(path)
+    writers = {"csv": _write_csv, "jsonl": _write_jsonl, "parquet": _write_parquet}
+    if file_format not in writers:
+        raise ValueError(f'Unknown export format {file_format}')
+    if file_format == "parquet":
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("Exporting to Parquet needs pyarrow, install it with pip install pyarrow") from None
+
+    partial = f"{path}.part"
+    try:
+        row_count = writers[file_format](chunks, partial, columns)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return row_count
+
+
+def _write_csv(chunks, path, columns):
+    """
+    Write chunks of rows to a CSV file with a header row
+    :param chunks: An iterable of lists of row tuples
+    :param path: The file to write
+    :param columns: The names of the columns
+    :return row_count: The number of rows written
+    """
+    row_count = 0
+    with open(path, "w", newline="", encoding="utf-8", buffering=WRITE_BUFFER) as fp:
+        writer = csv.writer(fp)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            row_count += len(chunk)
+    return row_count
+
+
+def _write_jsonl(chunks, path, columns):
+    """
+    Write chunks of rows to a JSON Lines file, one object per row keyed on the column names
+    :param chunks: An iterable of lists of row tuples
+    :param path: The file to write
+    :param columns: The names of the columns
+    :return row_count: The number of rows written
+    """
+    # One encoder for every row, without the spaces json.dumps adds by default
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+    row_count = 0
+    with open(path, "w", encoding="utf-8", buffering=WRITE_BUFFER) as fp:
+        for chunk in chunks:
+            # Join each chunk into one string so there is one write per chunk instead of one per row
+            fp.write("".join(encode(dict(zip(columns, row))) + "\n" for row in chunk))
+            row_count += len(chunk)
+    return row_count
+
+
+def _write_parquet(chunks, path, columns):
+    """
+    Write chunks of rows to a Parquet file. Chunks are gathered into row groups of about ROW_GROUP_SIZE rows so the
+    file does not end up with lots of tiny row groups.
+    :param chunks: An iterable of lists of row tuples
+    :param path: The file to write
+    :param columns: The names of the columns
+    :return row_count: The number of rows written
+    """
+    # Imported here so CSV and JSON Lines exports never pay for loading pyarrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([(column, getattr(pa, PARQUET_TYPES.get(column, "string"))()) for column in columns])
+    row_count = 0
+    pending = []
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            pending.extend(chunk)
+            row_count += len(chunk)
+            if len(pending) >= ROW_GROUP_SIZE:
+                writer.write_table(_parquet_table(pending, schema))
+                pending = []
+        if pending or row_count == 0:
+            writer.write_table(_parquet_table(pending, schema))
+    return row_count
+
+
+def _parquet_table(rows, schema):
+    """
+    Turn rows into a pyarrow table, column by column
+    :param rows: A list of row tuples
+    :param schema: The pyarrow schema of the table
+    :return table: A pyarrow.Table
+    """
+    import pyarrow as pa
+    values = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(values, schema)],
+                                schema=schema)
@@ -0,0 +1,303 @@
+"""
+Streaming import of the insurance workbook into the sqlite database. Rows are read lazily from a read-only workbook,
+the Y/N flags are converted to 1/0 as each row passes through, and the rows are handed to the database in batches so
+memory use stays flat no matter how large the workbook is.
+"""
+import glob
+import hashlib
+import itertools
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from database import normalize_expiry
+
+# The number of columns the insurance table expects from each row of the workbook
+COLUMN_COUNT = 10
+# The position of the expiry column in a row of the workbook
+EXPIRY_COLUMN = 1
+# The positions of the earthquake and flood columns in a row of the workbook
+FLAG_COLUMNS = (8, 9)
+# Map the Y/N values used in the workbook to the 1/0 values stored in the database
+FLAG_VALUES = {"Y": 1, "N": 0}
+# How long, in seconds, the writer waits on the queue before checking that the workers are still running
+QUEUE_TIMEOUT = 1
+
+# The queue a worker process puts its parsed batches on, set by _init_worker when the process starts
+_batches = None
+
+
+def normalize_row(row):
+    """
+    Trim a row from the workbook to the columns of the insurance table, store the expiry date as YYYY-MM-DD, and
+    replace "Y" with 1 and "N" with 0 in the earthquake and flood columns
+    :param row: A tuple of cell values from the workbook
+    :return row: The cleaned up tuple, or None if the row is empty
+    """
+    row = list(row[:COLUMN_COUNT])
+    # Skip the blank rows that read-only workbooks sometimes report at the end of a sheet
+    if not any(value is not None for value in row):
+        return None
+    # Pad short rows so they line up with the columns of the insurance table
+    row += [None] * (COLUMN_COUNT - len(row))
+    row[EXPIRY_COLUMN] = normalize_expiry(row[EXPIRY_COLUMN])
+    for index in FLAG_COLUMNS:
+        row[index] = FLAG_VALUES.get(row[index], row[index])
+    return tuple(row)
+
+
+def read_excel_rows(excel_file):
+    """
+    Lazily read the rows of a workbook, skipping the header row. The workbook is opened in read-only mode so only the
+    row currently being read is held in memory.
+    :param excel_file: The path to the workbook
+    :return rows: A generator of cleaned up row tuples
+    """
+    # Imported here since openpyxl is slow to import and only needed when a workbook is actually parsed
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        for row in sheet.iter_rows(min_row=2, values_only=True):
+            row = normalize_row(row)
+            if row is not None:
+                yield row
+    finally:
+        # Read-only workbooks keep the file open until they are closed
+        workbook.close()
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Hash the contents of a file in chunks so large files are never read into memory all at once
+    :param path: The path of the file to hash
+    :param chunk_size: The number of bytes to read at a time
+    :return digest: The hex sha256 of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sync_excel(database, excel_file=None, force=False, batch_size=5000):
+    """
+    Bring the database up to date with a workbook. If the workbook's size and modification time, or failing that its
+    hash, match what was recorded the last time it was imported, the workbook is not parsed at all. Otherwise only the
+    rows that changed are written and the rows that were removed are deleted.
+    :param database: The instance of database.Database to write to
+    :param excel_file: The path to the workbook, defaults to data.xlsx in the working directory
+    :param force: Parse the workbook even if it looks unchanged
+    :param batch_size: The number of rows to send to the database at a time
+    :return changed: True if the workbook was parsed and synced, False if it was skipped
+    """
+    if excel_file is None:
+        excel_file = os.path.join(os.getcwd(), "data.xlsx")
+    source = os.path.abspath(excel_file)
+    stat = os.stat(source)
+    manifest = database.read_manifest(source)
+
+    # The cheap check: the file has not been touched since the last import
+    if not force and manifest and manifest[:2] == (stat.st_size, stat.st_mtime_ns):
+        print(f'{os.path.basename(source)} is unchanged, skipping import')
+        return False
+
+    # The file was touched, but its contents may still be the same (it was copied or saved without edits)
+    digest = file_digest(source)
+    if not force and manifest and manifest[2] == digest:
+        database.write_manifest(source, stat.st_size, stat.st_mtime_ns, digest)
+        print(f'{os.path.basename(source)} is unchanged, skipping import')
+        return False
+
+    start = time.perf_counter()
+    row_count, upserted, deleted = database.sync_data(read_excel_rows(source), batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    database.write_manifest(source, stat.st_size, stat.st_mtime_ns, digest)
+
+    rate = row_count / elapsed if elapsed else 0
+    print(f'Synced {row_count} rows in {elapsed:.2f}s ({rate:,.0f} rows/s): {upserted} updated, {deleted} deleted')
+    return True
+
+
+def find_workbooks(source):
+    """
+    Find the workbooks to import
+    :param source: A directory, whose .xlsx files are all imported, or a glob pattern such as "incoming/*.xlsx"
+    :return paths: A sorted list of the absolute paths of the workbooks
+    """
+    if os.path.isdir(source):
+        source = os.path.join(source, "*.xlsx")
+    # Skip the lock files Excel leaves next to the workbooks it has open
+    return sorted(os.path.abspath(path) for path in glob.glob(source)
+                  if not os.path.basename(path).startswith("~$"))
+
+
+def _init_worker(batches):
+    """
+    Remember the queue the writer reads from. Runs once in every worker process of the pool.
+    :param batches: The multiprocessing.Queue shared with the writer
+    :return None:
+    """
+    global _batches
+    _batches = batches
+
+
+def _parse_workbook(path, known_digest, batch_size):
+    """
+    Parse a workbook in a worker process and put its cleaned up rows on the queue in batches. A message saying how
+    the file went always follows its last batch, and nothing a workbook does can stop the other workbooks.
+    :param path: The path of the workbook
+    :param known_digest: The hash recorded the last time the workbook was imported, or None
+    :param batch_size: The number of rows in each batch
+    :return None:
+    """
+    try:
+        stat = os.stat(path)
+        digest = file_digest(path)
+        manifest = (stat.st_size, stat.st_mtime_ns, digest)
+        # The file was touched, but its contents are the same as last time
+        if digest == known_digest:
+            _batches.put(("unchanged", path, manifest))
+            return
+        rows = read_excel_rows(path)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            _batches.put(("rows", path, batch))
+        _batches.put(("done", path, manifest))
+    except Exception as error:
+        _batches.put(("error", path, f'{type(error).__name__}: {error}'))
+
+
+def ingest_workbooks(database, source, processes=None, force=False, batch_size=5000, queue_size=None):
+    """
+    Import every workbook in a directory or matching a glob pattern. The workbooks are parsed in parallel by a pool of
+    worker processes, which send their rows through a bounded queue to this process, the only one that writes to the
+    database since sqlite allows one writer at a time. Rows are upserted, so a policy that shows up again is updated
+    and no rows are ever deleted. Workbooks that have not changed since they were last imported are skipped.
+
+    A workbook that fails to parse is reported and left out of the manifest so it is tried again next time, but the
+    other workbooks carry on. Batches it sent before failing stay written. That includes a worker process that dies
+    outright, for example when it runs out of memory on a huge workbook.
+    :param database: The instance of database.Database to write to
+    :param source: A directory or a glob pattern of workbooks
+    :param processes: The number of worker processes, defaults to the number of CPUs
+    :param force: Parse the workbooks even if they look unchanged
+    :param batch_size: The number of rows in each batch sent to the writer
+    :param queue_size: The most batches that can wait for the writer, defaults to two per worker
+    :return results: A tuple of (rows read for each imported workbook, error for each failed workbook), both dicts
+    keyed on the workbook's path
+    """
+    paths = find_workbooks(source)
+    imported = {}
+    failed = {}
+
+    # Leave out the workbooks that have not been touched since the last import
+    tasks = []
+    for path in paths:
+        stat = os.stat(path)
+        manifest = database.read_manifest(path)
+        if not force and manifest and manifest[:2] == (stat.st_size, stat.st_mtime_ns):
+            print(f'{os.path.basename(path)} is unchanged, skipping import')
+            continue
+        tasks.append((path, None if force or manifest is None else manifest[2], batch_size))
+    if not tasks:
+        return imported, failed
+
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    row_counts = {path: 0 for path, _, _ in tasks}
+    start = time.perf_counter()
+
+    upserted, broken = _run_workers(database, tasks, processes, queue_size, batch_size, row_counts, imported, failed)
+    # A worker process that dies takes the whole pool down with it, and there is no telling which of the files being
+    # parsed at the time killed it. Parse each of them again in a pool of its own, so only that file fails
+    for task in broken:
+        path = task[0]
+        row_counts[path] = 0
+        changed, still_broken = _run_workers(database, [task], 1, queue_size, batch_size, row_counts, imported, failed)
+        upserted += changed
+        if still_broken:
+            failed[path] = "The worker parsing this file stopped unexpectedly"
+            print(f'Error ocured - {os.path.basename(path)}: {failed[path]}')
+
+    elapsed = time.perf_counter() - start
+    row_count = sum(imported.values())
+    rate = row_count / elapsed if elapsed else 0
+    print(f'Imported {len(imported)} of {len(tasks)} workbooks, {row_count} rows in {elapsed:.2f}s '
+          f'({rate:,.0f} rows/s) with {processes} processes: {upserted} updated, {len(failed)} failed')
+    return imported, failed
+
+
+def _run_workers(database, tasks, processes, queue_size, batch_size, row_counts, imported, failed):
+    """
+    Parse workbooks in a pool of worker processes and write the batches they send back, as ingest_workbooks
+    describes. If a worker process dies the pool is broken, and the files that had not finished are handed back.
+    :param database: The instance of database.Database to write to
+    :param tasks: A list of (path, known digest, batch size) for each workbook to parse
+    :param processes: The number of worker processes
+    :param queue_size: The most batches that can wait for the writer, defaults to two per worker
+    :param batch_size: The number of rows in each call to upsert_data
+    :param row_counts: Maps each path to the rows written from it so far, added to as batches are written
+    :param imported: Maps each imported path to its row count, filled in as files finish
+    :param failed: Maps each failed path to its error, filled in as files fail
+    :return results: A tuple of (rows inserted or updated, the tasks that did not finish because the pool broke)
+    """
+    # Bounded, so the workers wait for the writer instead of piling parsed rows up in memory
+    batches = multiprocessing.Queue(maxsize=queue_size or processes * 2)
+    finished = set()
+    upserted = 0
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(batches,)) as pool:
+        futures = {pool.submit(_parse_workbook, *task): task for task in tasks}
+        while len(finished) < len(tasks):
+            # Checked before waiting, so every message a finished task sent has had a full timeout to arrive
+            stopped = all(future.done() for future in futures)
+            try:
+                kind, path, payload = batches.get(timeout=QUEUE_TIMEOUT)
+            except queue.Empty:
+                # Every task has returned or the pool broke, and some files never reported back
+                if stopped:
+                    break
+                continue
+
+            if kind == "rows":
+                # A file whose rows cannot be written is failed, and the rest of its batches are thrown away
+                if path in failed:
+                    continue
+                try:
+                    row_count, changed = database.upsert_data(payload, batch_size=batch_size)
+                except Exception as error:
+                    failed[path] = f'{type(error).__name__}: {error}'
+                    print(f'Error ocured - {os.path.basename(path)}: {failed[path]}')
+                    continue
+                row_counts[path] += row_count
+                upserted += changed
+                continue
+
+            finished.add(path)
+            progress = f'[{len(imported) + len(failed) + (path not in failed)}/{len(row_counts)}]'
+            name = os.path.basename(path)
+            if kind == "error":
+                failed[path] = payload
+                print(f'{progress} Error ocured - {name}: {payload}')
+            elif path not in failed:
+                database.write_manifest(path, *payload)
+                imported[path] = row_counts[path]
+                status = "unchanged" if kind == "unchanged" else f'{row_counts[path]} rows'
+                print(f'{progress} {name}: {status}')
+
+    broken = []
+    for future, task in futures.items():
+        if task[0] in finished or task[0] in failed:
+            continue
+        if isinstance(future.exception(), BrokenProcessPool):
+            broken.append(task)
+        else:
+            failed[task[0]] = "The worker parsing this file stopped unexpectedly"
+    return upserted, broken
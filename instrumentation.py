@@ -0,0 +1,400 @@
+"""
+Optional timing instrumentation for finding out where the viewer spends its time. Nothing here runs unless enable()
+is called: it wraps the methods listed in TARGETS with timers that record a latency histogram, row count, and bytes
+for every call, and logs the SQL and query plan of any call slower than a threshold. The methods are left exactly as
+they are otherwise, so instrumentation costs nothing when it is off.
+
+Turn it on from the command line with main.py --stats, or by setting DATA_VIEWER_STATS=1.
+"""
+import atexit
+import collections
+import datetime
+import functools
+import json
+import sys
+import threading
+import time
+
+from result_cache import estimate_size
+
+# The environment variable that turns instrumentation on when it is set to anything but 0
+ENABLED_VARIABLE = "DATA_VIEWER_STATS"
+# Calls slower than this many milliseconds are written to the slow query log
+SLOW_MS = 100
+# The most entries kept in the slow query log
+SLOW_LOG_SIZE = 200
+# The upper bounds, in microseconds, of the histogram buckets. Each bucket is twice as wide as the one before it,
+# from 16us up to about 67 seconds
+BUCKET_BOUNDS = tuple(2 ** power for power in range(4, 27))
+# The methods whose number result is the count of rows they wrote. Any other number, such as the one
+# count_filtered_data returns, is not counted as rows
+WRITE_METHODS = ("write_data", "sync_data", "upsert_data", "export_data")
+# The methods that are timed, as (module, class, methods). Classes from modules that have not been imported when
+# enable() is called are skipped, so enabling never imports tkinter or numpy on its own
+TARGETS = (
+    ("database", "Database", ("read_data", "read_unique_data", "read_filtered_data", "count_filtered_data",
+                              "read_page", "read_rollup", "write_data", "sync_data", "upsert_data", "export_data",
+                              "read_manifest", "write_manifest", "rebuild_rollups", "rebuild_search_index",
+                              "search_values", "advise_indexes", "close")),
+    ("columnar", "ColumnarDatabase", ("reload", "read_data", "read_unique_data", "read_filtered_data",
+                                      "count_filtered_data", "read_page", "export_data", "search_values")),
+    ("service", "ServiceClient", ("read_data", "read_unique_data", "read_filtered_data", "count_filtered_data",
+                                  "read_page", "read_rollup", "search_values", "export_data")),
+    ("paging", "PagedResult", ("_read_page",)),
+    ("virtual_table", "VirtualTable", ("_render",)),
+    ("viewer", "DbBrowser", ("_import_excel", "_update_data", "_show_data", "_create_table_rows")),
+)
+
+# The Recorder collecting timings, or None while instrumentation is off
+recorder = None
+
+# The SQL each thread has run during the instrumented call it is in, filled in by sqlite's trace callback
+_local = threading.local()
+
+
+class Histogram:
+    """
+    Class to count how long the calls to one method took, in buckets that double in width
+
+    Attributes:
+
+    - buckets :    :class:`list` --> The number of calls that fell into each of BUCKET_BOUNDS, and one more for slower calls
+    - bytes :    :class:`int` --> The estimated size of every result returned
+    - count :    :class:`int` --> The number of calls
+    - errors :    :class:`int` --> The number of calls that raised an exception
+    - last :    :class:`float` --> How long the most recent call took in seconds
+    - last_at :    :class:`float` --> When the most recent call finished, from time.monotonic()
+    - max :    :class:`float` --> The slowest call in seconds
+    - min :    :class:`float` --> The fastest call in seconds
+    - rows :    :class:`int` --> The number of rows returned or written by every call
+    - total :    :class:`float` --> The time taken by every call in seconds
+
+    Methods:
+
+    - add(seconds, rows, size) --> Count a call
+    - percentile(fraction) --> Estimate the time most calls finished within
+    - to_dict() --> Return the histogram in a form that can be written as JSON
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.last = 0.0
+        self.last_at = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def add(self, seconds, rows=0, size=0):
+        """
+        Count a call
+        :param seconds: How long the call took
+        :param rows: The number of rows it returned or wrote
+        :param size: The estimated size of its result in bytes
+        :return None:
+        """
+        microseconds = seconds * 1e6
+        index = 0
+        # There are only a couple dozen buckets, so walking them is quicker than anything cleverer
+        while index < len(BUCKET_BOUNDS) and microseconds > BUCKET_BOUNDS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.last = seconds
+        self.last_at = time.monotonic()
+        self.rows += rows
+        self.bytes += size
+
+    def percentile(self, fraction):
+        """
+        Estimate the time most calls finished within, from the upper bound of the bucket the percentile falls in
+        :param fraction: The fraction of calls, such as 0.95
+        :return seconds: The estimated time in seconds
+        """
+        wanted = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS, self.buckets):
+            seen += count
+            if seen >= wanted:
+                # The bound can be larger than the slowest call, which is known exactly
+                return min(bound / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Return the histogram in a form that can be written as JSON, with the times in milliseconds
+        :return histogram: A dict of the counters and the non-empty buckets
+        """
+        buckets = {f"<={bound / 1000:g}ms": count for bound, count in zip(BUCKET_BOUNDS, self.buckets) if count}
+        if self.buckets[-1]:
+            buckets[f">{BUCKET_BOUNDS[-1] / 1000:g}ms"] = self.buckets[-1]
+        return {"count": self.count, "errors": self.errors, "total_ms": self.total * 1e3,
+                "mean_ms": self.total / self.count * 1e3 if self.count else 0,
+                "min_ms": (self.min or 0) * 1e3, "p50_ms": self.percentile(0.5) * 1e3,
+                "p95_ms": self.percentile(0.95) * 1e3, "max_ms": self.max * 1e3, "rows": self.rows,
+                "bytes": self.bytes, "buckets": buckets}
+
+
+class Recorder:
+    """
+    Class to collect the timings of every instrumented call and the slow query log
+
+    Attributes:
+
+    - histograms :    :class:`dict` --> Maps each instrumented method's name to its Histogram
+    - slow_log :    :class:`collections.deque` --> The most recent calls that took longer than slow_ms
+    - slow_ms :    :class:`float` --> Calls slower than this many milliseconds are logged
+    - started :    :class:`str` --> When instrumentation was turned on
+
+    Methods:
+
+    - record(name, seconds, result) --> Count a call and the rows and bytes it returned
+    - record_error(name, seconds) --> Count a call that raised an exception
+    - log_slow(name, seconds, statements, database) --> Add a slow call to the slow query log
+    - last(prefix) --> Return how long the most recent call to any method starting with prefix took
+    - to_dict() --> Return every timing in a form that can be written as JSON
+    - dump(path) --> Write every timing to a JSON file
+    - summary() --> Return a short table of the methods that took the most time
+    """
+
+    def __init__(self, slow_ms=SLOW_MS):
+        self.slow_ms = slow_ms
+        self.histograms = collections.defaultdict(Histogram)
+        self.slow_log = collections.deque(maxlen=SLOW_LOG_SIZE)
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        # Calls are recorded from the Tk thread and the query workers at the same time
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, result=None):
+        """
+        Count a call and the rows and bytes it returned
+        :param name: The name of the method, such as "Database.read_page"
+        :param seconds: How long the call took
+        :param result: What the call returned, used to count rows and bytes
+        :return None:
+        """
+        rows, size = _measure(name, result)
+        with self._lock:
+            self.histograms[name].add(seconds, rows, size)
+
+    def record_error(self, name, seconds):
+        """
+        Count a call that raised an exception
+        :param name: The name of the method
+        :param seconds: How long the call took before it raised
+        :return None:
+        """
+        with self._lock:
+            histogram = self.histograms[name]
+            histogram.add(seconds)
+            histogram.errors += 1
+
+    def log_slow(self, name, seconds, statements, database=None):
+        """
+        Add a slow call to the slow query log, with the SQL it ran and sqlite's plan for each query
+        :param name: The name of the method
+        :param seconds: How long the call took
+        :param statements: The queries the call ran, with the parameters filled in
+        :param database: The database.Database the call was made on, used to explain the queries
+        :return None:
+        """
+        queries = []
+        # Only keep the last few distinct queries of a long call
+        for sql in list(dict.fromkeys(statements))[-5:]:
+            plan = None
+            if database is not None and hasattr(database, "explain") and sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                try:
+                    plan = database.explain(sql)
+                except Exception as error:
+                    plan = [f'Could not explain - {error}']
+            queries.append({"sql": " ".join(sql.split()), "plan": plan})
+        entry = {"at": datetime.datetime.now().isoformat(timespec="milliseconds"), "name": name,
+                 "ms": seconds * 1e3, "queries": queries}
+        with self._lock:
+            self.slow_log.append(entry)
+
+    def last(self, prefix):
+        """
+        Return how long the most recent call to any method starting with prefix took
+        :param prefix: The start of the method names, such as "Database.", or a tuple of them
+        :return last: A tuple of (name, seconds), or None if nothing matching has been called
+        """
+        with self._lock:
+            calls = [(histogram.last_at, name, histogram.last) for name, histogram in self.histograms.items()
+                     if name.startswith(prefix)]
+        if not calls:
+            return None
+        _, name, seconds = max(calls)
+        return name, seconds
+
+    def to_dict(self):
+        """
+        Return every timing in a form that can be written as JSON
+        :return stats: A dict of the histograms and the slow query log
+        """
+        with self._lock:
+            return {"started": self.started, "slow_ms": self.slow_ms,
+                    "operations": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+                    "slow_queries": list(self.slow_log)}
+
+    def dump(self, path):
+        """
+        Write every timing to a JSON file
+        :param path: The file to write
+        :return None:
+        """
+        try:
+            with open(path, "w") as fp:
+                json.dump(self.to_dict(), fp, indent=2, default=str)
+        except OSError as error:
+            print(f'Error ocured - {error}')
+
+    def summary(self, limit=10):
+        """
+        Return a short table of the methods that took the most time altogether
+        :param limit: The most methods to include
+        :return lines: A list of lines of text
+        """
+        with self._lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+            lines = [f'{"method":<36} {"calls":>7} {"total ms":>10} {"p95 ms":>9} {"rows":>10}']
+            for name, histogram in histograms:
+                lines.append(f'{name:<36} {histogram.count:>7} {histogram.total * 1e3:>10.1f} '
+                             f'{histogram.percentile(0.95) * 1e3:>9.1f} {histogram.rows:>10}')
+        return lines
+
+
+def enable(slow_ms=SLOW_MS, dump_path=None):
+    """
+    Turn instrumentation on by wrapping every method in TARGETS whose module has been imported. Call it before any
+    database.Database is opened, so its connections can be traced for the slow query log.
+    :param slow_ms: Calls slower than this many milliseconds are written to the slow query log
+    :param dump_path: A JSON file to write the timings to when the program exits, or None to not write one
+    :return recorder: The Recorder collecting the timings
+    """
+    global recorder
+    if recorder is not None:
+        return recorder
+    recorder = Recorder(slow_ms)
+
+    for module_name, class_name, methods in TARGETS:
+        module = sys.modules.get(module_name)
+        if module_name == "database":
+            # The database is always instrumented, and importing it is cheap
+            import database as module
+        cls = getattr(module, class_name, None) if module else None
+        if cls is None:
+            continue
+        for method in methods:
+            _wrap(cls, method, f"{class_name}.{method}")
+        if class_name == "Database":
+            _trace_connections(cls)
+
+    if dump_path:
+        atexit.register(recorder.dump, dump_path)
+    return recorder
+
+
+def _wrap(cls, method, name):
+    """
+    Replace a method of a class with one that times every call
+    :param cls: The class
+    :param method: The name of the method
+    :param name: The name the timings are recorded under
+    :return None:
+    """
+    function = getattr(cls, method)
+    # Static methods have to stay static once they are wrapped
+    static = isinstance(cls.__dict__.get(method), staticmethod)
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        statements = _local.__dict__.setdefault("statements", [])
+        mark = len(statements)
+        _local.depth = getattr(_local, "depth", 0) + 1
+        start = time.perf_counter()
+        try:
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            # Skip the PRAGMAs and transaction statements
+            ran = [sql for sql in statements[mark:] if _is_query(sql)]
+        except BaseException:
+            recorder.record_error(name, time.perf_counter() - start)
+            raise
+        finally:
+            _local.depth -= 1
+            # The outermost instrumented call clears the statements, even when it raised, so the list does not grow
+            # forever
+            if _local.depth == 0:
+                del statements[:]
+        recorder.record(name, seconds, result)
+        if seconds * 1e3 >= recorder.slow_ms and ran:
+            recorder.log_slow(name, seconds, ran, args[0] if args and not static else None)
+        return result
+
+    setattr(cls, method, staticmethod(timed) if static else timed)
+
+
+def _trace_connections(cls):
+    """
+    Wrap database.Database._connect so every new connection reports the SQL it runs to the slow query log
+    :param cls: The database.Database class
+    :return None:
+    """
+    connect = cls._connect
+
+    @functools.wraps(connect)
+    def traced_connect(self):
+        new = getattr(self._local, "conn", None) is None
+        conn = connect(self)
+        if new:
+            conn.set_trace_callback(_trace)
+        return conn
+
+    cls._connect = traced_connect
+
+
+def _trace(statement):
+    """
+    Remember a statement sqlite ran, if it ran inside an instrumented call
+    :param statement: The SQL, with the parameters filled in
+    :return None:
+    """
+    if getattr(_local, "depth", 0):
+        _local.statements.append(statement)
+
+
+def _is_query(sql):
+    """
+    Return True if a statement reads or writes rows, rather than being a PRAGMA, a transaction, or an EXPLAIN
+    :param sql: The statement
+    :return query: True if the statement should go in the slow query log
+    """
+    return sql.lstrip().upper().startswith(("SELECT", "WITH", "INSERT", "UPDATE", "DELETE"))
+
+
+def _measure(name, result):
+    """
+    Count the rows and estimate the bytes in a method's result
+    :param name: The name of the method, such as "Database.read_page"
+    :param result: What the method returned
+    :return measured: A tuple of (rows, bytes)
+    """
+    if isinstance(result, list):
+        return len(result), estimate_size(result)
+    # read_page returns (rows, key)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0]), estimate_size(result[0])
+    if name.rsplit(".", 1)[-1] in WRITE_METHODS:
+        # sync_data and upsert_data return the number of rows read first
+        if isinstance(result, tuple) and result and isinstance(result[0], int):
+            return result[0], 0
+        if isinstance(result, int) and not isinstance(result, bool):
+            return result, 0
+    return 0, 0
@@ -9,310 +9,282 @@
 """
 This program reads in data from an Excel file and stores it in a SQLite db. The program then reads in data from the db
 and displays it as a table using TKinter. The program then allows the user to filter the data.
+
+Run with no arguments to open the viewer, or with a command to work with the data without a display:
+
+    python main.py ingest
+    python main.py ingest --source "incoming/*.xlsx" --processes 8
+    python main.py query --field state --value CA
+    python main.py export california.csv --field state --value CA
+    python main.py distinct state
+    python main.py search location "spring"
+    python main.py stats --field region
+    python main.py --stats query --field state --value CA --count
+
+Several viewers on one machine can share one database by starting the query service once and attaching to it:
+
+    python main.py serve --address 127.0.0.1:8765
+    python main.py view --connect 127.0.0.1:8765
 """
+import argparse
+import atexit
+import contextlib
 import os
-import tkinter as tk
-from tkinter import *
-from tkinter import ttk
-from database import Database
-from openpyxl import load_workbook
+import sqlite3
+import sys
+import time
+
+import instrumentation
 
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
+# The folder the program lives in, data.xlsx and the database are kept next to it
+PROGRAM_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 ##########
 # The following area should only contain Functions and Classes
 ##########
 
-class DbBrowser:
+def _open_database(args):
     """
-    Overall class to manage the insurance viewer behavior
-
-    Attributes:
-
-    - data :    :class:`list` --> A list of data from from the sqlite database
-    - database :    :class:`database.Database` --> An instance of the database class
-    - entry_count :    :class:`tkinter.Label` --> The label that displays how many results are showing
-    - entry_count_label :    :class:`tkinter.Label` --> The label that labels the entry count
-    - entry_count_var :    :class:`tkinter.StringVar` --> The variable of the entry count, allowing for the label to be changed
-    - field_mapping :    :class:`dict` --> A dictionary to easily take the table's column and get the sqlite field equivalent
-    - filtered_data :    :class:`list` --> A list of data that has been filtered based on the selected filters
-    - primary_filter :    :class:`tkinter.StringVar` --> String variable for the primary filter
-    - primary_filter_label :    :class:`tkinter.Label` --> Label for the primary filter
-    - primary_filter_menu :    :class:`tkinter.OptionMenu` --> The drop down menu allowing users to select a filter
-    - root :    :class:`tk.Tk` --> Instance of tk
-    - secondary_filter :    :class:`tkinter.StringVar` --> The string variable for the secondary filter
-    - secondary_filter_label :    :class:`tkinter.Label` --> The label for the secondary filter
-    - secondary_filter_menu :    :class:`tkinter.OptionMenu` --> The drop down menu for the secondary filter
-    - secondary_menu_options :    :class:`list` --> A list containing the possible options for the secondary filter
-    - table :    :class:`tkinter.ttk.Treeview` --> A treeview instance that is used to create a table
-    - title_label :    :class:`tkinter.Label` --> A label that titles the screen
-
-    Methods:
-    - _import_excel() --> Import data from the excel file. convert y/n to 1/0
-    - _update_db() --> Create an instance of Database, pull data from the excel file to ensure the most up-to-date data, store the data in the database
-    - _window_setup() --> Set up basic parts of the TKinter window, such as the window title, the size, and resizeability
-    - _display_tkinter_widgets() --> Display all of the tkinter widgets, including labels, the drop down menus, and the table
-    - _filter_widgets() --> Set up the two filter widgets
-    - _update_second_dropdown(*args) --> When a primary filter is selected, update the options of the secondary filter.
-    - _update_data(*args) --> Update the table to show the filtered data
-    - _create_table_rows(data) --> Generate rows for the treeview table
-    - _data_table(data) --> Draw the data table
+    Open the database named on the command line
+    :param args: The parsed command line
+    :return database: A database.Database
     """
-    def __init__(self):
-        # Put the current version of data.xlsx into the database
-        self._update_db()
-        # Read and store the data from the insurance table
-        self.data = self.database.read_data()
-        # Initialize things such as screen size, window title, and resizability
-        self._window_setup()
-        # Display all of the tkinter widgets
-        self._display_tkinter_widgets()
-        # Main tkinter loop
-        self.root.mainloop()
-
-    # This function has no use outside of being used by this class, so I am making it a static method to make the
-    # squiggly lines go away telling me to make it a function instead of a method
-    @staticmethod
-    def _import_excel():
-        """
-        Import data from the excel file. convert y/n to 1/0
-        :return sheet: The data from the excel file
-        """
-        excel_file = os.path.join(os.getcwd(), "data.xlsx")
-        workbook = load_workbook(excel_file)
-        sheet = workbook.active
-        # Iterate through rows in the Excel sheet
-        for row in sheet.iter_rows(min_row=2, max_row=sheet.max_row, min_col=sheet.min_column,
-                                   max_col=sheet.max_column):
-            # Replace "Y" with 1 and "N" with 0 in the earthquake and flood table
-            if row[8].value == "Y":
-                row[8].value = 1
-            elif row[8].value == "N":
-                row[8].value = 0
-
-            if row[9].value == "Y":
-                row[9].value = 1
-            elif row[9].value == "N":
-                row[9].value = 0
-        return sheet
-
-    def _update_db(self):
-        """
-        Create an instance of Database, pull data from the excel file to ensure the most up-to-date data, store the data in the database
-        :return None:
-        """
-        # Create and store an instance of the Database class
-        self.database = Database()
-        # Read in the Excel data
-        fresh_data = self._import_excel()
-        # Write the Excel data to the insurance table
-        self.database.write_data(fresh_data)
-
-    def _window_setup(self):
-        """
-        Set up basic parts of the TKinter window, such as the window title, the size, and resizeability
-        :return None:
-        """
-        # Create an instance of TKinter
-        self.root = tk.Tk()
-        # Set the title of the window
-        self.root.title("CISP253 - Final Project")
-        # Set the size of the window
-        self.root.minsize(width=1280, height=720)
-        # Remove the ability to resize the window because I used absolute coords to place the scroll bar for the data
-        self.root.resizable(width=0, height=0)
-
-    def _display_tkinter_widgets(self):
-        """
-        Display all of the tkinter widgets, including labels, the drop down menus, and the table
-        :return None:
-        """
-        root = self.root
-
-        # Create a label for the window
-        self.title_label = tk.Label(root, text="Insurance Data Viewer", font=("Helvetica", 42, "bold"))
-        # Place the label at the top middle of the screen
-        self.title_label.pack(side="top", pady=20)
-
-        # Draw the dropdown menus
-        self._filter_widgets()
-
-        # Draw the number of entries labels
-        self.entry_count_label = tk.Label(root, text="# of Entries", font=("Helvetica", 16))
-        self.entry_count_label.place(x=1000, y=170)
-
-        # Draw the number of entries
-        self.entry_count_var = tk.StringVar()
-        self.entry_count_var.set(str(len(self.data)))
-        self.entry_count = tk.Label(root, textvariable=self.entry_count_var, font=("Helvetica", 12, "bold"))
-        self.entry_count.place(x=1045, y=200)
-
-        # Draw the data table
-        self._data_table()
-
-    def _filter_widgets(self):
-        """
-        Set up the two filter widgets
-        :return None:
-        """
-        root = self.root
-
-        # Dictionary mapping table column names to SQLite fields
-        self.field_mapping = {
-            "All": "*",
-            "Policy": "policy",
-            "Expiry": "expiry",
-            "Location": "location",
-            "State": "state",
-            "Region": "region",
-            "Insured Value": "insurance_value",
-            "Construction": "construction",
-            "Business Type": "business_type",
-            "Earthquake": "earthquake",
-            "Flood": "flood"
-        }
-        # Create and set up the primary dropdown menu
-        self.primary_filter = StringVar(root)
-        self.primary_filter.set("All")
-        self.primary_filter.trace_add("write", self._update_second_dropdown)
-        self.primary_filter_menu = OptionMenu(root, self.primary_filter, *self.field_mapping.keys())
-        self.primary_filter_menu.place(x=180, y=200, width=165)
-
-        # Create and set up the second dropdown menu
-        self.secondary_filter = tk.StringVar()
-        self.secondary_filter.trace_add("write", self._update_data)
-        self.secondary_filter_menu = tk.OptionMenu(root, self.secondary_filter, "")
-        self.secondary_filter_menu.place(x=550, y=200, width=195)
-
-        # Create a label for the primary filter
-        self.primary_filter_label = tk.Label(root, text="Select First Filter", font=("Helvetica", 16))
-        # Place the label above the primary filter menu
-        self.primary_filter_label.place(x=180, y=170)
-
-        # Create a label for the secondary filter
-        self.secondary_filter_label = tk.Label(root, text="Select Second Filter", font=("Helvetica", 16))
-        # Place the label above the secondary filter menu
-        self.secondary_filter_label.place(x=550, y=170)
-
-    def _update_second_dropdown(self, *args):
-        """
-        When a primary filter is selected, update the options of the secondary filter.
-        :param args:
-        :return None:
-        """
-        # Get the currently selected primary filter
-        selected_field = self.primary_filter.get()
-        # Get the SQLite field associated with the selected display name
-        sqlite_field = self.field_mapping[selected_field]
-        # If the filter is "All", disable the secondary filter
-        if selected_field == "All":
-            self.secondary_filter.set("")
-            self.secondary_filter_menu.config(state="disabled")
-        else:
-            # Change the binary options of earthquake and flood to the more user friendly yes/no
-            if sqlite_field == "earthquake" or sqlite_field == "flood":
-                self.secondary_menu_options = ["Yes", "No"]
-            else:
-                # Pull the unique values for the field from the database
-                self.secondary_menu_options = self.database.read_unique_data(sqlite_field)
-
-            # Enable the second dropdown menu and update its options
-            self.secondary_filter_menu.config(state="normal")
-
-            # Sort the values alphabetically
-            self.secondary_menu_options.sort()
-
-            # Update the options
-            # Retrieve the menu object
-            menu = self.secondary_filter_menu["menu"]
-            # Clear the existing options in the menu
-            menu.delete(0, "end")
-            # Loop over the unique values
-            for value in self.secondary_menu_options:
-                #  Associate each menu option with the self.secondary_filter and set its value to the current value.
-                #  This is a way to update the variable (self.secondary_filter) when an option is selected from the
-                #  dropdown menu
-                menu.add_command(label=value, command=tk._setit(self.secondary_filter, value))
-
-    def _update_data(self, *args):
-        """
-        Update the table to show the filtered data
-        :param args:
-        :return None:
-        """
-        # if the secondary filter is "yes", replace it with 1 (the db value) and "no" with 0
-        if self.secondary_filter.get() == "Yes":
-            self.filtered_data = self.database.read_filtered_data(self.field_mapping[self.primary_filter.get()], 1)
-        elif self.secondary_filter.get() == "No":
-            self.filtered_data = self.database.read_filtered_data(self.field_mapping[self.primary_filter.get()], 0)
-        # Otherwise, just pull the data from the db based on the selected filters
+    # Imported here so printing the help does not even have to load sqlite
+    from database import Database
+    # Send the messages printed while the database is set up to stderr, so stdout only holds the command's output
+    with contextlib.redirect_stdout(sys.stderr):
+        return Database(args.db)
+
+
+def _print_rows(rows):
+    """
+    Print rows as tab separated lines
+    :param rows: An iterable of tuples
+    :return None:
+    """
+    write = sys.stdout.write
+    for row in rows:
+        write("\t".join("" if item is None else str(item) for item in row) + "\n")
+
+
+def view_command(args):
+    """
+    Open the viewer window
+    :param args: The parsed command line
+    :return None:
+    """
+    # The viewer finds data.xlsx in the current folder, so --db is made absolute before leaving the folder it is
+    # relative to
+    db_name = os.path.abspath(args.db)
+    os.chdir(PROGRAM_DIR)
+    # Imported here so the other commands never load tkinter
+    from viewer import DbBrowser
+    DbBrowser(engine=args.engine, service=args.connect, db_name=db_name)
+
+
+def serve_command(args):
+    """
+    Bring the database up to date with the workbook once, then answer queries from viewers until interrupted
+    :param args: The parsed command line
+    :return None:
+    """
+    from ingest import sync_excel
+    from service import make_server
+    with _open_database(args) as database:
+        if not args.no_ingest and os.path.exists(args.file):
+            with contextlib.redirect_stdout(sys.stderr):
+                sync_excel(database, args.file)
+        server = make_server(database, args.address)
+        print(f'Serving {os.path.abspath(args.db)} on {args.address}, press Ctrl+C to stop', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+def ingest_command(args):
+    """
+    Bring the database up to date with a workbook, or import a directory of workbooks in parallel
+    :param args: The parsed command line
+    :return None:
+    """
+    from ingest import ingest_workbooks, sync_excel
+    with _open_database(args) as database:
+        if args.source:
+            _, failed = ingest_workbooks(database, args.source, processes=args.processes, force=args.force)
+            if failed:
+                raise ValueError(f'{len(failed)} workbooks could not be imported')
         else:
-            self.filtered_data = self.database.read_filtered_data(self.field_mapping[self.primary_filter.get()],
-                                                                  self.secondary_filter.get())
-        # If the table exists
-        if self.table:
-            # Wipe all the rows
-            self.table.delete(*self.table.get_children())
-            # Generate the new table rows
-            self._create_table_rows(self.filtered_data)
-            # Set the entry count based on how many rows are found
-            self.entry_count_var.set(str(len(self.filtered_data)))
-
-    def _create_table_rows(self, data):
-        """
-        Generate rows for the treeview table
-        :param data: a list of tuples
-        :return None:
-        """
-        for row in data:
-            # Remove the last 2 items in the row
-            cut_tuple = row[:-2]
-            # Replace 1s and 0s with checked or unchecked boxes
-            if (row[9] == 1) and (row[10] == 1):
-                cut_tuple += ("☑", "☑")
-            elif row[9] == 0 and row[10] == 0:
-                cut_tuple += ("☐", "☐")
-            elif row[9] == 1 and row[10] == 0:
-                cut_tuple += ("☑", "☐")
-            elif row[9] == 0 and row[10] == 1:
-                cut_tuple += ("☐", "☑")
-            # Insert the row into the table
-            self.table.insert("", "end", text=cut_tuple[0], values=cut_tuple[1:])
-
-    def _data_table(self):
-        """
-        Draw the data table
-        :return None:
-        """
-        # Check to see if the table exists already
-        root = self.root
-        # Calculate the number of rows that can fit in 2/5ths of the screen height
-        height_of_table = ((root.winfo_reqheight() // 5) * 2) // 5
-
-        # Create an instance of Treeview that will be used as a table
-        self.table = ttk.Treeview(root, height=height_of_table)
-        table = self.table
-
-        # Make a scroll bar for the data
-        scroll = ttk.Scrollbar(root, orient="vertical", command=table.yview)
-        scroll.place(x=1265, y=399, height=720 - 399)
-        table.configure(yscrollcommand=scroll.set)
-
-        # Name the columns of the table
-        table['columns'] = ("Policy", "Expiry", "Location", "State", "Region", "Insured Value", "Construction",
-                            "Business Type", "Earthquake", "Flood")
-        table.column("#0", width=110, anchor=CENTER)
-        table.heading("#0", text="#")
-        for col in table["columns"]:
-            table.column(col, width=110, anchor=CENTER)
-            table.heading(col, text=col.title())
-
-        # Create the rows
-        self._create_table_rows(self.data)
-
-        # Pack the table to the bottom of the screen and let it span across the x axis and fill from it's height
-        table.pack(fill="both", side="bottom")
+            sync_excel(database, args.file, force=args.force)
+
+
+def query_command(args):
+    """
+    Print the rows matching a filter, reading them a page at a time
+    :param args: The parsed command line
+    :return None:
+    """
+    if args.field != "*" and args.value is None:
+        raise ValueError("--value is needed with --field")
+    with _open_database(args) as database:
+        if args.count:
+            print(database.count_filtered_data(args.field, args.value))
+            return
+        if args.header:
+            from database import COLUMN_NAMES
+            _print_rows([COLUMN_NAMES])
+        remaining = args.limit
+        key = None
+        while remaining is None or remaining > 0:
+            page_size = 500 if remaining is None else min(500, remaining)
+            rows, key = database.read_page(args.field, args.value, order_by=args.order_by,
+                                           descending=args.descending, after=key, page_size=page_size)
+            _print_rows(rows)
+            if remaining is not None:
+                remaining -= len(rows)
+            if key is None or len(rows) < page_size:
+                break
+
+
+def export_command(args):
+    """
+    Write the rows where a field has a value to a CSV, JSON Lines, or Parquet file
+    :param args: The parsed command line
+    :return None:
+    """
+    if args.field != "*" and args.value is None:
+        raise ValueError("--value is needed with --field")
+    with _open_database(args) as database:
+        start = time.perf_counter()
+        row_count = database.export_data(args.path, args.field, args.value, file_format=args.format,
+                                         order_by=args.order_by, descending=args.descending)
+        elapsed = time.perf_counter() - start
+    size = os.path.getsize(args.path)
+    rate = size / elapsed / 1e6 if elapsed else 0
+    print(f'Exported {row_count} rows to {args.path} in {elapsed:.2f}s ({size:,} bytes, {rate:.0f} MB/s)',
+          file=sys.stderr)
+
+
+def distinct_command(args):
+    """
+    Print the unique values of a field
+    :param args: The parsed command line
+    :return None:
+    """
+    with _open_database(args) as database:
+        _print_rows((value,) for value in sorted(database.read_unique_data(args.field)))
+
+
+def search_command(args):
+    """
+    Print the values of a field that match the text, the way the viewer's search box finds them
+    :param args: The parsed command line
+    :return None:
+    """
+    with _open_database(args) as database:
+        _print_rows((value,) for value in database.search_values(args.field, args.text, args.limit))
+
+
+def stats_command(args):
+    """
+    Print how many rows the database holds, and the totals for each value of a field if one is given
+    :param args: The parsed command line
+    :return None:
+    """
+    with _open_database(args) as database:
+        print(f'database\t{os.path.abspath(args.db)}')
+        print(f'size\t{os.path.getsize(args.db):,} bytes')
+        print(f'rows\t{database.count_filtered_data("*", None):,}')
+        if args.field:
+            print()
+            _print_rows([(args.field, "policies", "total_insured", "min", "max")])
+            _print_rows(database.read_rollup(args.field))
+
+
+def build_parser():
+    """
+    Build the parser for the command line
+    :return parser: An argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=os.path.join(PROGRAM_DIR, "insurance_data.db"),
+                        help="The sqlite database to use (default: insurance_data.db next to main.py)")
+    parser.add_argument("--stats", action="store_true",
+                        help=f"Time every query and draw, the same as setting {instrumentation.ENABLED_VARIABLE}=1")
+    parser.add_argument("--stats-file", default="viewer_stats.json",
+                        help="The JSON file the timings are written to on exit when --stats is on")
+    parser.add_argument("--slow-ms", type=float, default=instrumentation.SLOW_MS,
+                        help="Log the SQL and query plan of calls slower than this many milliseconds")
+    subparsers = parser.add_subparsers(dest="command")
+
+    view = subparsers.add_parser("view", help="Open the viewer window, the default when no command is given")
+    view.add_argument("--engine", choices=("sqlite", "columnar"), default=os.environ.get("DATA_VIEWER_ENGINE", "sqlite"),
+                      help="Answer queries from sqlite or from NumPy arrays in memory")
+    view.add_argument("--connect", default=os.environ.get("DATA_VIEWER_SERVICE"),
+                      help="Attach to a query service at this host:port or Unix socket instead of opening the "
+                           "database, nothing is imported at start up and --db is left to the service")
+    view.set_defaults(handler=view_command)
+
+    serve = subparsers.add_parser("serve", help="Share one database, connection pool, and cache with every viewer on "
+                                                "this machine")
+    serve.add_argument("--address", default="127.0.0.1:8765",
+                       help="The host:port on this machine, or the path of a Unix socket, to listen on")
+    serve.add_argument("--file", default=os.path.join(PROGRAM_DIR, "data.xlsx"),
+                       help="The workbook to import before serving")
+    serve.add_argument("--no-ingest", action="store_true", help="Serve the database as it is without importing")
+    serve.set_defaults(handler=serve_command)
+
+    ingest = subparsers.add_parser("ingest", help="Bring the database up to date with a workbook")
+    ingest.add_argument("--file", default=os.path.join(PROGRAM_DIR, "data.xlsx"), help="The workbook to import")
+    ingest.add_argument("--source", help="A directory or glob pattern of workbooks to import in parallel, rows are "
+                                         "added or updated but never deleted")
+    ingest.add_argument("--processes", type=int, help="The number of processes parsing --source workbooks "
+                                                      "(default: one per CPU)")
+    ingest.add_argument("--force", action="store_true", help="Parse the workbooks even if they have not changed")
+    ingest.set_defaults(handler=ingest_command)
+
+    query = subparsers.add_parser("query", help="Print the rows where a field has a value, tab separated")
+    query.add_argument("--field", default="*", help="The field to filter on, every row is printed if it is left out")
+    query.add_argument("--value", help="The value the field has to have")
+    query.add_argument("--order-by", default="insurance_id", help="The field to sort the rows by")
+    query.add_argument("--descending", action="store_true", help="Sort from largest to smallest")
+    query.add_argument("--limit", type=int, help="The most rows to print")
+    query.add_argument("--count", action="store_true", help="Only print the number of matching rows")
+    query.add_argument("--header", action="store_true", help="Print the names of the columns first")
+    query.set_defaults(handler=query_command)
+
+    export = subparsers.add_parser("export", help="Write the rows where a field has a value to a CSV, JSON Lines, or "
+                                                  "Parquet file")
+    export.add_argument("path", help="The file to write, its extension picks the format")
+    export.add_argument("--field", default="*", help="The field to filter on, every row is written if it is left out")
+    export.add_argument("--value", help="The value the field has to have")
+    export.add_argument("--format", choices=("csv", "jsonl", "parquet"), help="The format to write, instead of "
+                                                                             "going by the extension")
+    export.add_argument("--order-by", help="The field to sort the rows by, they are written in whatever order is "
+                                           "quickest if it is left out")
+    export.add_argument("--descending", action="store_true", help="Sort from largest to smallest")
+    export.set_defaults(handler=export_command)
+
+    distinct = subparsers.add_parser("distinct", help="Print the unique values of a field")
+    distinct.add_argument("field", help="The field to read the unique values of")
+    distinct.set_defaults(handler=distinct_command)
+
+    search = subparsers.add_parser("search", help="Print the values of a field matching the start of each word typed, "
+                                                   "or the start of the value for fields other than location and "
+                                                   "business_type")
+    search.add_argument("field", help="The field to search, such as location, business_type, or policy")
+    search.add_argument("text", nargs="?", default="", help="The text to match, the most common or the smallest "
+                                                            "values are printed if it is left out")
+    search.add_argument("--limit", type=int, default=25, help="The most values to print")
+    search.set_defaults(handler=search_command)
+
+    stats = subparsers.add_parser("stats", help="Print the size of the database and the totals for a field")
+    stats.add_argument("--field", help="Also print the policy count and insured value totals for each value of this field")
+    stats.set_defaults(handler=stats_command)
+    return parser
 
 
 #######################################
@@ -320,16 +292,40 @@ class DbBrowser:
 # exist above this line
 # ====================================
 # Program Starts Here
-def main():
+def main(argv=None):
     """
-    Create an instance of DbBrowser, the class that runs the program.
+    Run the command given on the command line, or open the viewer if there is none. Set DATA_VIEWER_ENGINE=columnar
+    to explore the data in the viewer with the in-memory columnar engine.
+    :param argv: The command line arguments, sys.argv is used if this is None
     """
-    DbBrowser()
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # Parse the whole command line again with the view command on the end, so global options such as --db are kept
+        args = parser.parse_args(list(sys.argv[1:] if argv is None else argv) + ["view"])
+
+    if args.stats or os.environ.get(instrumentation.ENABLED_VARIABLE, "0") not in ("", "0"):
+        if args.command == "view":
+            # Imported before instrumentation is turned on so the viewer's methods are timed too
+            import viewer
+            if args.connect:
+                import service
+        stats_file = os.path.abspath(args.stats_file)
+        recorder = instrumentation.enable(slow_ms=args.slow_ms, dump_path=stats_file)
+        if args.command != "view":
+            # Show the timings once the command is done, after its own output
+            atexit.register(lambda: print("\n".join(recorder.summary()), file=sys.stderr))
+    try:
+        args.handler(args)
+    except (ValueError, OSError, ImportError, sqlite3.Error) as error:
+        print(f'Error ocured - {error}', file=sys.stderr)
+        return 1
+    return 0
 
 
 # ===============================
 # No extra Code beyond this point
 # This code is required for the main() function to work
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 # EOF #
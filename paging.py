@@ -0,0 +1,148 @@
+"""
+A read-only sequence over a filtered, sorted query that only keeps a couple of pages of rows in memory. It can be
+handed to anything that expects a list of rows, such as virtual_table.VirtualTable. A window can also be asked for
+without waiting on the database: window() only answers from the pages in memory, read_pages() reads the missing ones
+on a background thread, and store_pages() hands them over on the thread that owns the result.
+"""
+from collections import OrderedDict
+
+from database import PAGE_SIZE
+
+
+class PagedResult:
+    """
+    Class to look like a list of every row matching a filter while only reading the pages that are asked for
+
+    Attributes:
+
+    - database :    :class:`database.Database` --> The database the pages are read from
+    - descending :    :class:`bool` --> True if the rows are sorted from largest to smallest
+    - field :    :class:`str` --> The field being filtered on, or "*" for every row
+    - max_pages :    :class:`int` --> The most pages kept in memory at once
+    - order_by :    :class:`str` --> The field the rows are sorted by
+    - page_size :    :class:`int` --> The number of rows in each page
+    - value :    :class:`object` --> The value the field is filtered to
+
+    Methods:
+
+    - window(start, stop) --> Return the rows from start to stop if every page they are on is in memory, or None
+    - missing_pages(start, stop) --> Return the numbers of the pages from start to stop that are not in memory
+    - read_pages(numbers) --> Read pages from the database without changing what is in memory
+    - store_pages(pages) --> Keep pages that read_pages read
+    - _page(number) --> Return the rows of a page, reading it from the database if it is not in memory
+    - _read_page(number, after) --> Read a page from the database
+    """
+
+    def __init__(self, database, field="*", value=None, order_by="insurance_id", descending=False,
+                 page_size=PAGE_SIZE, max_pages=2):
+        self.database = database
+        self.field = field
+        self.value = value
+        self.order_by = order_by
+        self.descending = descending
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._length = database.count_filtered_data(field, value)
+        # The pages in memory from least to most recently used, and the key that continues after each of them
+        self._pages = OrderedDict()
+        self._next_keys = {}
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            rows = []
+            # Stitch the slice together from the pages it spans
+            while start < stop:
+                number, position = divmod(start, self.page_size)
+                page = self._page(number)
+                rows.extend(page[position:position + stop - start])
+                start = (number + 1) * self.page_size
+            return rows
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("PagedResult index out of range")
+        number, position = divmod(index, self.page_size)
+        return self._page(number)[position]
+
+    def window(self, start, stop):
+        """
+        Return the rows from start to stop if every page they are on is in memory, without touching the database
+        :param start: The index of the first row
+        :param stop: The index after the last row
+        :return rows: A list of the rows, or None if a page they are on has to be read first
+        """
+        if self.missing_pages(start, stop):
+            return None
+        return self[start:stop]
+
+    def missing_pages(self, start, stop):
+        """
+        Return the numbers of the pages from start to stop that are not in memory
+        :param start: The index of the first row
+        :param stop: The index after the last row
+        :return numbers: A list of page numbers, in order
+        """
+        start, stop, _ = slice(start, stop).indices(self._length)
+        if start >= stop:
+            return []
+        pages = range(start // self.page_size, (stop - 1) // self.page_size + 1)
+        return [number for number in pages if number not in self._pages]
+
+    def read_pages(self, numbers):
+        """
+        Read pages from the database without changing what is in memory, so it can run on a background thread while
+        the result is being shown. Each page after one just read continues from that page's key.
+        :param numbers: The page numbers to read, in order
+        :return pages: A list of (number, rows, next key) tuples
+        """
+        pages = []
+        for number in numbers:
+            after = pages[-1][2] if pages and pages[-1][0] == number - 1 else self._next_keys.get(number - 1)
+            pages.append((number,) + self._read_page(number, after))
+        return pages
+
+    def store_pages(self, pages):
+        """
+        Keep pages that read_pages read, forgetting the least recently used pages once there are too many
+        :param pages: A list of (number, rows, next key) tuples
+        :return None:
+        """
+        for number, rows, next_key in pages:
+            self._pages[number] = rows
+            self._pages.move_to_end(number)
+            self._next_keys[number] = next_key
+        while len(self._pages) > self.max_pages:
+            oldest, _ = self._pages.popitem(last=False)
+            self._next_keys.pop(oldest, None)
+
+    def _page(self, number):
+        """
+        Return the rows of a page, reading it from the database if it is not in memory
+        :param number: The number of the page, starting from 0
+        :return rows: The rows in the page
+        """
+        if number in self._pages:
+            self._pages.move_to_end(number)
+            return self._pages[number]
+
+        rows, next_key = self._read_page(number, self._next_keys.get(number - 1))
+        self.store_pages([(number, rows, next_key)])
+        return rows
+
+    def _read_page(self, number, after):
+        """
+        Read a page from the database. A page that follows one in memory is read with its continuation key, any other
+        page is read by offset.
+        :param number: The number of the page, starting from 0
+        :param after: The continuation key of the page before it, or None
+        :return page: A tuple of (rows, the key that continues after them)
+        """
+        return self.database.read_page(self.field, self.value, order_by=self.order_by, descending=self.descending,
+                                       after=after, offset=number * self.page_size, page_size=self.page_size)
@@ -0,0 +1,211 @@
+"""
+Builds compound filters out of equality, IN, and range conditions joined with AND and OR. A query can be passed to
+database.Database anywhere a field is expected, and it is compiled to a parameterized WHERE clause with every field
+checked against the columns of the insurance table, so nothing typed by a user is ever pasted into the SQL. Queries
+can be turned into plain dicts and back, so they can be sent as JSON.
+"""
+from operator import eq, ge, gt, le, lt, ne
+
+# The comparisons a Condition can make
+OPERATORS = ("=", "!=", "<", "<=", ">", ">=", "IN", "BETWEEN")
+# The Python functions that make the single value comparisons
+COMPARISONS = {"=": eq, "!=": ne, "<": lt, "<=": le, ">": gt, ">=": ge}
+
+
+class Query:
+    """
+    Base class for the parts of a query. Queries are compared and hashed by their contents, so they can be used as
+    cache keys.
+
+    Methods:
+
+    - to_sql(columns) --> Compile the query to a WHERE clause and its parameters
+    - fields() --> Return the set of fields the query looks at
+    - describe(names) --> Return a readable description of the query
+    - to_dict() --> Return the query as a dict of plain values, which from_dict turns back into the query
+    - _key() --> Return a tuple that identifies the query
+    """
+
+    def _key(self):
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self).__name__, self._key()))
+
+    def __repr__(self):
+        return self.describe()
+
+
+class Condition(Query):
+    """
+    Class for one comparison between a field and a value
+
+    Attributes:
+
+    - field :    :class:`str` --> The field being compared
+    - operator :    :class:`str` --> One of OPERATORS
+    - value :    :class:`object` --> The value to compare with. A tuple of values for IN, a (low, high) tuple for BETWEEN
+    """
+
+    def __init__(self, field, operator, value):
+        operator = operator.upper()
+        if operator not in OPERATORS:
+            raise ValueError(f'Unknown operator {operator}')
+        if operator == "IN":
+            value = tuple(value)
+        elif operator == "BETWEEN":
+            value = tuple(value)
+            if len(value) != 2:
+                raise ValueError("BETWEEN needs a (low, high) pair")
+        self.field = field
+        self.operator = operator
+        self.value = value
+
+    def _key(self):
+        return self.field, self.operator, self.value
+
+    def to_sql(self, columns):
+        """
+        Compile the condition to a WHERE clause and its parameters
+        :param columns: The columns the field has to be one of
+        :return sql: A tuple of (clause, params)
+        """
+        if self.field not in columns:
+            raise ValueError(f'Cannot filter on {self.field}')
+        if self.operator == "IN":
+            return f"{self.field} IN ({', '.join('?' * len(self.value))})", self.value
+        if self.operator == "BETWEEN":
+            return f"{self.field} BETWEEN ? AND ?", self.value
+        return f"{self.field} {self.operator} ?", (self.value,)
+
+    def test(self, value):
+        """
+        Return True if a value of the condition's field would pass the condition
+        :param value: The value to test
+        :return passes: True if the value passes
+        """
+        if self.operator == "IN":
+            return value in self.value
+        if self.operator == "BETWEEN":
+            return self.value[0] <= value <= self.value[1]
+        return COMPARISONS[self.operator](value, self.value)
+
+    def fields(self):
+        """
+        Return the set of fields the condition looks at
+        :return fields: A set with the condition's field
+        """
+        return {self.field}
+
+    def describe(self, names=None):
+        """
+        Return a readable description of the condition, such as State IN (CA, NY)
+        :param names: A dict of the names to show for each field, the field itself is shown if it is missing
+        :return description: The description
+        """
+        name = (names or {}).get(self.field, self.field)
+        if self.operator == "IN":
+            return f"{name} IN ({', '.join(str(value) for value in self.value)})"
+        if self.operator == "BETWEEN":
+            return f"{name} BETWEEN {self.value[0]} AND {self.value[1]}"
+        return f"{name} {self.operator} {self.value}"
+
+    def to_dict(self):
+        """
+        Return the condition as a dict of plain values, which from_dict turns back into the condition
+        :return data: A dict with the field, operator, and value
+        """
+        value = list(self.value) if isinstance(self.value, tuple) else self.value
+        return {"field": self.field, "operator": self.operator, "value": value}
+
+
+class _Group(Query):
+    """
+    Base class for queries that join other queries together
+
+    Attributes:
+
+    - parts :    :class:`tuple` --> The queries being joined
+    """
+    joiner = ""
+
+    def __init__(self, *parts):
+        if not parts:
+            raise ValueError(f'{type(self).__name__} needs at least one part')
+        self.parts = parts
+
+    def _key(self):
+        return tuple((type(part).__name__, part._key()) for part in self.parts)
+
+    def to_sql(self, columns):
+        """
+        Compile the group to a WHERE clause and its parameters
+        :param columns: The columns every field has to be one of
+        :return sql: A tuple of (clause, params)
+        """
+        clauses = []
+        params = ()
+        for part in self.parts:
+            clause, part_params = part.to_sql(columns)
+            clauses.append(clause)
+            params += tuple(part_params)
+        return f"({f' {self.joiner} '.join(clauses)})", params
+
+    def fields(self):
+        """
+        Return the set of fields the group looks at
+        :return fields: The fields of every part
+        """
+        return set().union(*(part.fields() for part in self.parts))
+
+    def describe(self, names=None):
+        """
+        Return a readable description of the group
+        :param names: A dict of the names to show for each field
+        :return description: The description
+        """
+        descriptions = [part.describe(names) for part in self.parts]
+        if len(descriptions) == 1:
+            return descriptions[0]
+        return f" {self.joiner} ".join(f"({description})" if isinstance(part, _Group) else description
+                                       for part, description in zip(self.parts, descriptions))
+
+    def to_dict(self):
+        """
+        Return the group as a dict of plain values, which from_dict turns back into the group
+        :return data: A dict mapping "and" or "or" to the dicts of the parts
+        """
+        return {self.joiner.lower(): [part.to_dict() for part in self.parts]}
+
+
+class And(_Group):
+    """
+    Class for a query that only matches rows every one of its parts matches
+    """
+    joiner = "AND"
+
+
+class Or(_Group):
+    """
+    Class for a query that matches rows any one of its parts matches
+    """
+    joiner = "OR"
+
+
+def from_dict(data):
+    """
+    Turn a dict made by Query.to_dict back into a query
+    :param data: The dict
+    :return query: The Condition, And, or Or the dict describes
+    """
+    if "and" in data:
+        return And(*(from_dict(part) for part in data["and"]))
+    if "or" in data:
+        return Or(*(from_dict(part) for part in data["or"]))
+    try:
+        return Condition(data["field"], data["operator"], data["value"])
+    except (KeyError, TypeError) as error:
+        raise ValueError(f'Not a query: {data!r}') from error
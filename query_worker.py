@@ -0,0 +1,176 @@
+"""
+Runs database queries on a background thread so the Tk main loop never waits on sqlite. Results are handed back to
+the main loop by polling with after(), since tkinter widgets may only be touched from the thread running the main loop.
+"""
+import itertools
+import queue
+import sqlite3
+import threading
+
+# How often, in milliseconds, the main loop checks for finished queries. 16ms keeps up with a 60Hz display
+POLL_INTERVAL = 16
+
+
+class QueryWorker:
+    """
+    Class to run queries one at a time on a background thread, throwing away the ones that have been superseded
+
+    Every query is submitted on a channel, such as "data" for the table or "options" for the secondary dropdown. Only
+    the newest query on a channel matters: older queries still waiting are skipped, a running one is interrupted, and
+    any result that arrives late is dropped instead of being handed to its callback.
+
+    Attributes:
+
+    - database :    :class:`database.Database` --> The database the queries run against, used to interrupt them
+    - on_busy :    :class:`function` --> Called with True when queries start being worked on and False when they are done
+    - root :    :class:`tk.Tk` --> The Tk instance whose main loop receives the results
+
+    Methods:
+
+    - submit(channel, function, callback, error_callback) --> Run a function on the worker thread and pass its result to a callback on the main loop
+    - cancel(channel) --> Drop whatever query is waiting or running on a channel
+    - busy() --> Return True if any query is still waiting or running
+    - stop() --> Stop the worker thread
+    - _run() --> The worker thread's loop
+    - _poll() --> Hand finished results to their callbacks on the main loop
+    """
+
+    def __init__(self, root, database, on_busy=None):
+        self.root = root
+        self.database = database
+        self.on_busy = on_busy
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._tokens = itertools.count()
+        # channel -> the token of the newest query submitted on it
+        self._latest = {}
+        # (channel, token) of the query running right now, or None
+        self._running = None
+        self._outstanding = 0
+        self._showing_busy = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="query-worker", daemon=True)
+        self._thread.start()
+        self._poll_id = root.after(POLL_INTERVAL, self._poll)
+
+    def submit(self, channel, function, callback, error_callback=None):
+        """
+        Run a function on the worker thread and pass its result to a callback on the main loop. Any earlier query on
+        the same channel is superseded.
+        :param channel: The name of the channel, newer queries on a channel replace older ones
+        :param function: The function to run on the worker thread, called with no arguments
+        :param callback: Called on the main loop with the function's result
+        :param error_callback: Called on the main loop with the exception if the function raised one
+        :return None:
+        """
+        token = next(self._tokens)
+        self._latest[channel] = token
+        self._interrupt(channel)
+        self._outstanding += 1
+        if not self._showing_busy and self.on_busy:
+            self._showing_busy = True
+            self.on_busy(True)
+        self._requests.put((channel, token, function, callback, error_callback))
+
+    def cancel(self, channel):
+        """
+        Drop whatever query is waiting or running on a channel
+        :param channel: The name of the channel
+        :return None:
+        """
+        # A token nothing was submitted with means every query on the channel is stale
+        self._latest[channel] = next(self._tokens)
+        self._interrupt(channel)
+
+    def busy(self):
+        """
+        Return True if any query is still waiting or running
+        :return busy: True if the worker has unfinished queries
+        """
+        return self._outstanding > 0
+
+    def stop(self):
+        """
+        Stop the worker thread, interrupting the query it is running
+        :return None:
+        """
+        self._stopped = True
+        self.root.after_cancel(self._poll_id)
+        self._latest.clear()
+        self.database.interrupt(self._thread)
+        self._requests.put(None)
+        self._thread.join(timeout=1)
+
+    def _interrupt(self, channel):
+        """
+        Interrupt the running query if it is on the channel, since its result is going to be thrown away
+        :param channel: The name of the channel
+        :return None:
+        """
+        running = self._running
+        if running and running[0] == channel:
+            # Only this worker's connection, so queries other workers are running carry on
+            self.database.interrupt(self._thread)
+
+    def _run(self):
+        """
+        The worker thread's loop. Takes queries off the queue one at a time, skipping the ones that were superseded
+        while they waited.
+        :return None:
+        """
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            channel, token, function, callback, error_callback = request
+            result = error = None
+            if self._latest.get(channel) == token:
+                self._running = (channel, token)
+                try:
+                    result = function()
+                except sqlite3.OperationalError as exc:
+                    # An interrupt meant for a query on another channel of this worker can land on this one, so try
+                    # again if this query is still wanted
+                    if self._latest.get(channel) == token and "interrupt" in str(exc):
+                        try:
+                            result = function()
+                        except Exception as retry_exc:
+                            error = retry_exc
+                    else:
+                        error = exc
+                except Exception as exc:
+                    error = exc
+                finally:
+                    self._running = None
+            self._results.put((channel, token, result, error, callback, error_callback))
+
+    def _poll(self):
+        """
+        Hand finished results to their callbacks on the main loop. Results from superseded queries are dropped.
+        :return None:
+        """
+        try:
+            while True:
+                channel, token, result, error, callback, error_callback = self._results.get_nowait()
+                self._outstanding -= 1
+                if self._latest.get(channel) != token:
+                    continue
+                # A callback that raises must not stop the results after it from being handed over
+                try:
+                    if error is None:
+                        callback(result)
+                    elif error_callback:
+                        error_callback(error)
+                    else:
+                        print(f'Error ocured - {error}')
+                except Exception as callback_error:
+                    print(f'Error ocured - {callback_error}')
+        except queue.Empty:
+            pass
+        finally:
+            # Keep polling whatever happened, otherwise no later result would ever reach the window
+            if self._outstanding == 0 and self._showing_busy:
+                self._showing_busy = False
+                self.on_busy(False)
+            if not self._stopped:
+                self._poll_id = self.root.after(POLL_INTERVAL, self._poll)
@@ -0,0 +1,131 @@
+"""
+A bounded least recently used cache for query results. Every entry remembers the data generation it was read at, so
+bumping the generation after a write invalidates every entry without having to find them.
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+# The number of rows sampled when estimating the size of a result
+SIZE_SAMPLE = 16
+
+
+class ResultCache:
+    """
+    Class to hold query results up to a memory budget, forgetting the least recently used results first
+
+    Attributes:
+
+    - evictions :    :class:`int` --> The number of results forgotten to stay under the memory budget
+    - hits :    :class:`int` --> The number of lookups that found a current result
+    - max_bytes :    :class:`int` --> The memory budget for all of the results, 0 turns the cache off
+    - misses :    :class:`int` --> The number of lookups that had to go to the database
+    - size :    :class:`int` --> The estimated number of bytes the results are using
+
+    Methods:
+
+    - get(key, generation) --> Return the result stored for a key, or None if there is no result from this generation
+    - put(key, generation, value, size) --> Store a result read at a generation
+    - clear() --> Forget every result
+    - stats() --> Return the hit, miss, and size counters
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (generation, size, value), from least to most recently used
+        self._entries = OrderedDict()
+        # The viewer reads from a worker thread as well as the Tk thread
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        """
+        Return the result stored for a key, or None if there is no result from this generation
+        :param key: A hashable key for the query, such as ("unique", field, None)
+        :param generation: The current data generation, older results are treated as missing
+        :return value: The stored result, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                # A result from an older generation is stale and will never be used again
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, generation, value, size=None):
+        """
+        Store a result read at a generation. Results bigger than the whole budget are not stored.
+        :param key: A hashable key for the query
+        :param generation: The data generation the result was read at
+        :param value: The result, which should not be changed after it is stored
+        :param size: The size of the result in bytes, estimated from the value if not given
+        :return None:
+        """
+        if size is None:
+            size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (generation, size, value)
+            self.size += size
+            # Forget the least recently used results until the cache fits in its budget again
+            while self.size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Forget every result
+        :return None:
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Return the hit, miss, and size counters
+        :return stats: A dict of the counters
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "entries": len(self._entries), "bytes": self.size, "max_bytes": self.max_bytes}
+
+    def _remove(self, key):
+        """
+        Remove a result and take its size off the total. The lock must already be held.
+        :param key: The key of the result to remove
+        :return None:
+        """
+        _, size, _ = self._entries.pop(key)
+        self.size -= size
+
+
+def estimate_size(value):
+    """
+    Estimate how many bytes a result uses. Lists and tuples of rows are estimated from a sample of their rows so big
+    results do not have to be walked.
+    :param value: The result to measure
+    :return size: The estimated size in bytes
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple)) and value:
+        sample = value[:SIZE_SAMPLE]
+        sample_size = 0
+        for item in sample:
+            sample_size += sys.getsizeof(item)
+            if isinstance(item, tuple):
+                sample_size += sum(sys.getsizeof(part) for part in item)
+        size += sample_size * len(value) // len(sample)
+    return size
@@ -0,0 +1,551 @@
+"""
+A local query service, so several viewers on one machine share one warm database, one connection per client, and one
+result cache instead of each importing the workbook and holding the data themselves. The server owns a
+database.Database and answers requests on a localhost port or a Unix socket. ServiceClient has the same read interface
+as database.Database, so the viewer can attach to the service in place of a database of its own.
+
+Requests and responses are JSON, one object per line. A request names a method and its arguments:
+
+    {"method": "read_page", "args": {"field": "state", "value": "WI", "after": [120]}}
+
+and is answered with {"result": ...} or {"error": ..., "type": ...}. Methods that return whole results, such as
+read_filtered_data, send their rows in batches of {"rows": [...]} followed by {"result": row_count}, so neither side
+has to build one huge message. A query_builder query is sent as {"query": query.to_dict()} in place of a field.
+"""
+import itertools
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+
+from database import COLUMN_NAMES, EXPORT_CHUNK_SIZE, PAGE_SIZE, SEARCH_LIMIT
+from query_builder import Query, from_dict
+
+# The address the service listens on when none is given
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+# The hosts a TCP service may listen on, the service has no authentication so it is never put on the network
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+# The number of rows sent in each batch of a whole result
+BATCH_ROWS = 5000
+# The longest request line accepted, in bytes
+MAX_REQUEST_BYTES = 1024 * 1024
+# The methods that answer with a single result
+METHODS = ("read_unique_data", "count_filtered_data", "read_page", "read_rollup", "search_values", "cache_stats")
+# The methods that answer with batches of rows
+STREAM_METHODS = ("read_filtered_data", "iter_filtered_data")
+# The exceptions raised again on the client, every other error from the service is raised as a RuntimeError
+ERRORS = {"ValueError": ValueError, "OperationalError": sqlite3.OperationalError}
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Class for the service listening on a localhost port. Each client connection is handled on a thread of its own,
+    which gets its own sqlite connection from the shared database.
+
+    Attributes:
+
+    - database :    :class:`database.Database` --> The database every client's requests are answered from
+    - sessions :    :class:`dict` --> Maps each connected client's session number to the thread handling it, so its queries can be interrupted
+
+    Methods:
+
+    - add_session(thread) --> Give a client's thread a session number
+    - remove_session(session) --> Forget a client that has disconnected
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, database):
+        # An IPv6 host such as ::1 needs an IPv6 socket
+        if isinstance(address, tuple) and ":" in address[0]:
+            self.address_family = socket.AF_INET6
+        super().__init__(address, QueryHandler)
+        self.database = database
+        self.sessions = {}
+        self._session_numbers = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add_session(self, thread):
+        """
+        Give a client's thread a session number
+        :param thread: The threading.Thread handling the client
+        :return session: The session number
+        """
+        with self._lock:
+            session = next(self._session_numbers)
+            self.sessions[session] = thread
+        return session
+
+    def remove_session(self, session):
+        """
+        Forget a client that has disconnected
+        :param session: The client's session number
+        :return None:
+        """
+        with self._lock:
+            self.sessions.pop(session, None)
+
+
+if hasattr(socket, "AF_UNIX"):
+    class UnixQueryServer(QueryServer):
+        """
+        Class for the service listening on a Unix socket, which only users allowed to open the socket file can reach
+        """
+        address_family = socket.AF_UNIX
+        allow_reuse_address = False
+
+        def server_bind(self):
+            # A socket file left behind by a service that did not shut down cleanly would stop the bind
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+            super().server_bind()
+
+        def server_close(self):
+            super().server_close()
+            if os.path.exists(self.server_address):
+                os.remove(self.server_address)
+else:
+    UnixQueryServer = None
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    """
+    Class to answer one client's requests, one line at a time, until it disconnects
+
+    Attributes:
+
+    - session :    :class:`int` --> The client's session number, sent to it as soon as it connects
+
+    Methods:
+
+    - handle() --> Answer requests until the client disconnects
+    - _answer(request) --> Answer a single request
+    - _send(message) --> Write a message to the client as a line of JSON
+    """
+
+    def handle(self):
+        """
+        Send the client its session number, then answer requests until it disconnects
+        :return None:
+        """
+        self.session = self.server.add_session(threading.current_thread())
+        try:
+            self._send({"session": self.session})
+            while True:
+                line = self.rfile.readline(MAX_REQUEST_BYTES)
+                if not line:
+                    break
+                try:
+                    self._answer(json.loads(line))
+                except (ValueError, TypeError, KeyError, sqlite3.Error) as error:
+                    self._send({"error": str(error), "type": type(error).__name__})
+        except (ConnectionError, OSError):
+            # The client went away part way through a response
+            pass
+        finally:
+            self.server.remove_session(self.session)
+            # Give the connection back, otherwise every client that ever connected would keep one open
+            self.server.database.disconnect()
+
+    def _answer(self, request):
+        """
+        Answer a single request
+        :param request: The decoded request, with a method and its arguments
+        :return None:
+        """
+        database = self.server.database
+        method = request["method"]
+        args = decode_args(request.get("args") or {})
+
+        if method == "interrupt":
+            # Sent on a connection of its own, since the client's connection is busy waiting for the query
+            thread = self.server.sessions.get(args["session"])
+            if thread is not None:
+                database.interrupt(thread)
+            self._send({"result": None})
+        elif method == "generation":
+            self._send({"result": database._current_generation()})
+        elif method in METHODS:
+            self._send({"result": getattr(database, method)(**args)})
+        elif method in STREAM_METHODS:
+            if method == "read_filtered_data":
+                # Cached on the service, so every client asking for the same rows shares them
+                rows = database.read_filtered_data(**args)
+                chunks = (rows[start:start + BATCH_ROWS] for start in range(0, len(rows), BATCH_ROWS))
+            else:
+                chunks = database.iter_filtered_data(**args)
+            row_count = 0
+            for chunk in chunks:
+                self._send({"rows": chunk})
+                row_count += len(chunk)
+            self._send({"result": row_count})
+        else:
+            raise ValueError(f'Unknown method {method}')
+
+    def _send(self, message):
+        """
+        Write a message to the client as a line of JSON
+        :param message: A dict of plain values
+        :return None:
+        """
+        self.wfile.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+
+
+class ServiceClient:
+    """
+    Class to send the viewer's queries to a QueryServer. It has the same read interface as database.Database, and
+    each thread gets its own connection to the service the way each thread gets its own sqlite connection.
+
+    Attributes:
+
+    - address :    :class:`str` --> The host:port or Unix socket path of the service
+    - timeout :    :class:`float` --> How long to wait to connect, in seconds
+
+    Methods:
+
+    - _connect() --> Return the current thread's connection to the service, opening it the first time it is needed
+    - _drop() --> Close the current thread's connection, so the next request starts on a clean one
+    - _call(method, args) --> Send a request and return its result
+    - _stream(method, args) --> Send a request and yield the batches of rows that answer it
+    - read_data() --> Read every row
+    - read_unique_data(field) --> Read the unique values of a field
+    - read_filtered_data(field, value) --> Read all rows containing the same value for the field provided
+    - iter_filtered_data(field, value, chunk_size, order_by, descending) --> Stream the matching rows in chunks
+    - export_data(path, field, value, file_format, order_by, descending, chunk_size) --> Write the matching rows to a file
+    - count_filtered_data(field, value) --> Count the matching rows
+    - read_page(field, value, order_by, descending, after, offset, page_size) --> Read one page of the matching rows
+    - read_rollup(field) --> Read the policy count and insured value totals for each value of a field
+    - search_values(field, text, limit) --> Find the values of a field matching what the user has typed so far
+    - cache_stats() --> Return the service's result cache counters
+    - _current_generation() --> Return the service's data generation
+    - interrupt(thread) --> Abort the request one thread, or every thread, is waiting on
+    - close() --> Close every connection to the service
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=5):
+        self.address = address
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # Connect now, so a service that is not running is reported straight away
+        self._connect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        """
+        Return the current thread's connection to the service, opening it the first time it is needed
+        :return connection: A tuple of (socket, file, session)
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            family, target = parse_address(self.address)
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(target)
+                # Queries can take as long as they take once connected
+                sock.settimeout(None)
+                file = sock.makefile("rwb")
+                session = json.loads(file.readline())["session"]
+            except (OSError, ValueError, KeyError) as error:
+                sock.close()
+                raise ConnectionError(f'Could not connect to the query service at {self.address}: {error}')
+            connection = (sock, file, session)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append((threading.current_thread(), connection))
+        return connection
+
+    def _drop(self):
+        """
+        Close the current thread's connection, so the next request starts on a clean one instead of reading what was
+        left of an earlier response
+        :return None:
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            return
+        with self._lock:
+            self._connections = [(owner, other) for owner, other in self._connections if other is not connection]
+        self._local.connection = None
+        sock, file, _ = connection
+        file.close()
+        sock.close()
+
+    def _request(self, method, args):
+        """
+        Send a request and return a generator of the messages that answer it
+        :param method: The name of the method to run on the service
+        :param args: A dict of the method's arguments
+        :return messages: A generator of the decoded response lines
+        """
+        _, file, _ = self._connect()
+        try:
+            file.write(json.dumps({"method": method, "args": encode_args(args)}).encode() + b"\n")
+            file.flush()
+            while True:
+                line = file.readline()
+                if not line:
+                    raise ConnectionError(f'The query service at {self.address} closed the connection')
+                message = json.loads(line)
+                if "error" in message:
+                    raise ERRORS.get(message["type"], RuntimeError)(message["error"])
+                yield message
+                if "result" in message:
+                    return
+        except BaseException:
+            # The rest of the response is still on its way, so the connection cannot be used again
+            self._drop()
+            raise
+
+    def _call(self, method, args=None):
+        """
+        Send a request and return its result
+        :param method: The name of the method to run on the service
+        :param args: A dict of the method's arguments
+        :return result: The result the service sent back
+        """
+        # Read the response to the end, so the connection is ready for the next request
+        result = None
+        for message in self._request(method, args or {}):
+            result = message.get("result")
+        return result
+
+    def _stream(self, method, args):
+        """
+        Send a request and yield the batches of rows that answer it
+        :param method: The name of the method to run on the service
+        :param args: A dict of the method's arguments
+        :return chunks: A generator of lists of row tuples
+        """
+        messages = self._request(method, args)
+        try:
+            for message in messages:
+                if "rows" in message:
+                    yield [tuple(row) for row in message["rows"]]
+        finally:
+            # Closes the connection too if the caller stopped before the last batch
+            messages.close()
+
+    def read_data(self):
+        """
+        Read every row from the service
+        :return data: A list of row tuples
+        """
+        return self.read_filtered_data("*", None)
+
+    def read_unique_data(self, field):
+        """
+        Read the unique values of the field indicated
+        :param field: The database field to get unique values from
+        :return data: The unique values of the field
+        """
+        return self._call("read_unique_data", {"field": field})
+
+    def read_filtered_data(self, field, value):
+        """
+        Read all rows containing the same value for the field provided. They arrive in batches, which are joined here.
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :return data: A list of row tuples
+        """
+        data = []
+        for chunk in self._stream("read_filtered_data", {"field": field, "value": value}):
+            data.extend(chunk)
+        return data
+
+    def iter_filtered_data(self, field="*", value=None, chunk_size=PAGE_SIZE, order_by=None, descending=False):
+        """
+        Stream the rows containing the same value for the field provided in chunks
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :param chunk_size: The number of rows in each chunk
+        :param order_by: The field to sort the rows by, or None to return them in whatever order is quickest
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :return chunks: A generator of lists of row tuples
+        """
+        return self._stream("iter_filtered_data", {"field": field, "value": value, "chunk_size": chunk_size,
+                                                   "order_by": order_by, "descending": descending})
+
+    def export_data(self, path, field="*", value=None, file_format=None, order_by=None, descending=False,
+                    chunk_size=EXPORT_CHUNK_SIZE):
+        """
+        Write the rows containing the same value for the field provided to a CSV, JSON Lines, or Parquet file on this
+        machine. The rows are streamed from the service a chunk at a time.
+        :param path: The file to write
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :param file_format: "csv", "jsonl", or "parquet", worked out from the file's extension if not given
+        :param order_by: The field to sort the rows by, or None to write them in whatever order is quickest
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :param chunk_size: The number of rows in each chunk
+        :return row_count: The number of rows written
+        """
+        # Imported here so the client does not load the export writers until they are needed
+        from export import export_chunks
+        chunks = self.iter_filtered_data(field, value, chunk_size, order_by=order_by, descending=descending)
+        return export_chunks(chunks, path, file_format, COLUMN_NAMES)
+
+    def count_filtered_data(self, field, value):
+        """
+        Count the rows containing the same value for the field provided
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :return count: The number of matching rows
+        """
+        return self._call("count_filtered_data", {"field": field, "value": value})
+
+    def read_page(self, field="*", value=None, order_by="insurance_id", descending=False, after=None, offset=0,
+                  page_size=PAGE_SIZE):
+        """
+        Read one page of the rows containing the same value for the field provided, sorted by order_by
+        :param field: The field to select, "*" for every row, or a query_builder.Query
+        :param value: The value to find duplicates of
+        :param order_by: The field to sort the rows by
+        :param descending: Sort from largest to smallest instead of smallest to largest
+        :param after: The continuation key returned with the previous page, or None to start at offset
+        :param offset: The number of rows to skip when there is no continuation key
+        :param page_size: The most rows to return
+        :return page: A tuple of (rows, key), the same as database.Database.read_page
+        """
+        rows, key = self._call("read_page", {"field": field, "value": value, "order_by": order_by,
+                                             "descending": descending, "after": after, "offset": offset,
+                                             "page_size": page_size})
+        return [tuple(row) for row in rows], None if key is None else tuple(key)
+
+    def read_rollup(self, field):
+        """
+        Read the policy count and insured value totals for each value of a field
+        :param field: One of database.ROLLUP_FIELDS
+        :return rollup: A list of (value, count, sum, min, max) tuples sorted by value
+        """
+        return [tuple(row) for row in self._call("read_rollup", {"field": field})]
+
+    def search_values(self, field, text, limit=SEARCH_LIMIT):
+        """
+        Find the values of a field matching what the user has typed so far
+        :param field: One of database.FILTER_FIELDS
+        :param text: What the user has typed
+        :param limit: The most values to return
+        :return values: A list of at most limit matching values
+        """
+        return self._call("search_values", {"field": field, "text": text, "limit": limit})
+
+    def cache_stats(self):
+        """
+        Return the service's result cache counters, which every client shares
+        :return stats: A dict of the counters
+        """
+        return self._call("cache_stats")
+
+    def _current_generation(self):
+        """
+        Return the service's data generation, so a columnar.ColumnarDatabase loaded from the service knows when to
+        reload
+        :return generation: The current data generation
+        """
+        return self._call("generation")
+
+    def interrupt(self, thread=None):
+        """
+        Abort the request one thread, or every thread, is waiting on. The interrupted request raises
+        sqlite3.OperationalError in the thread that sent it, just like an interrupted query on a database.Database.
+        :param thread: The threading.Thread whose request to abort, or None to abort every thread's request
+        :return None:
+        """
+        with self._lock:
+            sessions = [connection[2] for owner, connection in self._connections if thread is None or owner is thread]
+        if not sessions:
+            return
+        # The thread's own connection is busy waiting for its answer, so the interrupt goes on a connection of its own
+        family, target = parse_address(self.address)
+        try:
+            with socket.socket(family, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(target)
+                with sock.makefile("rwb") as file:
+                    file.readline()
+                    for session in sessions:
+                        file.write(json.dumps({"method": "interrupt", "args": {"session": session}}).encode() + b"\n")
+                        file.flush()
+                        file.readline()
+        except OSError as error:
+            print(f'Error ocured - {error}')
+
+    def close(self):
+        """
+        Close every connection to the service. The client can still be used afterwards, it will just reconnect.
+        :return None:
+        """
+        with self._lock:
+            connections = self._connections
+            self._connections = []
+            self._local = threading.local()
+        for _, (sock, file, _) in connections:
+            file.close()
+            sock.close()
+
+
+def parse_address(address):
+    """
+    Work out what kind of socket an address is for. host:port is a TCP port on this machine, anything else is the
+    path of a Unix socket.
+    :param address: The address of the service
+    :return address: A tuple of (socket family, address to bind or connect to)
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        host = host.strip("[]")
+        if host not in LOCAL_HOSTS:
+            raise ValueError(f'The query service only runs on this machine, use one of {", ".join(LOCAL_HOSTS)}')
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        return family, (host, int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError(f'{address} is not a host:port, and Unix sockets are not supported here')
+    return socket.AF_UNIX, address
+
+
+def encode_args(args):
+    """
+    Make a request's arguments safe to send as JSON, turning a query_builder query into {"query": ...}
+    :param args: A dict of the method's arguments
+    :return args: The arguments with any query encoded
+    """
+    if isinstance(args.get("field"), Query):
+        args = dict(args, field={"query": args["field"].to_dict()})
+    return args
+
+
+def decode_args(args):
+    """
+    Undo encode_args on the service, and turn the lists JSON makes back into the tuples the database expects
+    :param args: The arguments as they were received
+    :return args: The arguments ready to pass to the database
+    """
+    args = dict(args)
+    if isinstance(args.get("field"), dict):
+        args["field"] = from_dict(args["field"]["query"])
+    if isinstance(args.get("after"), list):
+        args["after"] = tuple(args["after"])
+    return args
+
+
+def make_server(database, address=DEFAULT_ADDRESS):
+    """
+    Create the service for a database, listening but not yet answering requests
+    :param database: The database.Database to answer requests from
+    :param address: A host:port on this machine, or the path of a Unix socket
+    :return server: A QueryServer, call serve_forever() on it to start answering requests
+    """
+    family, target = parse_address(address)
+    if family == getattr(socket, "AF_UNIX", None):
+        return UnixQueryServer(target, database)
+    return QueryServer(target, database)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""
+Generates synthetic insurance data for benchmarks, as rows, workbooks laid out exactly like data.xlsx, or ready made
+sqlite databases. The data is repeatable for a given seed, and the number of distinct states, business types, and
+expiry dates can be turned up to test how the program copes with high cardinality. For example:
+
+    python synthetic.py xlsx policies.xlsx --rows 100000
+    python synthetic.py sqlite policies.db --rows 10000000 --business-types 500
+"""
+import argparse
+import datetime
+import itertools
+import os
+import random
+import time
+
+# The regions of the sample workbook, with the states in each
+REGIONS = {"East": ("NY", "NJ", "PA", "MD", "DE", "VA"), "Midwest": ("WI", "IL", "OH", "MI", "MN", "IN"),
+           "Northeast": ("VT", "MA", "NH", "ME", "CT", "RI"), "Central": ("MO", "KS", "IA", "NE", "OK", "AR")}
+LOCATIONS = ("Urban", "Rural", "Suburban")
+CONSTRUCTION = ("Frame", "Masonry", "Fire Resist", "Metal Clad", "Reinforced Concrete")
+BUSINESS_TYPES = ("Apartment", "Farming", "Office Bldg", "Hospitality", "Retail", "Manufacturing", "Construction")
+# The header row of data.xlsx
+HEADER = ("Policy", "Expiry", "Location", "State", "Region", "InsuredValue", "Construction", "BusinessType",
+          "Earthquake", "Flood")
+# The first expiry date generated
+FIRST_EXPIRY = datetime.date(2021, 1, 1)
+
+
+def _names(base, count):
+    """
+    Make a list of count distinct names, starting with the real ones and numbering made up ones after that
+    :param base: The real names
+    :param count: The number of names wanted
+    :return names: A list of count names
+    """
+    names = list(base[:count])
+    names += [f"{base[index % len(base)]} {index // len(base) + 1}" for index in range(len(base), count)]
+    return names
+
+
+def synthetic_rows(row_count, seed=0, first_policy=100000, states=None, business_types=None, expiry_days=730):
+    """
+    Generate rows with the same layout write_data expects
+    :param row_count: The number of rows to generate
+    :param seed: The seed for the random number generator, so runs are repeatable
+    :param first_policy: The policy # of the first row, the rest count up from it
+    :param states: The number of distinct states, all of the states in REGIONS if not given
+    :param business_types: The number of distinct business types, all of BUSINESS_TYPES if not given
+    :param expiry_days: The number of days the expiry dates are spread over
+    :return rows: A generator of row tuples
+    """
+    rng = random.Random(seed)
+    # Deal the states out to the regions in turn so every region has some
+    regions = list(REGIONS)
+    real_states = [state for group in itertools.zip_longest(*REGIONS.values()) for state in group if state]
+    state_names = _names(real_states, states or len(real_states))
+    state_regions = [(state, regions[index % len(regions)]) for index, state in enumerate(state_names)]
+    business_names = _names(BUSINESS_TYPES, business_types or len(BUSINESS_TYPES))
+    # Turn the dates into text once instead of once per row
+    expiries = [str(FIRST_EXPIRY + datetime.timedelta(days=day)) for day in range(expiry_days)]
+
+    for index in range(row_count):
+        state, region = rng.choice(state_regions)
+        yield (first_policy + index, rng.choice(expiries), rng.choice(LOCATIONS), state, region,
+               rng.randrange(100000, 20000000), rng.choice(CONSTRUCTION), rng.choice(business_names),
+               rng.randrange(2), rng.randrange(2))
+
+
+def write_workbook(path, rows):
+    """
+    Write rows to a workbook laid out exactly like data.xlsx: the same header, the policy # as text, the expiry as a
+    date, and 0 or 1 in the earthquake and flood columns. The workbook is written in write-only mode so rows are
+    streamed to the file instead of being held in memory.
+    :param path: The path of the workbook to write
+    :param rows: An iterable of row tuples, such as synthetic_rows returns
+    :return row_count: The number of rows written
+    """
+    # Imported here so generating rows does not need openpyxl
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(HEADER)
+    row_count = 0
+    for row in rows:
+        expiry = datetime.datetime.strptime(row[1], "%Y-%m-%d")
+        sheet.append((str(row[0]), expiry) + row[2:])
+        row_count += 1
+    workbook.save(path)
+    return row_count
+
+
+def write_database(path, rows, batch_size=5000):
+    """
+    Write rows to a sqlite database with the same tables, indexes, and rollups the viewer uses
+    :param path: The path of the database to write
+    :param rows: An iterable of row tuples, such as synthetic_rows returns
+    :param batch_size: The number of rows to send to sqlite at a time
+    :return row_count: The number of rows written
+    """
+    from database import Database
+
+    with Database(path) as database:
+        return database.write_data(rows, batch_size=batch_size)
+
+
+def main():
+    """
+    Parse the command line and write the synthetic data
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=("xlsx", "sqlite"), help="Write a workbook or a sqlite database")
+    parser.add_argument("path", help="The file to write")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-policy", type=int, default=100000)
+    parser.add_argument("--states", type=int, help="The number of distinct states")
+    parser.add_argument("--business-types", type=int, help="The number of distinct business types")
+    parser.add_argument("--expiry-days", type=int, default=730, help="The number of days expiry dates are spread over")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f'{args.path} already exists')
+    rows = synthetic_rows(args.rows, seed=args.seed, first_policy=args.first_policy, states=args.states,
+                          business_types=args.business_types, expiry_days=args.expiry_days)
+    write = write_workbook if args.kind == "xlsx" else write_database
+    start = time.perf_counter()
+    row_count = write(args.path, rows)
+    print(f'Wrote {row_count} rows to {args.path} in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,849 @@
+"""
+The Tk window for exploring the insurance data. It is kept apart from main.py so the command line tools never have to
+import tkinter.
+"""
+import os
+import tkinter as tk
+from tkinter import *
+from tkinter import filedialog, messagebox, ttk
+import instrumentation
+from database import PREFIX_SEARCH_FIELDS, ROLLUP_FIELDS, SEARCH_FIELDS, Database, normalize_expiry
+from ingest import sync_excel
+from paging import PagedResult
+from query_builder import And, Condition
+from query_worker import QueryWorker
+from virtual_table import VirtualTable, format_row
+
+# The fields that hold numbers, so range bounds typed for them are compared as numbers
+NUMBER_FIELDS = ("policy", "insurance_value")
+# The most values a dropdown menu shows, fields with more are searched instead
+MENU_LIMIT = 40
+# How long, in milliseconds, typing has to pause before the search box looks up matches
+SEARCH_DELAY = 150
+# How often, in milliseconds, the stats pane is refreshed
+STATS_INTERVAL = 500
+# The lines of the stats pane, each showing the most recent call to the methods starting with its prefixes
+STATS_LINES = (("query", ("Database.", "ColumnarDatabase.", "ServiceClient.")), ("pages", "PagedResult."),
+               ("draw", "VirtualTable."), ("import", "DbBrowser._import_excel"))
+
+
+class DbBrowser:
+    """
+    Overall class to manage the insurance viewer behavior
+
+    Attributes:
+
+    - data :    :class:`paging.PagedResult` --> All of the data from the sqlite database, read a page at a time
+    - database :    :class:`database.Database` --> An instance of the database class, a columnar.ColumnarDatabase loaded from it, or a service.ServiceClient attached to a query service
+    - entry_count :    :class:`tkinter.Label` --> The label that displays how many results are showing
+    - entry_count_label :    :class:`tkinter.Label` --> The label that labels the entry count
+    - export_button :    :class:`tkinter.Button` --> The button that exports the rows being shown to a file
+    - export_worker :    :class:`query_worker.QueryWorker` --> Runs exports in the background without holding up the filter queries, or None before the first export
+    - entry_count_var :    :class:`tkinter.StringVar` --> The variable of the entry count, allowing for the label to be changed
+    - field_mapping :    :class:`dict` --> A dictionary to easily take the table's column and get the sqlite field equivalent
+    - filter_description_var :    :class:`tkinter.StringVar` --> The variable of the label describing the stacked filters
+    - filter_stack :    :class:`list` --> The query_builder conditions added with the Add Filter and Add Range buttons
+    - filtered_data :    :class:`paging.PagedResult` --> The data that has been filtered based on the selected filters, read a page at a time, or a columnar.RowView with the columnar engine
+    - page_worker :    :class:`query_worker.QueryWorker` --> Reads the pages scrolled to in the background, so dragging the scroll bar never waits on a query
+    - primary_filter :    :class:`tkinter.StringVar` --> String variable for the primary filter
+    - primary_filter_label :    :class:`tkinter.Label` --> Label for the primary filter
+    - primary_filter_menu :    :class:`tkinter.OptionMenu` --> The drop down menu allowing users to select a filter
+    - range_high :    :class:`tkinter.Entry` --> The entry for the upper bound of a range filter
+    - range_low :    :class:`tkinter.Entry` --> The entry for the lower bound of a range filter
+    - query_worker :    :class:`query_worker.QueryWorker` --> Runs the filter queries in the background
+    - root :    :class:`tk.Tk` --> Instance of tk
+    - search_entry :    :class:`tkinter.Entry` --> The box that replaces the secondary filter for fields with too many values for a menu
+    - search_field :    :class:`str` --> The field the search box is searching, or None while the dropdown menu is shown
+    - search_list :    :class:`tkinter.Listbox` --> The matches for what has been typed in the search box
+    - search_var :    :class:`tkinter.StringVar` --> The text typed in the search box
+    - stats_var :    :class:`tkinter.StringVar` --> The text of the stats pane, or None when instrumentation is off
+    - secondary_filter :    :class:`tkinter.StringVar` --> The string variable for the secondary filter
+    - secondary_filter_label :    :class:`tkinter.Label` --> The label for the secondary filter
+    - secondary_filter_menu :    :class:`tkinter.OptionMenu` --> The drop down menu for the secondary filter
+    - secondary_menu_options :    :class:`list` --> A list containing the possible options for the secondary filter
+    - sort_descending :    :class:`bool` --> True if the table is sorted from largest to smallest
+    - sort_field :    :class:`str` --> The SQLite field the table is sorted by
+    - summary_button :    :class:`tkinter.Button` --> The button that opens the summary panel
+    - summary_field :    :class:`tkinter.StringVar` --> The field the summary panel is grouped by
+    - summary_mapping :    :class:`dict` --> Maps the names shown in the summary panel to the fields with rollups
+    - summary_table :    :class:`tkinter.ttk.Treeview` --> The table of totals in the summary panel
+    - summary_window :    :class:`tkinter.Toplevel` --> The summary panel, or None if it has not been opened
+    - table :    :class:`tkinter.ttk.Treeview` --> A treeview instance that is used to create a table
+    - title_label :    :class:`tkinter.Label` --> A label that titles the screen
+    - virtual_table :    :class:`virtual_table.VirtualTable` --> Keeps only the visible rows of the data in the table
+
+    Methods:
+    - _import_excel() --> Import data from the excel file. convert y/n to 1/0
+    - _update_db(db_name) --> Create an instance of Database, pull data from the excel file to ensure the most up-to-date data, store the data in the database
+    - _window_setup() --> Set up basic parts of the TKinter window, such as the window title, the size, and resizeability
+    - _display_tkinter_widgets() --> Display all of the tkinter widgets, including labels, the drop down menus, and the table
+    - _export_data() --> Ask for a file and write the rows being shown to it
+    - _export_done(path, row_count) --> Tell the user an export finished
+    - _export_failed(error) --> Tell the user an export failed
+    - _summary_panel() --> Open a window that totals the policies and insured values for each group of a field
+    - _update_summary(*args) --> Read the rollup for the field selected in the summary panel
+    - _show_summary(field, rollup) --> Fill the summary panel's table with a rollup
+    - _filter_widgets() --> Set up the two filter widgets
+    - _stack_widgets() --> Set up the widgets that add filters together
+    - _add_filter() --> Add the selected filter to the stack of filters
+    - _add_range() --> Add a range on the primary filter's field to the stack of filters
+    - _clear_filters() --> Remove every stacked filter
+    - _describe_filters() --> Show the stacked filters in words
+    - _update_second_dropdown(*args) --> When a primary filter is selected, update the options of the secondary filter.
+    - _set_secondary_options(options) --> Fill the secondary filter's dropdown menu with the options for the selected primary filter
+    - _search_widgets() --> Set up the search box and its list of matches
+    - _show_search(field) --> Replace the secondary filter's dropdown menu with the search box
+    - _schedule_search(*args) --> Look up matches once typing in the search box pauses
+    - _search() --> Look up the values matching the search box in the background
+    - _show_matches(matches) --> Show the matches for the search box under it
+    - _pick_match(event) --> Filter on the match picked from the list, or the first match when Enter is pressed
+    - _hide_matches(event) --> Hide the list of matches
+    - _update_data(*args) --> Update the table to show the filtered data
+    - _show_data(result) --> Show the result of a filter query in the table
+    - _update_stats() --> Show the time the latest query, page read, and draw took in the stats pane
+    - _show_loading(loading) --> Show that queries are running by changing the cursor and the entry count
+    - _selected_filter() --> Get the SQLite field and value picked in the filter dropdown menus
+    - _current_query() --> Combine the stacked filters with the one picked in the dropdown menus
+    - _sort_table(column) --> Sort the table by a column when its heading is clicked
+    - _create_table_rows(data) --> Generate rows for the treeview table
+    - _load_pages(rows, start, stop) --> Read the pages of the rows scrolled to in the background
+    - _show_pages(rows, pages) --> Draw the rows scrolled to once their pages have been read
+    - _data_table(data) --> Draw the data table
+    """
+    def __init__(self, engine="sqlite", service=None, db_name="insurance_data.db"):
+        if service:
+            # Attach to a query service, which has already imported the data and shares its cache with other viewers
+            from service import ServiceClient
+            self.database = ServiceClient(service)
+        else:
+            # Put the current version of data.xlsx into the database
+            self._update_db(db_name)
+        # Answer queries from NumPy arrays in memory instead of sqlite if asked to
+        if engine == "columnar":
+            # Imported here so NumPy is only loaded when it is used
+            from columnar import ColumnarDatabase
+            self.database = ColumnarDatabase(self.database)
+        # Sort by the order the rows were added in until a column heading is clicked
+        self.sort_field = "insurance_id"
+        self.sort_descending = False
+        # Page through the data from the insurance table rather than reading all of it into memory
+        self.data = PagedResult(self.database)
+        self.filtered_data = None
+        # Initialize things such as screen size, window title, and resizability
+        self._window_setup()
+        # Run queries in the background so the window never freezes waiting on the db
+        self.query_worker = QueryWorker(self.root, self.database, on_busy=self._show_loading)
+        # Pages get a worker of their own, so scrolling is not held up by a filter query and does not show as loading
+        self.page_worker = QueryWorker(self.root, self.database)
+        # Display all of the tkinter widgets
+        self._display_tkinter_widgets()
+        # Main tkinter loop
+        self.root.mainloop()
+        # Close the database connections once the window is closed
+        self.query_worker.stop()
+        self.page_worker.stop()
+        if self.export_worker is not None:
+            self.export_worker.stop()
+        self.database.close()
+
+    def _import_excel(self):
+        """
+        Import data from the excel file. convert y/n to 1/0. Only the rows that changed since the last import are
+        written, and nothing is parsed at all if the file has not changed.
+        :return None:
+        """
+        excel_file = os.path.join(os.getcwd(), "data.xlsx")
+        sync_excel(self.database, excel_file)
+
+    def _update_db(self, db_name):
+        """
+        Create an instance of Database, pull data from the excel file to ensure the most up-to-date data, store the data in the database
+        :param db_name: The database file to open
+        :return None:
+        """
+        # Create and store an instance of the Database class
+        self.database = Database(db_name)
+        # Bring the insurance table up to date with the Excel data
+        self._import_excel()
+
+    def _window_setup(self):
+        """
+        Set up basic parts of the TKinter window, such as the window title, the size, and resizeability
+        :return None:
+        """
+        # Create an instance of TKinter
+        self.root = tk.Tk()
+        # Set the title of the window
+        self.root.title("CISP253 - Final Project")
+        # Set the size of the window
+        self.root.minsize(width=1280, height=720)
+        # Remove the ability to resize the window because I used absolute coords to place the scroll bar for the data
+        self.root.resizable(width=0, height=0)
+
+    def _display_tkinter_widgets(self):
+        """
+        Display all of the tkinter widgets, including labels, the drop down menus, and the table
+        :return None:
+        """
+        root = self.root
+
+        # Create a label for the window
+        self.title_label = tk.Label(root, text="Insurance Data Viewer", font=("Helvetica", 42, "bold"))
+        # Place the label at the top middle of the screen
+        self.title_label.pack(side="top", pady=20)
+
+        # Draw the dropdown menus
+        self._filter_widgets()
+
+        # Draw the number of entries labels
+        self.entry_count_label = tk.Label(root, text="# of Entries", font=("Helvetica", 16))
+        self.entry_count_label.place(x=1000, y=170)
+
+        # Draw the number of entries
+        self.entry_count_var = tk.StringVar()
+        self.entry_count_var.set(str(len(self.data)))
+        self.entry_count = tk.Label(root, textvariable=self.entry_count_var, font=("Helvetica", 12, "bold"))
+        self.entry_count.place(x=1045, y=200)
+
+        # Draw the stats pane next to the number of entries, only when the program is timing itself
+        self.stats_var = None
+        if instrumentation.recorder is not None:
+            self.stats_var = tk.StringVar()
+            stats = tk.Label(root, textvariable=self.stats_var, font=("Courier", 9), justify="left")
+            stats.place(x=1130, y=165)
+            self._update_stats()
+
+        # Draw the button that opens the summary panel
+        self.summary_window = None
+        self.summary_button = tk.Button(root, text="Summary", font=("Helvetica", 12), command=self._summary_panel)
+        self.summary_button.place(x=1000, y=250, width=120)
+
+        # Draw the button that exports the rows being shown
+        self.export_worker = None
+        self.export_button = tk.Button(root, text="Export", font=("Helvetica", 12), command=self._export_data)
+        self.export_button.place(x=1140, y=250, width=120)
+
+        # Draw the data table
+        self._data_table()
+
+    def _export_data(self):
+        """
+        Ask for a file and write the rows being shown to it, in the order they are sorted. The rows are streamed from
+        the database in the background, so the window keeps working however many rows there are.
+        :return None:
+        """
+        path = filedialog.asksaveasfilename(parent=self.root, title="Export", defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"),
+                                                       ("Parquet", "*.parquet")])
+        if not path:
+            return
+        field, value = self._current_query()
+        order_by, descending = self.sort_field, self.sort_descending
+
+        # Exports get a worker of their own so a long export does not hold up the filter queries
+        if self.export_worker is None:
+            self.export_worker = QueryWorker(self.root, self.database)
+        # Exporting to the same file again replaces the earlier export
+        self.export_worker.submit(path, lambda: self.database.export_data(path, field, value, order_by=order_by,
+                                                                          descending=descending),
+                                  lambda row_count: self._export_done(path, row_count), self._export_failed)
+
+    def _export_done(self, path, row_count):
+        """
+        Tell the user an export finished
+        :param path: The file that was written
+        :param row_count: The number of rows written
+        :return None:
+        """
+        messagebox.showinfo("Export", f"Exported {row_count:,} rows to {os.path.basename(path)}", parent=self.root)
+
+    def _export_failed(self, error):
+        """
+        Tell the user an export failed
+        :param error: The exception the export raised
+        :return None:
+        """
+        print(f'Error ocured - {error}')
+        messagebox.showerror("Export", f"The export failed: {error}", parent=self.root)
+
+    def _summary_panel(self):
+        """
+        Open a window that totals the policies and insured values for each state, region, construction type, business
+        type, or earthquake and flood coverage. The totals come from the rollup tables, so they show up instantly no
+        matter how many rows there are.
+        :return None:
+        """
+        # Bring the window to the front if it is already open
+        if self.summary_window is not None and self.summary_window.winfo_exists():
+            self.summary_window.lift()
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("Summary")
+        self.summary_window = window
+
+        # Only the fields that have rollups can be summarized
+        self.summary_mapping = {name: field for name, field in self.field_mapping.items() if field in ROLLUP_FIELDS}
+        self.summary_field = tk.StringVar(window)
+        self.summary_field.set("State")
+        self.summary_field.trace_add("write", self._update_summary)
+        summary_menu = tk.OptionMenu(window, self.summary_field, *self.summary_mapping.keys())
+        summary_menu.pack(side="top", pady=10)
+
+        self.summary_table = ttk.Treeview(window, height=15,
+                                          columns=("Policies", "Total Insured", "Average", "Min", "Max"))
+        self.summary_table.column("#0", width=140, anchor=CENTER)
+        self.summary_table.heading("#0", text="Group")
+        for col in self.summary_table["columns"]:
+            self.summary_table.column(col, width=120, anchor=CENTER)
+            self.summary_table.heading(col, text=col)
+        self.summary_table.pack(fill="both", expand=True, padx=10, pady=10)
+
+        self._update_summary()
+
+    def _update_summary(self, *args):
+        """
+        Read the rollup for the field selected in the summary panel
+        :param args:
+        :return None:
+        """
+        field = self.summary_mapping[self.summary_field.get()]
+        self.query_worker.submit("summary", lambda: self.database.read_rollup(field),
+                                 lambda rollup: self._show_summary(field, rollup))
+
+    def _show_summary(self, field, rollup):
+        """
+        Fill the summary panel's table with a rollup
+        :param field: The field the rollup is grouped by
+        :param rollup: A list of (value, count, sum, min, max) tuples
+        :return None:
+        """
+        # The panel may have been closed while the rollup was being read
+        if self.summary_window is None or not self.summary_window.winfo_exists():
+            return
+        table = self.summary_table
+        table.delete(*table.get_children())
+        for value, count, total, low, high in rollup:
+            # Show the binary earthquake and flood groups as yes/no like the filters do
+            if field == "earthquake" or field == "flood":
+                value = "Yes" if value == 1 else "No"
+            average = total // count if count else 0
+            table.insert("", "end", text=value, values=tuple("" if number is None else f"{number:,}"
+                                                             for number in (count, total, average, low, high)))
+
+    def _filter_widgets(self):
+        """
+        Set up the two filter widgets
+        :return None:
+        """
+        root = self.root
+
+        # Dictionary mapping table column names to SQLite fields
+        self.field_mapping = {
+            "All": "*",
+            "Policy": "policy",
+            "Expiry": "expiry",
+            "Location": "location",
+            "State": "state",
+            "Region": "region",
+            "Insured Value": "insurance_value",
+            "Construction": "construction",
+            "Business Type": "business_type",
+            "Earthquake": "earthquake",
+            "Flood": "flood"
+        }
+        # Create and set up the primary dropdown menu
+        self.primary_filter = StringVar(root)
+        self.primary_filter.set("All")
+        self.primary_filter.trace_add("write", self._update_second_dropdown)
+        self.primary_filter_menu = OptionMenu(root, self.primary_filter, *self.field_mapping.keys())
+        self.primary_filter_menu.place(x=180, y=200, width=165)
+
+        # Create and set up the second dropdown menu
+        self.secondary_filter = tk.StringVar()
+        self.secondary_filter.trace_add("write", self._update_data)
+        self.secondary_filter_menu = tk.OptionMenu(root, self.secondary_filter, "")
+        self.secondary_filter_menu.place(x=550, y=200, width=195)
+
+        # Create a label for the primary filter
+        self.primary_filter_label = tk.Label(root, text="Select First Filter", font=("Helvetica", 16))
+        # Place the label above the primary filter menu
+        self.primary_filter_label.place(x=180, y=170)
+
+        # Create a label for the secondary filter
+        self.secondary_filter_label = tk.Label(root, text="Select Second Filter", font=("Helvetica", 16))
+        # Place the label above the secondary filter menu
+        self.secondary_filter_label.place(x=550, y=170)
+
+        # Set up the search box that stands in for the secondary filter on fields with too many values
+        self._search_widgets()
+
+        # Draw the widgets that stack filters together
+        self._stack_widgets()
+
+    def _stack_widgets(self):
+        """
+        Set up the widgets that add filters together. Add Filter keeps the filter picked in the dropdown menus, Add
+        Range keeps a range on the primary filter's field, and the table shows the rows matching all of them.
+        :return None:
+        """
+        root = self.root
+        self.filter_stack = []
+
+        # Draw the button that keeps the filter picked in the dropdown menus
+        add_filter_button = tk.Button(root, text="Add Filter", font=("Helvetica", 12), command=self._add_filter)
+        add_filter_button.place(x=760, y=198, width=120)
+
+        # Draw the range entries and the button that adds them
+        range_label = tk.Label(root, text="Range", font=("Helvetica", 12))
+        range_label.place(x=180, y=250)
+        self.range_low = tk.Entry(root)
+        self.range_low.place(x=240, y=252, width=140)
+        to_label = tk.Label(root, text="to", font=("Helvetica", 12))
+        to_label.place(x=390, y=250)
+        self.range_high = tk.Entry(root)
+        self.range_high.place(x=420, y=252, width=140)
+        add_range_button = tk.Button(root, text="Add Range", font=("Helvetica", 12), command=self._add_range)
+        add_range_button.place(x=580, y=248, width=120)
+
+        # Draw the button that removes every stacked filter
+        clear_button = tk.Button(root, text="Clear Filters", font=("Helvetica", 12), command=self._clear_filters)
+        clear_button.place(x=760, y=248, width=120)
+
+        # Draw the description of the stacked filters
+        self.filter_description_var = tk.StringVar()
+        filter_description = tk.Label(root, textvariable=self.filter_description_var, font=("Helvetica", 11),
+                                      wraplength=900, justify="left")
+        filter_description.place(x=180, y=300)
+        self._describe_filters()
+
+    def _add_filter(self):
+        """
+        Add the filter picked in the dropdown menus to the stack of filters. Picking another value of a field that is
+        already stacked matches either value.
+        :return None:
+        """
+        field, value = self._selected_filter()
+        if field == "*" or value == "":
+            return
+        for index, condition in enumerate(self.filter_stack):
+            # Merge the value into the field's existing equality filter, turning it into an IN filter
+            if condition.field == field and condition.operator in ("=", "IN"):
+                values = (condition.value,) if condition.operator == "=" else condition.value
+                if value not in values:
+                    self.filter_stack[index] = Condition(field, "IN", values + (value,))
+                break
+        else:
+            self.filter_stack.append(Condition(field, "=", value))
+        self._describe_filters()
+        # Go back to every row, which redraws the table with the stacked filters
+        self.primary_filter.set("All")
+
+    def _add_range(self):
+        """
+        Add a range on the primary filter's field to the stack of filters. Either end of the range can be left blank.
+        :return None:
+        """
+        field = self.field_mapping[self.primary_filter.get()]
+        if field == "*":
+            return
+        bounds = []
+        for entry in (self.range_low, self.range_high):
+            bound = entry.get().strip()
+            # Match the way the values are stored, so the comparison is not made against text
+            if bound and field == "expiry":
+                bound = normalize_expiry(bound)
+            elif bound and field in NUMBER_FIELDS:
+                try:
+                    bound = int(bound.replace(",", ""))
+                except ValueError as error:
+                    print(f'Error ocured - {error}')
+                    return
+            bounds.append(bound)
+        low, high = bounds
+        if low != "" and high != "":
+            self.filter_stack.append(Condition(field, "BETWEEN", (low, high)))
+        elif low != "":
+            self.filter_stack.append(Condition(field, ">=", low))
+        elif high != "":
+            self.filter_stack.append(Condition(field, "<=", high))
+        else:
+            return
+        self.range_low.delete(0, "end")
+        self.range_high.delete(0, "end")
+        self._describe_filters()
+        self._update_data()
+
+    def _clear_filters(self):
+        """
+        Remove every stacked filter
+        :return None:
+        """
+        self.filter_stack = []
+        self._describe_filters()
+        self._update_data()
+
+    def _describe_filters(self):
+        """
+        Show the stacked filters in words, using the names of the table's columns
+        :return None:
+        """
+        if not self.filter_stack:
+            self.filter_description_var.set("")
+            return
+        names = {field: name for name, field in self.field_mapping.items()}
+        self.filter_description_var.set("Showing " + And(*self.filter_stack).describe(names))
+
+    def _update_second_dropdown(self, *args):
+        """
+        When a primary filter is selected, update the options of the secondary filter.
+        :param args:
+        :return None:
+        """
+        # Get the currently selected primary filter
+        selected_field = self.primary_filter.get()
+        # Get the SQLite field associated with the selected display name
+        sqlite_field = self.field_mapping[selected_field]
+        # The value picked for the previous field means nothing for this one, so it must not be filtered on, stacked,
+        # sorted, or exported
+        if self.secondary_filter.get() != "":
+            self.secondary_filter.set("")
+        # Fields with too many values for a menu are searched as the user types instead
+        if sqlite_field in SEARCH_FIELDS or sqlite_field in PREFIX_SEARCH_FIELDS:
+            self.query_worker.cancel("options")
+            self._show_search(sqlite_field)
+            return
+        self.search_field = None
+        self.search_entry.place_forget()
+        self._hide_matches()
+        self.secondary_filter_menu.place(x=550, y=200, width=195)
+        # If the filter is "All", disable the secondary filter
+        if selected_field == "All":
+            # Options for the previous field are no longer needed
+            self.query_worker.cancel("options")
+            self.secondary_filter_menu.config(state="disabled")
+        else:
+            # Change the binary options of earthquake and flood to the more user friendly yes/no
+            if sqlite_field == "earthquake" or sqlite_field == "flood":
+                self.query_worker.cancel("options")
+                self._set_secondary_options(["Yes", "No"])
+            else:
+                # Pull the unique values for the field from the database without blocking the window
+                self.query_worker.submit("options", lambda: self.database.read_unique_data(sqlite_field),
+                                         self._set_secondary_options)
+
+    def _set_secondary_options(self, options):
+        """
+        Fill the secondary filter's dropdown menu with the options for the selected primary filter
+        :param options: A list of the values to show in the menu
+        :return None:
+        """
+        # A field with more values than fit in a menu is searched instead, so every value can still be picked
+        if len(options) > MENU_LIMIT:
+            self._show_search(self.field_mapping[self.primary_filter.get()])
+            return
+        self.secondary_menu_options = options
+
+        # Enable the second dropdown menu and update its options
+        self.secondary_filter_menu.config(state="normal")
+
+        # Sort the values alphabetically, blank values from empty Excel cells go first
+        self.secondary_menu_options.sort(key=lambda value: (value is not None, value))
+
+        # Update the options
+        # Retrieve the menu object
+        menu = self.secondary_filter_menu["menu"]
+        # Clear the existing options in the menu
+        menu.delete(0, "end")
+        # Loop over the unique values
+        for value in self.secondary_menu_options:
+            #  Associate each menu option with the self.secondary_filter and set its value to the current value.
+            #  This is a way to update the variable (self.secondary_filter) when an option is selected from the
+            #  dropdown menu
+            menu.add_command(label=value, command=tk._setit(self.secondary_filter, value))
+
+    def _search_widgets(self):
+        """
+        Set up the search box and its list of matches. They are only placed on screen while the primary filter is a
+        field with too many values for a menu.
+        :return None:
+        """
+        root = self.root
+        self._search_job = None
+        self.search_field = None
+        self.search_var = tk.StringVar(root)
+        self.search_var.trace_add("write", self._schedule_search)
+        self.search_entry = tk.Entry(root, textvariable=self.search_var)
+        self.search_entry.bind("<Return>", self._pick_match)
+        self.search_entry.bind("<Down>", lambda event: self.search_list.focus_set())
+        self.search_entry.bind("<Escape>", self._hide_matches)
+        self.search_list = tk.Listbox(root, activestyle="none", exportselection=False)
+        self.search_list.bind("<<ListboxSelect>>", self._pick_match)
+        self.search_list.bind("<Return>", self._pick_match)
+        self.search_list.bind("<Escape>", self._hide_matches)
+
+    def _show_search(self, field):
+        """
+        Replace the secondary filter's dropdown menu with the search box
+        :param field: The SQLite field to search
+        :return None:
+        """
+        self.search_field = field
+        self.secondary_filter_menu.place_forget()
+        self.search_entry.place(x=550, y=202, width=195)
+        self.search_var.set("")
+        self.search_entry.focus_set()
+
+    def _schedule_search(self, *args):
+        """
+        Look up matches once typing in the search box pauses, so a search is not run for every key pressed
+        :param args:
+        :return None:
+        """
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(SEARCH_DELAY, self._search)
+
+    def _search(self):
+        """
+        Look up the values matching the search box in the background, replacing any search that is still running
+        :return None:
+        """
+        self._search_job = None
+        field = self.search_field
+        if field is None:
+            return
+        text = self.search_var.get()
+        self.query_worker.submit("search", lambda: self.database.search_values(field, text), self._show_matches)
+
+    def _show_matches(self, matches):
+        """
+        Show the matches for the search box in a list under it
+        :param matches: A list of the matching values, most common first
+        :return None:
+        """
+        self.search_list.delete(0, "end")
+        if not matches:
+            self._hide_matches()
+            return
+        for value in matches:
+            self.search_list.insert("end", value)
+        self.search_list.config(height=min(len(matches), 10))
+        self.search_list.place(x=550, y=226, width=195)
+        # Draw the list over the range entries below the search box
+        self.search_list.lift()
+
+    def _pick_match(self, event=None):
+        """
+        Filter on the match picked from the list, or the first match when Enter is pressed in the search box
+        :param event: The Tk event that picked the match
+        :return None:
+        """
+        selection = self.search_list.curselection()
+        if selection:
+            value = self.search_list.get(selection[0])
+        elif self.search_list.size():
+            value = self.search_list.get(0)
+        else:
+            return
+        # Show the value in the box without searching for it again
+        self.search_var.set(value)
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+            self._search_job = None
+        self._hide_matches()
+        self.search_entry.focus_set()
+        self.secondary_filter.set(value)
+
+    def _hide_matches(self, event=None):
+        """
+        Hide the list of matches
+        :param event: The Tk event that closed the list
+        :return None:
+        """
+        self.search_list.selection_clear(0, "end")
+        self.search_list.place_forget()
+
+    def _update_data(self, *args):
+        """
+        Update the table to show the filtered data
+        :param args:
+        :return None:
+        """
+        field, value = self._current_query()
+        order_by, descending = self.sort_field, self.sort_descending
+
+        def query():
+            # The columnar engine can hand back positions into the rows it already holds instead of copying pages
+            if hasattr(self.database, "view"):
+                return self.database.view(field, value, order_by=order_by, descending=descending)
+            # Only the pages of the result that are on screen are read from the db
+            result = PagedResult(self.database, field, value, order_by=order_by, descending=descending)
+            # Read the first page here too, so the main loop does not have to wait for it
+            result[0:self.virtual_table.visible_rows]
+            return result
+
+        # Run the query in the background, replacing any query for an older selection
+        self.query_worker.submit("data", query, self._show_data)
+
+    def _show_data(self, result):
+        """
+        Show the result of a filter query in the table
+        :param result: The paging.PagedResult or columnar.RowView for the selected filters
+        :return None:
+        """
+        self.filtered_data = result
+        # If the table exists
+        if self.table:
+            # Point the table at the new rows
+            self._create_table_rows(self.filtered_data)
+            # Set the entry count based on how many rows are found
+            self.entry_count_var.set(str(len(self.filtered_data)))
+
+    def _update_stats(self):
+        """
+        Show how long the latest query, page read, draw, and import took in the stats pane, then check again soon
+        :return None:
+        """
+        lines = []
+        for label, prefix in STATS_LINES:
+            last = instrumentation.recorder.last(prefix)
+            lines.append(f"{label:<7}" + ("-" if last is None else f"{last[1] * 1e3:8.1f} ms"))
+        self.stats_var.set("\n".join(lines))
+        self.root.after(STATS_INTERVAL, self._update_stats)
+
+    def _show_loading(self, loading):
+        """
+        Show that queries are running by changing the cursor and the entry count
+        :param loading: True while queries are running, False once they are done
+        :return None:
+        """
+        self.root.config(cursor="watch" if loading else "")
+        if loading:
+            self.entry_count_var.set("Loading...")
+        else:
+            shown = self.data if self.filtered_data is None else self.filtered_data
+            self.entry_count_var.set(str(len(shown)))
+
+    def _selected_filter(self):
+        """
+        Get the SQLite field and value picked in the filter dropdown menus
+        :return selected: A tuple of (field, value), the field is "*" when every row should be shown
+        """
+        field = self.field_mapping[self.primary_filter.get()]
+        # Until a value is picked for the field, every row is shown
+        if self.secondary_filter.get() == "":
+            return "*", None
+        # if the secondary filter is "yes", replace it with 1 (the db value) and "no" with 0
+        if self.secondary_filter.get() == "Yes":
+            return field, 1
+        elif self.secondary_filter.get() == "No":
+            return field, 0
+        # Otherwise, just use the value of the selected filter
+        return field, self.secondary_filter.get()
+
+    def _current_query(self):
+        """
+        Combine the stacked filters with the one picked in the dropdown menus
+        :return selected: A tuple of (field, value) that can be passed to the database, the field is a query_builder
+        query when filters are stacked
+        """
+        field, value = self._selected_filter()
+        if not self.filter_stack:
+            return field, value
+        conditions = list(self.filter_stack)
+        if field != "*" and value != "":
+            conditions.append(Condition(field, "=", value))
+        return And(*conditions), None
+
+    def _sort_table(self, column):
+        """
+        Sort the table by a column when its heading is clicked. Clicking the same heading again reverses the order.
+        The sorting is done by SQLite, so only the rows on screen are ever read.
+        :param column: The name of the column that was clicked
+        :return None:
+        """
+        field = "insurance_id" if column == "#0" else self.field_mapping[column]
+        if field == self.sort_field:
+            self.sort_descending = not self.sort_descending
+        else:
+            self.sort_field = field
+            self.sort_descending = False
+
+        # Put an arrow on the heading of the sorted column
+        for col in ("#0",) + tuple(self.table["columns"]):
+            text = "#" if col == "#0" else col.title()
+            if col == column:
+                text += " ▼" if self.sort_descending else " ▲"
+            self.table.heading(col, text=text)
+
+        self._update_data()
+
+    def _create_table_rows(self, data):
+        """
+        Generate rows for the treeview table. Only the rows that fit on screen are turned into Treeview items, and they
+        are refilled from the data as the table is scrolled.
+        :param data: a list of tuples
+        :return None:
+        """
+        self.virtual_table.set_rows(data)
+
+    def _load_pages(self, rows, start, stop):
+        """
+        Read the pages of the rows scrolled to in the background. Each new position replaces the one before it, so
+        while the scroll bar is dragged only the latest position is read.
+        :param rows: The paging.PagedResult being shown
+        :param start: The index of the first row on screen
+        :param stop: The index after the last row on screen
+        :return None:
+        """
+        numbers = rows.missing_pages(start, stop)
+        self.page_worker.submit("pages", lambda: rows.read_pages(numbers), lambda pages: self._show_pages(rows, pages))
+
+    def _show_pages(self, rows, pages):
+        """
+        Draw the rows scrolled to once their pages have been read
+        :param rows: The paging.PagedResult the pages were read for
+        :param pages: The pages, as paging.PagedResult.read_pages returns them
+        :return None:
+        """
+        rows.store_pages(pages)
+        # The table may have moved on to another result while the pages were read
+        if self.virtual_table.rows is rows:
+            self.virtual_table.refresh()
+
+    def _data_table(self):
+        """
+        Draw the data table
+        :return None:
+        """
+        # Check to see if the table exists already
+        root = self.root
+        # Calculate the number of rows that can fit in 2/5ths of the screen height
+        height_of_table = ((root.winfo_reqheight() // 5) * 2) // 5
+
+        # Create an instance of Treeview that will be used as a table
+        self.table = ttk.Treeview(root, height=height_of_table)
+        table = self.table
+
+        # Make a scroll bar for the data
+        scroll = ttk.Scrollbar(root, orient="vertical")
+        scroll.place(x=1265, y=399, height=720 - 399)
+        # Only keep as many rows in the table as fit on screen, the scroll bar moves them over the data
+        self.virtual_table = VirtualTable(table, scroll, format_row, on_missing=self._load_pages)
+
+        # Name the columns of the table
+        table['columns'] = ("Policy", "Expiry", "Location", "State", "Region", "Insured Value", "Construction",
+                            "Business Type", "Earthquake", "Flood")
+        table.column("#0", width=110, anchor=CENTER)
+        # Clicking a heading sorts the table by that column
+        table.heading("#0", text="#", command=lambda: self._sort_table("#0"))
+        for col in table["columns"]:
+            table.column(col, width=110, anchor=CENTER)
+            table.heading(col, text=col.title(), command=lambda col=col: self._sort_table(col))
+
+        # Create the rows
+        self._create_table_rows(self.data)
+
+        # Pack the table to the bottom of the screen and let it span across the x axis and fill from it's height
+        table.pack(fill="both", side="bottom")
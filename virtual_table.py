@@ -0,0 +1,171 @@
+"""
+A virtualized view over a ttk.Treeview. Only as many Treeview items as fit on screen ever exist. Scrolling refills
+those items from the underlying rows instead of inserting every row, so drawing the table takes the same time no matter
+how many rows are in the result. Rows that have to be read from the database first are drawn as placeholders, so
+dragging the scroll bar never waits on a query.
+"""
+
+# The boxes shown in the earthquake and flood columns for the 0s and 1s stored in the database
+CHECKBOXES = {0: "☐", 1: "☑"}
+# Shown in place of a row that is still being read
+PLACEHOLDER = "…"
+
+
+class VirtualTable:
+    """
+    Class to show a window of rows from a large sequence in a fixed number of Treeview items
+
+    Attributes:
+
+    - format_row :    :class:`function` --> Turns a row from the sequence into the tuple displayed in the table
+    - on_missing :    :class:`function` --> Called with the rows, start, and stop when the window is not in memory yet, or None to always read the rows straight away
+    - offset :    :class:`int` --> The index of the row shown at the top of the table
+    - rows :    :class:`collections.abc.Sequence` --> The rows being shown, anything that supports len() and slicing
+    - scrollbar :    :class:`tkinter.ttk.Scrollbar` --> The scroll bar that moves the window over the rows
+    - table :    :class:`tkinter.ttk.Treeview` --> The treeview the rows are drawn in
+    - visible_rows :    :class:`int` --> The number of rows that fit in the table
+
+    Methods:
+
+    - set_rows(rows) --> Show a new sequence of rows, starting from the top
+    - scroll_to(offset) --> Move the window so the row at offset is at the top of the table
+    - refresh() --> Draw the current window again, once the rows that were missing have been read
+    - _render() --> Fill the Treeview items with the rows in the current window
+    - _on_scrollbar(*args) --> Move the window when the scroll bar is dragged or its arrows are clicked
+    - _on_mousewheel(event) --> Move the window when the mouse wheel is turned over the table
+    - _on_key(event) --> Move the window when the arrow or page keys are pressed in the table
+    """
+
+    def __init__(self, table, scrollbar, format_row, on_missing=None):
+        self.table = table
+        self.scrollbar = scrollbar
+        self.format_row = format_row
+        self.on_missing = on_missing
+        self.rows = []
+        self.offset = 0
+        self.visible_rows = int(table.cget("height"))
+
+        # The scroll bar moves the window over the rows rather than scrolling the Treeview itself
+        scrollbar.configure(command=self._on_scrollbar)
+        # Windows and macOS report the mouse wheel as <MouseWheel>, X11 reports it as buttons 4 and 5
+        table.bind("<MouseWheel>", self._on_mousewheel)
+        table.bind("<Button-4>", self._on_mousewheel)
+        table.bind("<Button-5>", self._on_mousewheel)
+        for key in ("<Up>", "<Down>", "<Prior>", "<Next>", "<Home>", "<End>"):
+            table.bind(key, self._on_key)
+
+    def set_rows(self, rows):
+        """
+        Show a new sequence of rows, starting from the top
+        :param rows: Anything that supports len() and slicing, such as a list of tuples
+        :return None:
+        """
+        self.rows = rows
+        self.offset = 0
+        self._render()
+
+    def scroll_to(self, offset):
+        """
+        Move the window so the row at offset is at the top of the table
+        :param offset: The index of the row to show first
+        :return None:
+        """
+        # Keep the last page full instead of letting the table scroll past the end
+        last_offset = max(len(self.rows) - self.visible_rows, 0)
+        offset = min(max(int(offset), 0), last_offset)
+        if offset != self.offset:
+            self.offset = offset
+            self._render()
+
+    def refresh(self):
+        """
+        Draw the current window again, once the rows that were missing have been read
+        :return None:
+        """
+        self._render()
+
+    def _render(self):
+        """
+        Fill the Treeview items with the rows in the current window. Existing items are reused, so at most
+        visible_rows items are ever created. Rows that can only be shown without reading them, such as a
+        paging.PagedResult, are drawn as placeholders until on_missing has had them read.
+        :return None:
+        """
+        table = self.table
+        start, stop = self.offset, self.offset + self.visible_rows
+        if self.on_missing is not None and hasattr(self.rows, "window"):
+            window = self.rows.window(start, stop)
+            if window is None:
+                self.on_missing(self.rows, start, stop)
+                window = [None] * (min(stop, len(self.rows)) - start)
+        else:
+            window = self.rows[start:stop]
+        items = table.get_children()
+
+        # A highlighted item would now be showing a different row
+        table.selection_remove(table.selection())
+        for index, row in enumerate(window):
+            values = (PLACEHOLDER,) if row is None else self.format_row(row)
+            if index < len(items):
+                table.item(items[index], text=values[0], values=values[1:])
+            else:
+                table.insert("", "end", text=values[0], values=values[1:])
+        # Remove the items left over when the window is shorter than the table
+        if len(items) > len(window):
+            table.delete(*items[len(window):])
+
+        # Size and place the scroll bar's slider to match the window
+        total = len(self.rows)
+        if total:
+            self.scrollbar.set(self.offset / total, min(self.offset + self.visible_rows, total) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _on_scrollbar(self, *args):
+        """
+        Move the window when the scroll bar is dragged or its arrows are clicked
+        :param args: ("moveto", fraction) or ("scroll", count, "units" or "pages") from the scroll bar
+        :return None:
+        """
+        if args[0] == "moveto":
+            self.scroll_to(float(args[1]) * len(self.rows))
+        elif args[0] == "scroll":
+            step = self.visible_rows if args[2] == "pages" else 1
+            self.scroll_to(self.offset + int(args[1]) * step)
+
+    def _on_mousewheel(self, event):
+        """
+        Move the window when the mouse wheel is turned over the table
+        :param event: The tkinter event for the mouse wheel
+        :return str: "break" so the Treeview does not also handle the event
+        """
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.offset - 3)
+        else:
+            self.scroll_to(self.offset + 3)
+        return "break"
+
+    def _on_key(self, event):
+        """
+        Move the window when the arrow or page keys are pressed in the table
+        :param event: The tkinter event for the key press
+        :return str: "break" so the Treeview does not also handle the event
+        """
+        steps = {"Up": -1, "Down": 1, "Prior": -self.visible_rows, "Next": self.visible_rows}
+        if event.keysym == "Home":
+            self.scroll_to(0)
+        elif event.keysym == "End":
+            self.scroll_to(len(self.rows))
+        else:
+            self.scroll_to(self.offset + steps[event.keysym])
+        return "break"
+
+
+def format_row(row):
+    """
+    Turn a row from the database into the tuple displayed in the insurance table
+    :param row: A tuple from the insurance table
+    :return display_row: The row without its last 2 items, followed by checked or unchecked boxes for them
+    """
+    # Replace 1s and 0s with checked or unchecked boxes
+    return row[:-2] + (CHECKBOXES.get(row[9], row[9]), CHECKBOXES.get(row[10], row[10]))